@@ -1,39 +1,150 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import PlainTextResponse, JSONResponse
-import tempfile
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 import os
 import uuid
 import json
-from process_pdf import process_pdf_to_markdown
+import gzip
+import hashlib
+import tempfile
+import zipfile
+from process_pdf import (process_pdf_to_markdown, get_page_count, rebuild_markdown_from_words, validate_area,
+                         EXTRACTION_MODES, ADAPTIVE_LOW_DPI, DEFAULT_BLANK_THRESHOLD)
+from preprocess import parse_preprocess, DEFAULT_TARGET_X_HEIGHT
+from layout import DEFAULT_LAYOUT
+from result_cache import compute_cache_key, cache_lookup, cache_store, cache_usage
+import job_store
+from web.upload_limits import MaxBodySizeMiddleware
+from job_events import subscribe, unsubscribe, publish, format_sse, SSE_KEEPALIVE, FINAL_STATUSES
+from job_metrics import (observe_job, job_timings, process_tree_rss, QUEUE_DEPTH, ACTIVE_JOBS,
+                         JOB_WORKERS, OCR_WORKERS)
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from typing import Dict, Optional, List, Union
 import threading
 import time
+import asyncio
 import logging
-import queue
-from collections import deque
+import socket
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 app = FastAPI()
 
+# Límite de tamaño de los PDF subidos y tamaño de bloque al copiarlos
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "500")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Directorio compartido con la web (mismo volumen montado en ambos contenedores).
+# Si está definido, /process_path acepta rutas a PDF ya guardados en él
+SHARED_UPLOAD_DIR = os.environ.get("SHARED_UPLOAD_DIR")
+
+# El margen cubre las cabeceras multipart y el resto de campos del formulario
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE, paths=("/process",))
+
+# Lotes: varios PDF (o un ZIP) en una sola petición
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_MB", "2048")) * 1024 * 1024
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "500"))
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_BATCH_BYTES + UPLOAD_CHUNK_SIZE, paths=("/batch",))
+
 # Directorio para almacenar trabajos
 JOBS_DIR = os.environ.get("JOBS_DIR", "/app/jobs")
 os.makedirs(JOBS_DIR, exist_ok=True)
 
+# Procesos de OCR por trabajo cuando el cliente no indica otro valor
+DEFAULT_OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "1"))
+MAX_OCR_WORKERS = int(os.environ.get("MAX_OCR_WORKERS", str(os.cpu_count() or 1)))
+
+# Pool de procesos de OCR compartido por todos los trabajos. Se crea una vez
+# y se mantiene vivo para que cada proceso conserve su motor de OCR cargado
+# (ver ocr_backends) entre páginas y entre trabajos
+ocr_executor: Optional[ProcessPoolExecutor] = None
+ocr_executor_lock = threading.Lock()
+
+def get_ocr_executor() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos de OCR compartido, creándolo la primera vez."""
+    global ocr_executor
+    with ocr_executor_lock:
+        if ocr_executor is None:
+            # 'spawn' evita heredar por fork el estado de los hilos del servidor
+            ocr_executor = ProcessPoolExecutor(max_workers=MAX_OCR_WORKERS,
+                                               mp_context=multiprocessing.get_context("spawn"))
+        return ocr_executor
+
+# Planificador de trabajos: un número fijo de hilos por réplica consume la
+# cola acotada que comparten todas las réplicas en el almacén (job_store)
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "2"))
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", "20"))
+QUEUE_RETRY_AFTER = int(os.environ.get("QUEUE_RETRY_AFTER", "30"))  # segundos
+# Huecos de la cola que puede ocupar un lote: el resto queda para los envíos
+# individuales, que así no reciben 503 mientras se procesa un lote grande
+BATCH_MAX_QUEUED = int(os.environ.get("BATCH_MAX_QUEUED", str(max(1, MAX_PENDING_JOBS // 2))))
+
+# Réplicas: cada nodo reclama trabajos de la cola compartida con una concesión
+# de JOB_LEASE_SECONDS que renueva mientras los procesa. Si deja de renovarla
+# (el nodo ha caído), otro nodo retoma el trabajo, hasta MAX_JOB_ATTEMPTS veces
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+LEASE_RENEW_INTERVAL = JOB_LEASE_SECONDS / 4
+MAX_JOB_ATTEMPTS = int(os.environ.get("MAX_JOB_ATTEMPTS", "3"))
+# Segundos entre consultas a la cola compartida cuando no hay trabajo
+QUEUE_POLL_INTERVAL = float(os.environ.get("QUEUE_POLL_INTERVAL", "1"))
+# Segundos entre consultas al almacén en /events para los trabajos de otro nodo
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "2"))
+
+# Parámetros que cambian el Markdown generado y, por tanto, forman parte de
+# la clave de la caché de resultados (workers, por ejemplo, no la afecta)
+CACHE_PARAM_KEYS = ("dpi", "lang", "conf_threshold", "area", "areas", "mode", "adaptive", "low_dpi",
+                    "preprocess", "target_x_height", "blank_threshold", "layout")
+# Las tablas de palabras no dependen del umbral: se cachean sin él
+WORDS_CACHE_PARAM_KEYS = tuple(k for k in CACHE_PARAM_KEYS if k != "conf_threshold")
+WORDS_SUFFIX = ".words.jsonl.gz"
+
 # Estructura para almacenar información de trabajos en memoria
 # Estructura de un trabajo:
 # - id: str (UUID)
 # - status: str ("pending", "processing", "completed", "error")
 # - message: str (mensaje de error o info adicional)
 # - pdf_path: str (ruta al PDF original)
+# - owns_pdf: bool (False si el PDF está en el volumen compartido y es de la web)
 # - md_path: str (ruta al archivo Markdown generado)
+# - words_path: str (tablas de palabras de Tesseract, para cambiar el umbral sin OCR)
 # - created_at: float (timestamp de creación)
 # - updated_at: float (timestamp de última actualización)
-# - result: Optional[str] (contenido Markdown si está completado)
+# - result_size: int y result_sha256: str (del Markdown en md_path, si está completado;
+#   el contenido no se guarda en memoria, /result lo sirve desde disco)
 # - params: Dict (parámetros de configuración)
+# - cache_key: str (clave en la caché de resultados)
+# - report: Dict (informe por página: capa de texto u OCR)
+# - progress: Dict (pages_done / pages_total mientras se procesa)
+# - page_offsets: List[int] (fin en bytes de cada página ya escrita en md_path)
+# - words_cache_key: str (clave de las tablas de palabras en la caché)
+# - cache: str ("hit" si el resultado salió de la caché, "words" si se
+#   reconstruyó desde palabras cacheadas, "miss" si hubo que hacer OCR)
+# - timings: Dict (segundos de las etapas propias del servicio: upload,
+#   page_count, queue_wait, persist y total; las de conversión están en report)
+# - pages_per_second: float y peak_rss_bytes: int (del procesamiento)
+# - node: str (réplica que lo procesa o lo procesó)
+#
+# Todos los trabajos se guardan en el almacén SQLite (job_store); en memoria
+# sólo están los que este nodo está procesando (tiene su concesión)
 jobs: Dict[str, Dict] = {}
 
 # Diccionario para almacenar logs por job_id
-job_logs = {}  # Diccionario para almacenar logs por job_id
+job_logs = OrderedDict()  # Diccionario para almacenar logs por job_id
 MAX_LOG_ENTRIES = 100  # Número máximo de entradas de log por trabajo
+# Trabajos con logs en memoria: se descartan los de los trabajos más antiguos
+MAX_LOGGED_JOBS = int(os.environ.get("MAX_LOGGED_JOBS", "500"))
+# Número de entradas de log emitidas por trabajo (numera los eventos de log)
+job_log_seq: Dict[str, int] = {}
+
+# La cola está en el almacén; este evento despierta a los hilos del nodo en
+# cuanto se encola algo aquí, sin esperar a la siguiente consulta
+work_available = threading.Event()
+# Trabajos de este nodo cuya concesión ha caducado: los ha retomado otro nodo
+lost_leases = set()
+QUEUE_DEPTH.set_function(job_store.count_queued)
+OCR_WORKERS.set(MAX_OCR_WORKERS)
 
 def log_to_job(job_id, message, level="INFO"):
     """Añade un mensaje de log al registro del trabajo específico."""
@@ -43,57 +154,141 @@ def log_to_job(job_id, message, level="INFO"):
     # Inicializar la cola de logs si no existe
     if job_id not in job_logs:
         job_logs[job_id] = deque(maxlen=MAX_LOG_ENTRIES)
+        # Limitar la memoria: olvidar los logs de los trabajos más antiguos
+        while len(job_logs) > MAX_LOGGED_JOBS:
+            old_job_id, _ = job_logs.popitem(last=False)
+            job_log_seq.pop(old_job_id, None)
     
     # Añadir entrada de log
     job_logs[job_id].append(log_entry)
+    job_log_seq[job_id] = job_log_seq.get(job_id, 0) + 1
+    publish(job_id, "log", {"seq": job_log_seq[job_id], "line": log_entry})
     
     # También imprimir en la consola para debugging
     print(f"[Job {job_id}] {log_entry}")
     
     return log_entry
 
-def save_job_state(job_id: str):
-    """Guarda el estado del trabajo en disco para persistencia."""
-    job_data = jobs[job_id].copy()
-    
-    # Eliminamos el resultado del contenido a guardar si es muy grande
-    if 'result' in job_data and job_data['result'] and len(job_data['result']) > 100:
-        job_data['result'] = "STORED_SEPARATELY"  # Marcador
-        
-        # Guardar resultado en archivo separado
-        result_path = os.path.join(JOBS_DIR, f"{job_id}_result.txt")
-        with open(result_path, 'w', encoding='utf-8') as f:
-            f.write(jobs[job_id]['result'])
+def save_job_state(job_id: str, job: Optional[Dict] = None):
+    """
+    Guarda el estado del trabajo en el almacén. Por defecto se guarda el de
+    memoria (`jobs`); los trabajos que ya no están en ella se pasan en `job`.
+    Los que procesa este nodo sólo se guardan mientras conserva su concesión;
+    si la ha perdido lanza LeaseLost y el estado del almacén no se toca.
+    """
+    job = job if job is not None else jobs[job_id]
+    if job_id in jobs:
+        try:
+            job_store.save_job(job, owner=NODE_ID)
+        except job_store.LeaseLost:
+            lost_leases.add(job_id)
+            raise
+    else:
+        job_store.save_job(job)
     
-    # Guardar metadatos del trabajo
-    job_path = os.path.join(JOBS_DIR, f"{job_id}.json")
-    with open(job_path, 'w', encoding='utf-8') as f:
-        json.dump(job_data, f, ensure_ascii=False)
+    # Cada cambio de estado se guarda aquí: lo notificamos a los clientes suscritos
+    publish(job_id, "status", job_status_event(job))
 
-def load_job_state(job_id: str) -> Optional[Dict]:
-    """Carga el estado del trabajo desde disco."""
+def ensure_lease(job_id: str):
+    """
+    Prorroga la concesión de un trabajo de este nodo antes de tocar sus
+    ficheros de salida; si la ha perdido lanza LeaseLost, porque el nodo que
+    lo ha retomado puede estar renombrando o borrando esos mismos ficheros.
+    """
+    if job_id in lost_leases or not job_store.renew_lease(job_id, NODE_ID, JOB_LEASE_SECONDS):
+        lost_leases.add(job_id)
+        raise job_store.LeaseLost(job_id)
+
+def release_job(job_id: str):
+    """Saca de memoria un trabajo terminado y libera su concesión; queda sólo en el almacén."""
+    jobs.pop(job_id, None)
+    lost_leases.discard(job_id)
+    job_store.release_lease(job_id, NODE_ID)
+
+def job_status_event(job: Dict) -> Dict:
+    """Resumen del estado de un trabajo para los eventos de progreso."""
+    event = {"status": job["status"], "updated_at": job["updated_at"]}
+    if job["status"] == "pending":
+        event["queue_position"] = get_queue_position(job["id"])
+    if job.get("progress"):
+        event.update(job["progress"])
+    if job.get("message"):
+        event["message"] = job["message"]
+    return event
+
+def publish_queue_positions():
+    """Notifica la nueva posición en la cola a los trabajos que siguen esperando."""
+    for position, job_id in enumerate(job_store.queued_job_ids(), start=1):
+        publish(job_id, "status", {"status": "pending", "queue_position": position})
+
+def load_legacy_job(job_id: str) -> Optional[Dict]:
+    """
+    Importa al almacén un trabajo guardado con el formato anterior
+    (`{job_id}.json` y `{job_id}_result.txt`) y borra esos ficheros.
+    """
     job_path = os.path.join(JOBS_DIR, f"{job_id}.json")
     
-    if not os.path.exists(job_path):
+    try:
+        with open(job_path, 'r', encoding='utf-8') as f:
+            job_data = json.load(f)
+    except FileNotFoundError:
+        # Otra réplica lo ha importado entretanto
         return None
-    
-    with open(job_path, 'r', encoding='utf-8') as f:
-        job_data = json.load(f)
+    job_data.setdefault("id", job_id)
     
     # Recuperar resultado de archivo separado si es necesario
+    result_path = os.path.join(JOBS_DIR, f"{job_id}_result.txt")
     if job_data.get('result') == "STORED_SEPARATELY":
-        result_path = os.path.join(JOBS_DIR, f"{job_id}_result.txt")
         if os.path.exists(result_path):
             with open(result_path, 'r', encoding='utf-8') as f:
                 job_data['result'] = f.read()
+        else:
+            job_data['result'] = None
     
+    job_store.save_job(job_data)
+    for path in (job_path, result_path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
     return job_data
 
+@app.on_event("startup")
+def migrate_legacy_jobs():
+    """
+    Importa al almacén, una sola vez al arrancar, los trabajos que quedan con
+    el formato anterior. Así get_job es una simple lectura del almacén y los
+    endpoints no leen, escriben ni borran ficheros para buscar un trabajo.
+    """
+    imported = 0
+    for entry in os.scandir(JOBS_DIR):
+        if entry.is_file() and entry.name.endswith(".json"):
+            try:
+                if load_legacy_job(entry.name[:-len(".json")]) is not None:
+                    imported += 1
+            except (OSError, ValueError) as e:
+                print(f"No se pudo importar el trabajo {entry.name}: {e}")
+    if imported:
+        print(f"Importados {imported} trabajos con el formato anterior al almacén")
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """
+    Busca un trabajo: primero entre los activos en memoria y, si no, en el
+    almacén (sin cargarlo en memoria). Devuelve None si no existe.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        job = job_store.load_job(job_id)
+    return job
+
 def process_job(job_id: str):
     """Procesa un trabajo en segundo plano."""
     # Actualizar estado
+    started = time.time()
+    timings = jobs[job_id].setdefault("timings", {})
+    timings["queue_wait"] = started - jobs[job_id]["created_at"]
     jobs[job_id]["status"] = "processing"
-    jobs[job_id]["updated_at"] = time.time()
+    jobs[job_id]["updated_at"] = started
     save_job_state(job_id)
     
     # Obtener parámetros
@@ -102,22 +297,41 @@ def process_job(job_id: str):
     conf_threshold = params.get("conf_threshold", 60)
     lang = params.get("lang", "spa")
     area = params.get("area", None)
+    areas = params.get("areas", None)
+    workers = params.get("workers", DEFAULT_OCR_WORKERS)
+    mode = params.get("mode", "auto")
+    adaptive = params.get("adaptive", False)
+    low_dpi = params.get("low_dpi", ADAPTIVE_LOW_DPI)
+    # Trabajos anteriores al preprocesado: sin preprocesar, como se procesaban
+    preprocess = params.get("preprocess", "none")
+    target_x_height = params.get("target_x_height")
+    # Trabajos anteriores a la detección de páginas en blanco: todas con OCR
+    blank_threshold = params.get("blank_threshold", 0)
+    layout = params.get("layout", False)
     
     # Registrar inicio del procesamiento
     log_to_job(job_id, "Iniciando procesamiento del documento PDF")
-    log_to_job(job_id, f"Configuración: DPI={dpi}, LANG={lang}, THRESHOLD={conf_threshold}")
+    log_to_job(job_id, f"Configuración: DPI={dpi}, LANG={lang}, THRESHOLD={conf_threshold}, WORKERS={workers}, MODO={mode}")
     if area:
         log_to_job(job_id, f"Procesando área específica: {area}")
+    if areas:
+        log_to_job(job_id, f"Procesando áreas con nombre: {', '.join(areas)}")
+    if adaptive:
+        log_to_job(job_id, f"Modo adaptativo: primera pasada a {low_dpi} DPI")
+    if layout:
+        log_to_job(job_id, "Segmentación en bloques: los bloques manuscritos se marcan sin OCR")
     
     # Recuperar información del trabajo
     pdf_path = jobs[job_id]["pdf_path"]
     md_path = jobs[job_id]["md_path"]
+    words_path = jobs[job_id].get("words_path")
     
     try:
         # Registrar información sobre el PDF
         log_to_job(job_id, f"Documento recibido: {os.path.basename(pdf_path)}")
         
         # Intentar obtener información del PDF
+        stage_start = time.perf_counter()
         try:
             # Intentamos importar PyPDF2 o PyPDF4 según esté disponible
             pdf_module = None
@@ -143,6 +357,7 @@ def process_job(job_id: str):
                         log_to_job(job_id, f"No se pudo determinar el número de páginas: {str(e)}", "WARNING")
         except Exception as e:
             log_to_job(job_id, f"Error al analizar la estructura del PDF: {str(e)}", "WARNING")
+        timings["page_count"] = time.perf_counter() - stage_start
         
         # Registrar inicio de OCR
         log_to_job(job_id, "Iniciando proceso de OCR (reconocimiento óptico de caracteres)")
@@ -151,27 +366,86 @@ def process_job(job_id: str):
         def log_callback(message):
             return log_to_job(job_id, message)
         
+        # Progreso por página: se guarda para /status y /pages y se envía a los
+        # suscritos. También se muestrea la memoria del servicio (este proceso y
+        # el pool de OCR, compartidos con los demás trabajos en curso)
+        jobs[job_id]["page_offsets"] = []
+        jobs[job_id]["peak_rss_bytes"] = process_tree_rss()
+        def progress_callback(pages_done, total_pages, md_bytes):
+            # Sin concesión otro nodo ya ha retomado el trabajo: se abandona
+            if job_id in lost_leases:
+                raise job_store.LeaseLost(job_id)
+            jobs[job_id]["page_offsets"].append(md_bytes)
+            jobs[job_id]["progress"] = {"pages_done": pages_done, "pages_total": total_pages}
+            jobs[job_id]["peak_rss_bytes"] = max(jobs[job_id]["peak_rss_bytes"], process_tree_rss())
+            publish(job_id, "progress", jobs[job_id]["progress"])
+        
         # Llamamos a la función real de procesamiento con el callback
-        process_pdf_to_markdown(
+        stage_start = time.perf_counter()
+        report = process_pdf_to_markdown(
             input_pdf=pdf_path,
             output_md=md_path,
             dpi=dpi,
             lang=lang,
             conf_threshold=conf_threshold,
             area=area,
-            log_callback=log_callback
+            areas=areas,
+            log_callback=log_callback,
+            workers=workers,
+            words_path=words_path,
+            mode=mode,
+            adaptive=adaptive,
+            low_dpi=low_dpi,
+            preprocess=preprocess,
+            target_x_height=target_x_height,
+            blank_threshold=blank_threshold,
+            layout=layout,
+            executor=get_ocr_executor() if workers > 1 else None,
+            progress_callback=progress_callback
         )
+        conversion_seconds = time.perf_counter() - stage_start
+        jobs[job_id]["report"] = report
+        if conversion_seconds > 0:
+            jobs[job_id]["pages_per_second"] = round(report["total_pages"] / conversion_seconds, 3)
+        if mode != "ocr":
+            log_to_job(job_id, f"Páginas con capa de texto: {report['text_pages']}, páginas con OCR: {report['ocr_pages']}")
+        if report.get("blank_pages"):
+            log_to_job(job_id, f"Páginas en blanco omitidas: {report['blank_pages']}")
+        if report.get("layout"):
+            log_to_job(job_id, f"Bloques: {report['layout_blocks']}, "
+                               f"manuscritos sin OCR: {report['handwriting_blocks']}")
+        if report.get("adaptive"):
+            log_to_job(job_id, f"Regiones en segunda pasada: {report['second_pass_regions']}, "
+                               f"líneas recuperadas: {report['recovered_lines']}")
+        
+        # A partir de aquí se tocan los ficheros de salida: sólo con la concesión
+        ensure_lease(job_id)
         
-        # Leer contenido del Markdown generado
-        with open(md_path, "r", encoding="utf-8") as md_file:
-            md_content = md_file.read()
+        # Guardar el resultado en caché para futuras subidas idénticas
+        stage_start = time.perf_counter()
+        if jobs[job_id].get("cache_key"):
+            try:
+                cache_store(jobs[job_id]["cache_key"], md_path)
+                if words_path and jobs[job_id].get("words_cache_key"):
+                    cache_store(jobs[job_id]["words_cache_key"], words_path, suffix=WORDS_SUFFIX)
+            except OSError as e:
+                log_to_job(job_id, f"No se pudo guardar el resultado en caché: {str(e)}", "WARNING")
         
         # Actualizar el job con el resultado
-        log_to_job(job_id, "Proceso completado exitosamente")
+        jobs[job_id].update(finalize_result(md_path))
+        timings["persist"] = time.perf_counter() - stage_start
+        timings["total"] = time.time() - started
+        log_to_job(job_id, f"Proceso completado exitosamente ({jobs[job_id].get('pages_per_second')} páginas/s; "
+                           f"{format_stage_timings(jobs[job_id])})")
         jobs[job_id]["status"] = "completed"
-        jobs[job_id]["result"] = md_content
         jobs[job_id]["updated_at"] = time.time()
         save_job_state(job_id)
+        observe_job(jobs[job_id])
+        
+    except job_store.LeaseLost:
+        # Otro nodo ha retomado el trabajo con sus propios ficheros: este intento
+        # se abandona sin tocar el estado ni borrar nada
+        log_to_job(job_id, "Se perdió la concesión del trabajo: lo ha retomado otro nodo", "WARNING")
         
     except Exception as e:
         # En caso de error
@@ -180,40 +454,259 @@ def process_job(job_id: str):
         jobs[job_id]["status"] = "error"
         jobs[job_id]["message"] = error_msg
         jobs[job_id]["updated_at"] = time.time()
-        save_job_state(job_id)
+        timings["total"] = jobs[job_id]["updated_at"] - started
+        try:
+            ensure_lease(job_id)
+            save_job_state(job_id)
+        except job_store.LeaseLost:
+            # Los ficheros ya son del nodo que ha retomado el trabajo: no se borran
+            log_to_job(job_id, "Se perdió la concesión del trabajo: lo ha retomado otro nodo", "WARNING")
+            return
+        observe_job(jobs[job_id])
         
         # Limpieza en caso de error, pero sólo si no estamos en debug
         if os.environ.get("DEBUG") != "1":
-            if os.path.exists(pdf_path):
+            if jobs[job_id].get("owns_pdf", True) and os.path.exists(pdf_path):
                 os.unlink(pdf_path)
                 log_to_job(job_id, "Eliminado archivo PDF temporal", "INFO")
             if os.path.exists(md_path):
                 os.unlink(md_path)
                 log_to_job(job_id, "Eliminado archivo MD temporal", "INFO")
+            if words_path and os.path.exists(words_path):
+                os.unlink(words_path)
 
-@app.post("/process", response_class=JSONResponse)
-async def process_pdf(
-    file: UploadFile = File(...),
-    dpi: int = Form(300),
-    conf_threshold: int = Form(60),
-    lang: str = Form("spa"),
-    area: Optional[str] = Form(None),
-    original_filename: Optional[str] = Form(None)  # Nuevo parámetro para el nombre original
-):
-    """Inicia un nuevo trabajo de procesamiento de PDF."""
-    # Generar ID único para el trabajo
-    job_id = str(uuid.uuid4())
-    
-    # Crear archivos temporales para la entrada y salida
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf", dir=JOBS_DIR) as pdf_file:
-        # Guardar el PDF subido
-        content = await file.read()
-        pdf_file.write(content)
-        pdf_path = pdf_file.name
-    
-    # Preparar nombre para archivo de salida
-    md_path = pdf_path.replace(".pdf", ".md")
-    
+def format_stage_timings(job: Dict) -> str:
+    """Desglose de tiempos de un trabajo en una línea (para los logs)."""
+    return ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in job_timings(job).items())
+
+def save_upload(src, dest_path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """
+    Copia un fichero subido a `dest_path` por bloques, calculando a la vez su
+    SHA-256. Si supera `max_bytes` borra lo escrito y lanza un 413.
+    Devuelve el SHA-256 en hexadecimal.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, "wb") as dest:
+            while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+                digest.update(chunk)
+                dest.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.unlink(dest_path)
+        raise
+    return digest.hexdigest()
+
+def finalize_result(md_path: str) -> Dict:
+    """
+    Prepara un Markdown terminado para servirlo: calcula su tamaño y SHA-256
+    (ETag de /result) y deja a su lado una copia `.gz` para los clientes que
+    aceptan gzip, de modo que no haya que comprimir en cada descarga.
+    """
+    digest = hashlib.sha256()
+    gz_tmp = f"{md_path}.gz.tmp"
+    with open(md_path, "rb") as src, gzip.open(gz_tmp, "wb") as gz:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            gz.write(chunk)
+    os.replace(gz_tmp, f"{md_path}.gz")
+    return {"result_size": os.path.getsize(md_path), "result_sha256": digest.hexdigest()}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de ETags para If-None-Match (admite listas y '*')."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def parse_range(range_header: str, size: int) -> Optional[tuple]:
+    """
+    Interpreta una cabecera Range de un único intervalo de bytes y devuelve
+    (inicio, fin) inclusivos, o None si no es un rango que sepamos servir
+    (se responde entonces con el fichero completo). Lanza 416 si el rango
+    no es satisfacible.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start:
+            first = int(start)
+            last = int(end) if end else size - 1
+        else:
+            # Sufijo: los últimos N bytes
+            first = max(0, size - int(end))
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise HTTPException(status_code=416, detail="Rango no satisfacible",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return first, min(last, size - 1)
+
+def iter_file(path: str, start: int = 0, length: Optional[int] = None):
+    """Lee un fichero por bloques, opcionalmente sólo `length` bytes desde `start`."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(UPLOAD_CHUNK_SIZE if remaining is None else min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def enqueue_job(job_id: str) -> bool:
+    """Añade un trabajo a la cola compartida. Devuelve False si la cola está llena."""
+    if not job_store.enqueue_job(job_id, MAX_PENDING_JOBS):
+        return False
+    work_available.set()
+    return True
+
+def get_queue_position(job_id: str) -> Optional[int]:
+    """Posición (empezando en 1) de un trabajo en la cola, o None si no está en ella."""
+    return job_store.queue_position(job_id)
+
+def claim_next_job() -> Optional[str]:
+    """
+    Reclama para este nodo el siguiente trabajo de la cola compartida (o uno
+    cuyo nodo dejó de renovar la concesión) y lo carga en memoria. Devuelve
+    su id, o None si no hay trabajo. Un reintento escribe en ficheros nuevos
+    y borra los del intento anterior: si aquel nodo sigue vivo, escribe en
+    ficheros ya desvinculados y no mezcla su salida con la del nuevo.
+    """
+    job = job_store.claim_job(NODE_ID, JOB_LEASE_SECONDS, BATCH_MAX_QUEUED, MAX_JOB_ATTEMPTS)
+    if job is None:
+        return None
+    job_id = job["id"]
+    attempt = job.pop("attempts")
+    if attempt > 1:
+        for path in (job["md_path"], f"{job['md_path']}.gz", job.get("words_path")):
+            try:
+                if path:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+        job["md_path"] = os.path.join(JOBS_DIR, f"{job_id}.r{attempt}.md")
+        if job.get("words_path"):
+            job["words_path"] = os.path.join(JOBS_DIR, f"{job_id}.r{attempt}{WORDS_SUFFIX}")
+        job.pop("page_offsets", None)
+        if job.get("progress"):
+            job["progress"]["pages_done"] = 0
+    job["node"] = NODE_ID
+    lost_leases.discard(job_id)
+    jobs[job_id] = job
+    if attempt > 1:
+        log_to_job(job_id, f"Trabajo retomado por el nodo {NODE_ID} (intento {attempt}): "
+                           "el nodo anterior dejó de renovar su concesión", "WARNING")
+    return job_id
+
+def job_worker():
+    """Hilo del pool: reclama trabajos de la cola compartida y los procesa de uno en uno."""
+    while True:
+        try:
+            job_id = claim_next_job()
+        except Exception as e:
+            # Almacén bloqueado o no disponible: se reintenta en la siguiente consulta
+            print(f"Error al reclamar un trabajo de la cola: {e}")
+            job_id = None
+        if job_id is None:
+            work_available.wait(QUEUE_POLL_INTERVAL)
+            work_available.clear()
+            continue
+        publish_queue_positions()
+        try:
+            with ACTIVE_JOBS.track_inprogress():
+                process_job(job_id)
+        except Exception as e:
+            # process_job ya gestiona sus errores; esto sólo evita perder el hilo
+            print(f"Error inesperado en el trabajo {job_id}: {e}")
+        finally:
+            # Terminado (o fallido): sólo queda en el almacén
+            release_job(job_id)
+
+def fail_abandoned_jobs():
+    """Da por fallidos los trabajos que se han interrumpido MAX_JOB_ATTEMPTS veces."""
+    for job in job_store.abandoned_jobs(MAX_JOB_ATTEMPTS):
+        job["status"] = "error"
+        job["message"] = (f"El trabajo se interrumpió {MAX_JOB_ATTEMPTS} veces sin terminar "
+                          "(el nodo que lo procesaba dejó de responder)")
+        job["updated_at"] = time.time()
+        # Otro nodo puede haberlo dado por fallido (o retomado) entretanto
+        if not job_store.fail_abandoned_job(job, MAX_JOB_ATTEMPTS):
+            continue
+        if job["id"] in jobs:
+            lost_leases.add(job["id"])
+        publish(job["id"], "status", job_status_event(job))
+        observe_job(job)
+
+def lease_keeper():
+    """
+    Hilo que renueva cada LEASE_RENEW_INTERVAL las concesiones de los trabajos
+    que procesa este nodo, guardando de paso su progreso para que /status y
+    /pages respondan desde cualquier réplica, y da por fallidos los trabajos
+    abandonados demasiadas veces.
+    """
+    while True:
+        for job_id, job in list(jobs.items()):
+            try:
+                renewed = job_store.renew_lease(job_id, NODE_ID, JOB_LEASE_SECONDS,
+                                                progress=dict(job.get("progress") or {}),
+                                                page_offsets=list(job.get("page_offsets") or []))
+            except Exception as e:
+                print(f"Error al renovar la concesión del trabajo {job_id}: {e}")
+                continue
+            if not renewed and job_id in jobs:
+                lost_leases.add(job_id)
+        try:
+            fail_abandoned_jobs()
+        except Exception as e:
+            print(f"Error al revisar los trabajos abandonados: {e}")
+        time.sleep(LEASE_RENEW_INTERVAL)
+
+@app.on_event("shutdown")
+def stop_ocr_executor():
+    """Cierra el pool de procesos de OCR al parar el servidor."""
+    if ocr_executor is not None:
+        ocr_executor.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("startup")
+def start_job_workers():
+    """
+    Arranca el pool fijo de hilos que procesan la cola compartida y el hilo
+    que renueva las concesiones. Los trabajos que quedaron a medias al parar
+    el servidor (de este u otro nodo) se retoman cuando caduca su concesión.
+    """
+    threading.Thread(target=lease_keeper, name="lease-keeper", daemon=True).start()
+    JOB_WORKERS.set(MAX_CONCURRENT_JOBS)
+    for i in range(MAX_CONCURRENT_JOBS):
+        thread = threading.Thread(target=job_worker, name=f"job-worker-{i}")
+        thread.daemon = True
+        thread.start()
+
+def queue_full_response() -> JSONResponse:
+    """Respuesta 503 con Retry-After cuando la cola de trabajos está llena."""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(QUEUE_RETRY_AFTER)},
+        content={
+            "detail": "El servicio está ocupado: la cola de trabajos está llena. Inténtelo de nuevo más tarde",
+            "retry_after": QUEUE_RETRY_AFTER
+        }
+    )
+
+def build_job_params(dpi: int, conf_threshold: int, lang: str, area: Optional[str],
+                     areas: Optional[str], workers: Optional[int], mode: str,
+                     adaptive: bool, low_dpi: int, original_filename: Optional[str],
+                     preprocess: Optional[str] = None, target_x_height: Optional[int] = None,
+                     blank_threshold: Optional[float] = None, layout: Optional[bool] = None) -> Dict:
+    """Valida los parámetros del formulario y devuelve los `params` del trabajo."""
     # Procesar el área si existe
     area_coords = None
     if area:
@@ -222,12 +715,92 @@ async def process_pdf(
             if isinstance(area, str):
                 area_coords = json.loads(area)
             if isinstance(area_coords, list) and len(area_coords) == 4:
-                area_coords = tuple(int(coord) for coord in area_coords)
+                area_coords = validate_area(area_coords)
             else:
                 area_coords = None
         except (ValueError, TypeError, json.JSONDecodeError) as e:
             # En caso de error, log pero continuar sin área
             print(f"Error al procesar área: {e}")
+            area_coords = None
+    
+    # Áreas con nombre: JSON {"nombre": [left, upper, right, lower], ...}
+    named_areas = None
+    if areas:
+        try:
+            named_areas = json.loads(areas)
+            if not isinstance(named_areas, dict):
+                raise ValueError("se esperaba un objeto JSON {nombre: [l, u, r, b]}")
+            named_areas = {str(name): validate_area(box) for name, box in named_areas.items()}
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Parámetro areas no válido: {e}")
+    
+    if mode not in EXTRACTION_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo no válido: {mode} (opciones: {', '.join(EXTRACTION_MODES)})")
+    
+    # Número de procesos de OCR, limitado a los núcleos disponibles
+    if workers is None:
+        workers = DEFAULT_OCR_WORKERS
+    workers = max(1, min(workers, MAX_OCR_WORKERS))
+    
+    # Pasos de preprocesado efectivos (sin indicar, los de OCR_PREPROCESS):
+    # se guardan resueltos para que formen parte de la clave de la caché
+    try:
+        preprocess_steps = parse_preprocess(preprocess)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if target_x_height is not None and target_x_height < 8:
+        raise HTTPException(status_code=400, detail="target_x_height debe ser de al menos 8 píxeles")
+    
+    # Sensibilidad de la detección de páginas en blanco (0 la desactiva)
+    if blank_threshold is None:
+        blank_threshold = DEFAULT_BLANK_THRESHOLD
+    if not 0 <= blank_threshold < 1:
+        raise HTTPException(status_code=400, detail="blank_threshold debe estar entre 0 y 1")
+    
+    return {
+        "dpi": dpi,
+        "conf_threshold": conf_threshold,
+        "lang": lang,
+        "area": area_coords,
+        "areas": named_areas,
+        "workers": workers,
+        "mode": mode,
+        "adaptive": adaptive,
+        "low_dpi": low_dpi if adaptive else None,
+        "preprocess": ",".join(preprocess_steps) or "none",
+        "target_x_height": (target_x_height or DEFAULT_TARGET_X_HEIGHT) if "downscale" in preprocess_steps else None,
+        "blank_threshold": blank_threshold,
+        "layout": DEFAULT_LAYOUT if layout is None else layout,
+        "original_filename": original_filename  # Guardamos el nombre original
+    }
+
+def submit_job(job_id: str, pdf_path: str, pdf_digest: str, params: Dict, owns_pdf: bool = True,
+               group_id: Optional[str] = None, pages_total: Optional[int] = None,
+               timings: Optional[Dict] = None):
+    """
+    Crea el trabajo para un PDF ya disponible en `pdf_path`: lo resuelve desde
+    la caché si es posible y, si no, lo encola. Con `owns_pdf` a False el PDF
+    pertenece a otro servicio (volumen compartido) y nunca se borra desde aquí.
+
+    Los trabajos de un lote (`group_id`) no se encolan aquí: quedan pendientes
+    y entran en la cola compartida cuando un nodo reclama trabajo, sin pasar
+    de BATCH_MAX_QUEUED en cola (job_store.claim_job). `pages_total` permite
+    informar del progreso del lote antes de empezar a procesar el documento.
+    `timings` trae los tiempos ya medidos al recibir el PDF (la subida).
+
+    Es síncrona y hace E/S de ficheros y del almacén (copia desde la caché,
+    compresión del Markdown): los endpoints la llaman con run_in_threadpool.
+    """
+    def discard_pdf():
+        if owns_pdf and os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+    
+    cache_key = compute_cache_key(pdf_digest, {k: params[k] for k in CACHE_PARAM_KEYS})
+    words_cache_key = compute_cache_key(pdf_digest, {k: params[k] for k in WORDS_CACHE_PARAM_KEYS})
+    
+    # Preparar nombres de archivo para la salida
+    md_path = os.path.join(JOBS_DIR, f"{job_id}.md")
+    words_path = os.path.join(JOBS_DIR, f"{job_id}{WORDS_SUFFIX}")
     
     # Crear el registro del trabajo con los parámetros
     job_info = {
@@ -235,47 +808,497 @@ async def process_pdf(
         "status": "pending",
         "message": "",
         "pdf_path": pdf_path,
+        "owns_pdf": owns_pdf,
         "md_path": md_path,
+        "words_path": words_path,
         "created_at": time.time(),
         "updated_at": time.time(),
-        "result": None,
-        "params": {
-            "dpi": dpi,
-            "conf_threshold": conf_threshold,
-            "lang": lang,
-            "area": area_coords,
-            "original_filename": original_filename  # Guardamos el nombre original
-        }
+        "params": params,
+        "cache_key": cache_key,
+        "words_cache_key": words_cache_key,
+        "cache": "miss",
+        "timings": dict(timings or {})
     }
+    if group_id:
+        job_info["group_id"] = group_id
+    if pages_total is not None:
+        job_info["progress"] = {"pages_done": 0, "pages_total": pages_total}
+    
+    # Si ya procesamos este mismo PDF con los mismos parámetros, terminamos ya
+    stage_start = time.perf_counter()
+    if cache_lookup(cache_key, md_path):
+        job_info.update(finalize_result(md_path))
+        job_info["timings"]["persist"] = time.perf_counter() - stage_start
+        job_info.update({"status": "completed", "cache": "hit", "pdf_path": None})
+        if pages_total is not None:
+            job_info["progress"]["pages_done"] = pages_total
+        discard_pdf()
+        save_job_state(job_id, job_info)
+        observe_job(job_info)
+        log_to_job(job_id, "Resultado recuperado de la caché: el documento ya se había procesado con estos parámetros")
+        return {
+            "job_id": job_id,
+            "status": "completed",
+            "cache": "hit",
+            "message": "Resultado recuperado de la caché"
+        }
+    
+    # Si sólo cambia el umbral respecto a un procesamiento anterior,
+    # reconstruimos el Markdown desde las palabras guardadas, sin OCR
+    if cache_lookup(words_cache_key, words_path, suffix=WORDS_SUFFIX):
+        rebuild_markdown_from_words(words_path, md_path, conf_threshold=params["conf_threshold"])
+        job_info.update(finalize_result(md_path))
+        job_info["timings"]["persist"] = time.perf_counter() - stage_start
+        job_info.update({"status": "completed", "cache": "words", "pdf_path": None})
+        if pages_total is not None:
+            job_info["progress"]["pages_done"] = pages_total
+        discard_pdf()
+        save_job_state(job_id, job_info)
+        observe_job(job_info)
+        cache_store(cache_key, md_path)
+        log_to_job(job_id, "Markdown reconstruido desde las palabras en caché con el nuevo umbral de confianza")
+        return {
+            "job_id": job_id,
+            "status": "completed",
+            "cache": "words",
+            "message": "Resultado reconstruido desde la caché de palabras"
+        }
+    
+    # Trabajo de un lote: pendiente hasta que haya hueco para lotes en la cola
+    # (los nodos lo encolan al reclamar trabajo, ver job_store.claim_job)
+    if group_id:
+        save_job_state(job_id, job_info)
+        return {"job_id": job_id, "status": "pending", "cache": "miss"}
+    
+    # Si no hay sitio en la cola, descartamos el PDF y pedimos reintentar
+    if job_store.count_queued(batch=False) >= MAX_PENDING_JOBS:
+        discard_pdf()
+        return queue_full_response()
     
     # Guardar info del trabajo
-    jobs[job_id] = job_info
-    save_job_state(job_id)
+    save_job_state(job_id, job_info)
     
-    # Iniciar procesamiento en segundo plano
-    thread = threading.Thread(target=process_job, args=(job_id,))
-    thread.daemon = True
-    thread.start()
+    # Encolar el procesamiento; si la cola se ha llenado entretanto, deshacemos
+    if not enqueue_job(job_id):
+        discard_pdf()
+        job_store.delete_job(job_id)
+        return queue_full_response()
     
     # Devolver el ID del trabajo inmediatamente
     return {
         "job_id": job_id,
         "status": "pending",
-        "message": "Procesamiento iniciado. Consulte el estado con el endpoint /status/{job_id}"
+        "cache": "miss",
+        "queue_position": get_queue_position(job_id),
+        "message": "Trabajo en cola. Consulte el estado con el endpoint /status/{job_id}"
     }
 
-@app.get("/status/{job_id}")
-async def get_job_status(job_id: str):
-    """Consulta el estado de un trabajo por su ID."""
-    # Buscar el trabajo en memoria
-    job = jobs.get(job_id)
+@app.post("/process", response_class=JSONResponse)
+async def process_pdf(
+    file: UploadFile = File(...),
+    dpi: int = Form(300),
+    conf_threshold: int = Form(60),
+    lang: str = Form("spa"),
+    area: Optional[str] = Form(None),
+    areas: Optional[str] = Form(None),
+    workers: Optional[int] = Form(None),
+    mode: str = Form("auto"),
+    adaptive: bool = Form(False),
+    low_dpi: int = Form(ADAPTIVE_LOW_DPI),
+    preprocess: Optional[str] = Form(None),
+    target_x_height: Optional[int] = Form(None),
+    blank_threshold: Optional[float] = Form(None),
+    layout: Optional[bool] = Form(None),
+    original_filename: Optional[str] = Form(None)  # Nuevo parámetro para el nombre original
+):
+    """Inicia un nuevo trabajo de procesamiento de PDF."""
+    # Generar ID único para el trabajo
+    job_id = str(uuid.uuid4())
+    
+    params = build_job_params(dpi, conf_threshold, lang, area, areas, workers, mode,
+                              adaptive, low_dpi, original_filename, preprocess, target_x_height,
+                              blank_threshold, layout)
+    
+    # Guardar el PDF subido por bloques (en un hilo, sin bloquear el bucle de
+    # eventos) calculando a la vez su huella para la caché
+    pdf_path = os.path.join(JOBS_DIR, f"{job_id}.pdf")
+    upload_start = time.perf_counter()
+    try:
+        pdf_digest = await run_in_threadpool(save_upload, file.file, pdf_path)
+    finally:
+        await file.close()
+    
+    return await run_in_threadpool(submit_job, job_id, pdf_path, pdf_digest, params,
+                                   timings={"upload": time.perf_counter() - upload_start})
+
+def resolve_shared_pdf(pdf_ref: str) -> str:
+    """
+    Traduce la referencia enviada por la web (ruta relativa a SHARED_UPLOAD_DIR)
+    a una ruta local, comprobando que no se sale del directorio compartido.
+    """
+    if not SHARED_UPLOAD_DIR:
+        raise HTTPException(status_code=404, detail="El modo de volumen compartido no está habilitado")
+    base = os.path.realpath(SHARED_UPLOAD_DIR)
+    pdf_path = os.path.realpath(os.path.join(base, pdf_ref))
+    if os.path.commonpath([base, pdf_path]) != base or not pdf_path.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Referencia de PDF no válida")
+    if not os.path.isfile(pdf_path):
+        raise HTTPException(status_code=404, detail="El PDF no existe en el volumen compartido")
+    return pdf_path
+
+def hash_file(path: str) -> str:
+    """SHA-256 de un fichero, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@app.post("/process_path", response_class=JSONResponse)
+async def process_shared_pdf(
+    pdf_ref: str = Form(...),
+    dpi: int = Form(300),
+    conf_threshold: int = Form(60),
+    lang: str = Form("spa"),
+    area: Optional[str] = Form(None),
+    areas: Optional[str] = Form(None),
+    workers: Optional[int] = Form(None),
+    mode: str = Form("auto"),
+    adaptive: bool = Form(False),
+    low_dpi: int = Form(ADAPTIVE_LOW_DPI),
+    preprocess: Optional[str] = Form(None),
+    target_x_height: Optional[int] = Form(None),
+    blank_threshold: Optional[float] = Form(None),
+    layout: Optional[bool] = Form(None),
+    original_filename: Optional[str] = Form(None)
+):
+    """
+    Inicia un trabajo sobre un PDF que la web ya guardó en el volumen
+    compartido: sólo se recibe su ruta, sin volver a transferir ni copiar
+    el fichero.
+    """
+    job_id = str(uuid.uuid4())
+    pdf_path = resolve_shared_pdf(pdf_ref)
+    params = build_job_params(dpi, conf_threshold, lang, area, areas, workers, mode,
+                              adaptive, low_dpi, original_filename, preprocess, target_x_height,
+                              blank_threshold, layout)
     
-    # Si no está en memoria, intentar cargarlo desde disco
+    size = os.path.getsize(pdf_path)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+    # Sin subida: la etapa 'upload' es la lectura del PDF para calcular su huella
+    upload_start = time.perf_counter()
+    pdf_digest = await run_in_threadpool(hash_file, pdf_path)
+    
+    return await run_in_threadpool(submit_job, job_id, pdf_path, pdf_digest, params, owns_pdf=False,
+                                   timings={"upload": time.perf_counter() - upload_start})
+
+def extract_zip_pdfs(zip_path: str, created: List[tuple], max_files: int, max_bytes: int):
+    """
+    Extrae a JOBS_DIR los PDF de un ZIP, por bloques y con el límite de tamaño
+    de las subidas. Añade a `created` una tupla (job_id, nombre, ruta, sha256)
+    por documento, para que el llamante pueda deshacer si algo falla.
+
+    Lo extraído, sumado a los documentos ya guardados en `created`, no puede
+    pasar de `max_bytes`: un ZIP pequeño muy comprimido no llena JOBS_DIR. El
+    tamaño declarado de cada miembro se comprueba antes de abrirlo y el real
+    mientras se copia.
+    """
+    def too_large():
+        return HTTPException(status_code=413, detail="El lote supera el tamaño máximo permitido una vez descomprimido")
+    
+    total = sum(os.path.getsize(pdf_path) for _, _, pdf_path, _ in created)
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                # Se ignoran directorios, otros formatos y metadatos (__MACOSX/._*)
+                if member.is_dir() or not name.lower().endswith(".pdf") or name.startswith("."):
+                    continue
+                if len(created) >= max_files:
+                    raise HTTPException(status_code=400, detail=f"El lote supera el máximo de {max_files} documentos")
+                if member.file_size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{name} supera el tamaño máximo permitido")
+                if total + member.file_size > max_bytes:
+                    raise too_large()
+                job_id = str(uuid.uuid4())
+                pdf_path = os.path.join(JOBS_DIR, f"{job_id}.pdf")
+                with archive.open(member) as src:
+                    try:
+                        digest = save_upload(src, pdf_path, min(MAX_UPLOAD_BYTES, max_bytes - total))
+                    except HTTPException:
+                        # Tamaño declarado falso: se paró al pasar el límite
+                        raise too_large()
+                total += os.path.getsize(pdf_path)
+                created.append((job_id, name, pdf_path, digest))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo ZIP no es válido")
+
+def safe_page_count(pdf_path: str) -> Optional[int]:
+    """Número de páginas, o None si no se puede leer (el error saldrá al procesarlo)."""
+    try:
+        return get_page_count(pdf_path)
+    except Exception:
+        return None
+
+@app.post("/batch", response_class=JSONResponse)
+async def process_batch(
+    files: List[UploadFile] = File(...),
+    dpi: int = Form(300),
+    conf_threshold: int = Form(60),
+    lang: str = Form("spa"),
+    area: Optional[str] = Form(None),
+    areas: Optional[str] = Form(None),
+    workers: Optional[int] = Form(None),
+    mode: str = Form("auto"),
+    adaptive: bool = Form(False),
+    low_dpi: int = Form(ADAPTIVE_LOW_DPI),
+    preprocess: Optional[str] = Form(None),
+    target_x_height: Optional[int] = Form(None),
+    blank_threshold: Optional[float] = Form(None),
+    layout: Optional[bool] = Form(None)
+):
+    """
+    Crea un lote (grupo de trabajos) a partir de varios PDF y/o archivos ZIP
+    con PDF. Cada documento es un trabajo normal (caché incluida) y sus
+    páginas se reparten en el pool de procesos de OCR compartido. El progreso
+    conjunto se consulta en /batch/{group_id} y los Markdown se descargan en
+    un ZIP con /batch/{group_id}/archive.
+    """
+    # Por defecto un lote usa todos los procesos de OCR disponibles
+    params = build_job_params(dpi, conf_threshold, lang, area, areas,
+                              workers if workers is not None else MAX_OCR_WORKERS,
+                              mode, adaptive, low_dpi, None, preprocess, target_x_height,
+                              blank_threshold, layout)
+    
+    # Guardar los documentos: (job_id, nombre original, ruta, sha256)
+    documents: List[tuple] = []
+    try:
+        for upload in files:
+            try:
+                filename = os.path.basename(upload.filename or "documento.pdf")
+                if filename.lower().endswith(".zip"):
+                    zip_fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=JOBS_DIR)
+                    os.close(zip_fd)
+                    try:
+                        await run_in_threadpool(save_upload, upload.file, zip_path, MAX_BATCH_BYTES)
+                        await run_in_threadpool(extract_zip_pdfs, zip_path, documents, MAX_BATCH_FILES,
+                                                MAX_BATCH_BYTES)
+                    finally:
+                        if os.path.exists(zip_path):
+                            os.unlink(zip_path)
+                else:
+                    if len(documents) >= MAX_BATCH_FILES:
+                        raise HTTPException(status_code=400, detail=f"El lote supera el máximo de {MAX_BATCH_FILES} documentos")
+                    job_id = str(uuid.uuid4())
+                    pdf_path = os.path.join(JOBS_DIR, f"{job_id}.pdf")
+                    digest = await run_in_threadpool(save_upload, upload.file, pdf_path)
+                    documents.append((job_id, filename, pdf_path, digest))
+            finally:
+                await upload.close()
+    except HTTPException:
+        for _, _, pdf_path, _ in documents:
+            if os.path.exists(pdf_path):
+                os.unlink(pdf_path)
+        raise
+    
+    if not documents:
+        raise HTTPException(status_code=400, detail="El lote no contiene ningún PDF")
+    
+    group_id = str(uuid.uuid4())
+    group = {
+        "id": group_id,
+        "created_at": time.time(),
+        "job_ids": [job_id for job_id, _, _, _ in documents],
+        "filenames": {job_id: name for job_id, name, _, _ in documents},
+        "params": params
+    }
+    await run_in_threadpool(job_store.save_group, group)
+    
+    results = []
+    for job_id, name, pdf_path, digest in documents:
+        pages_total = await run_in_threadpool(safe_page_count, pdf_path)
+        result = await run_in_threadpool(submit_job, job_id, pdf_path, digest,
+                                         dict(params, original_filename=name),
+                                         group_id=group_id, pages_total=pages_total)
+        results.append({"filename": name, **result})
+    
+    # Los que no salieron de la caché entran en la cola según haya hueco para lotes
+    if any(r["status"] == "pending" for r in results):
+        work_available.set()
+    
+    return {
+        "group_id": group_id,
+        "total": len(results),
+        "jobs": results,
+        "message": "Lote creado. Consulte el progreso con el endpoint /batch/{group_id}"
+    }
+
+def load_group_jobs(group_id: str) -> tuple:
+    """Devuelve el lote y sus trabajos (los activos, con su estado en memoria)."""
+    group = job_store.load_group(group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail=f"Lote con ID {group_id} no encontrado")
+    stored = {job["id"]: job for job in job_store.load_jobs(group["job_ids"])}
+    group_jobs = [jobs.get(job_id) or stored.get(job_id) for job_id in group["job_ids"]]
+    return group, [job for job in group_jobs if job is not None]
+
+@app.get("/batch/{group_id}")
+async def get_batch_status(group_id: str):
+    """Progreso conjunto de un lote: trabajos por estado y páginas hechas/totales."""
+    group, group_jobs = load_group_jobs(group_id)
+    
+    counts = {"pending": 0, "processing": 0, "completed": 0, "error": 0}
+    pages_done = 0
+    pages_total = 0
+    documents = []
+    for job in group_jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+        progress = job.get("progress") or {}
+        if progress.get("pages_total"):
+            pages_total += progress["pages_total"]
+            pages_done += progress.get("pages_done", 0)
+        documents.append({
+            "job_id": job["id"],
+            "filename": group["filenames"].get(job["id"]),
+            "status": job["status"],
+            **progress,
+            **({"message": job["message"]} if job.get("message") else {})
+        })
+    
+    if counts["pending"] + counts["processing"] == 0:
+        status = "error" if counts["completed"] == 0 else "completed"
+    elif counts["processing"] or counts["completed"] or counts["error"]:
+        status = "processing"
+    else:
+        status = "pending"
+    
+    return {
+        "group_id": group_id,
+        "status": status,
+        "created_at": group["created_at"],
+        "total": len(group["job_ids"]),
+        "jobs_by_status": counts,
+        "pages_done": pages_done,
+        "pages_total": pages_total,
+        "documents": documents
+    }
+
+def build_batch_archive(group: Dict, group_jobs: List[Dict]):
+    """
+    Escribe en un temporal (se borra al cerrarlo) un ZIP con el Markdown de
+    cada documento completado y un errores.txt con los que fallaron.
+    """
+    archive_file = tempfile.TemporaryFile(dir=JOBS_DIR)
+    used_names = set()
+    errors = []
+    with zipfile.ZipFile(archive_file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for job in group_jobs:
+            filename = group["filenames"].get(job["id"]) or job["id"]
+            if job["status"] != "completed" or not job.get("md_path") or not os.path.exists(job["md_path"]):
+                errors.append(f"{filename}: {job.get('message') or 'sin resultado'}")
+                continue
+            stem = filename[:-4] if filename.lower().endswith(".pdf") else filename
+            name = f"{stem}.md"
+            # Documentos con el mismo nombre dentro del lote
+            suffix = 2
+            while name in used_names:
+                name = f"{stem}_{suffix}.md"
+                suffix += 1
+            used_names.add(name)
+            archive.write(job["md_path"], arcname=name)
+        if errors:
+            archive.writestr("errores.txt", "\n".join(errors) + "\n")
+    archive_file.seek(0)
+    return archive_file
+
+def iter_open_file(file_obj):
+    """Lee por bloques un fichero ya abierto y lo cierra al terminar."""
+    try:
+        while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        file_obj.close()
+
+@app.get("/batch/{group_id}/archive")
+async def get_batch_archive(group_id: str):
+    """ZIP con los Markdown de todos los documentos del lote, cuando ha terminado."""
+    group, group_jobs = load_group_jobs(group_id)
+    unfinished = sum(1 for job in group_jobs if job["status"] not in FINAL_STATUSES)
+    if unfinished:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote aún no ha terminado ({unfinished} documentos pendientes o en proceso)"
+        )
+    
+    archive_file = await run_in_threadpool(build_batch_archive, group, group_jobs)
+    return StreamingResponse(
+        iter_open_file(archive_file),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=lote_{group_id[:8]}.zip"}
+    )
+
+@app.post("/rethreshold/{job_id}", response_class=JSONResponse)
+async def rethreshold_job(job_id: str, conf_threshold: int = Form(...)):
+    """
+    Crea un trabajo nuevo con el Markdown de `job_id` regenerado con otro
+    umbral de confianza, a partir de sus tablas de palabras y sin repetir OCR.
+    """
+    job = get_job(job_id)
     if not job:
-        job = load_job_state(job_id)
-        if job:
-            # Si lo encontramos en disco, lo cargamos en memoria
-            jobs[job_id] = job
+        raise HTTPException(status_code=404, detail=f"Trabajo con ID {job_id} no encontrado")
+    
+    words_path = job.get("words_path")
+    if job["status"] != "completed" or not words_path or not os.path.exists(words_path):
+        raise HTTPException(
+            status_code=400,
+            detail="El trabajo no tiene tablas de palabras guardadas; hay que procesar el PDF de nuevo"
+        )
+    
+    new_job_id = str(uuid.uuid4())
+    md_path = os.path.join(JOBS_DIR, f"{new_job_id}.md")
+    # Leer las palabras y comprimir el resultado recorren todo el documento:
+    # en el threadpool, sin bloquear el bucle de eventos
+    await run_in_threadpool(rebuild_markdown_from_words, words_path, md_path, conf_threshold=conf_threshold)
+    result = await run_in_threadpool(finalize_result, md_path)
+    
+    params = dict(job.get("params", {}), conf_threshold=conf_threshold)
+    new_job = {
+        "id": new_job_id,
+        "status": "completed",
+        "message": "",
+        "pdf_path": None,
+        "md_path": md_path,
+        # Se comparte el fichero de palabras del trabajo original
+        "words_path": words_path,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+        "params": params,
+        "source_job_id": job_id,
+        **result
+    }
+    await run_in_threadpool(save_job_state, new_job_id, new_job)
+    log_to_job(new_job_id, f"Markdown regenerado desde el trabajo {job_id} con umbral {conf_threshold}")
+    
+    return {
+        "job_id": new_job_id,
+        "status": "completed",
+        "message": "Markdown regenerado con el nuevo umbral"
+    }
+
+def report_summary(report: Dict) -> Dict:
+    """El informe de un trabajo sin la lista por página."""
+    return {key: value for key, value in report.items() if key != "pages"}
+
+@app.get("/status/{job_id}")
+async def get_job_status(job_id: str, request: Request):
+    """
+    Consulta el estado de un trabajo por su ID. Sólo devuelve metadatos (el
+    Markdown se descarga con /result) y admite peticiones condicionales: si
+    If-None-Match coincide con el ETag actual se responde 304 sin cuerpo.
+    """
+    # Buscar el trabajo (en memoria si está activo, si no en el almacén)
+    job = get_job(job_id)
     
     # Si no lo encontramos, devolver error
     if not job:
@@ -289,6 +1312,32 @@ async def get_job_status(job_id: str):
         "updated_at": job["updated_at"]
     }
     
+    # Posición en la cola mientras el trabajo espera
+    if job["status"] == "pending":
+        response["queue_position"] = get_queue_position(job_id)
+    
+    # Páginas terminadas mientras se procesa
+    if job.get("progress"):
+        response.update(job["progress"])
+    
+    # Resumen del informe (páginas con capa de texto, con OCR y en blanco,
+    # tiempos por etapa); el detalle por página crece con el documento y se
+    # sirve aparte en /report
+    if job.get("report"):
+        response["report"] = report_summary(job["report"])
+    
+    # Indicar si el resultado se sirvió desde la caché
+    if job.get("cache"):
+        response["cache"] = job["cache"]
+    
+    # Desglose de tiempos por etapa, rendimiento y memoria del procesamiento
+    timings = job_timings(job)
+    if timings:
+        response["timings"] = timings
+    for key in ("pages_per_second", "peak_rss_bytes"):
+        if job.get(key) is not None:
+            response[key] = job[key]
+    
     # Añadir mensaje si existe
     if job.get("message"):
         response["message"] = job["message"]
@@ -297,23 +1346,28 @@ async def get_job_status(job_id: str):
     if job.get("params"):
         response["params"] = job["params"]
     
-    # Si está completado, añadimos el contenido Markdown
-    if job["status"] == "completed" and job.get("result"):
-        response["result"] = job["result"]
+    # Si está completado, tamaño y huella del Markdown (no su contenido)
+    if job["status"] == "completed":
+        for key in ("result_size", "result_sha256"):
+            if job.get(key) is not None:
+                response[key] = job[key]
     
-    return response
+    body = json.dumps(response, ensure_ascii=False, sort_keys=True)
+    etag = f'W/"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@app.get("/result/{job_id}", response_class=PlainTextResponse)
-async def get_job_result(job_id: str):
-    """Devuelve sólo el resultado Markdown de un trabajo completado."""
-    # Buscar el trabajo
-    job = jobs.get(job_id)
-    
-    # Si no está en memoria, intentar cargarlo desde disco
-    if not job:
-        job = load_job_state(job_id)
-        if job:
-            jobs[job_id] = job
+@app.get("/result/{job_id}")
+async def get_job_result(job_id: str, request: Request):
+    """
+    Devuelve el Markdown de un trabajo completado leyéndolo por bloques desde
+    disco. Admite peticiones Range de un intervalo (206), If-None-Match (304)
+    y, si el cliente acepta gzip, sirve la copia ya comprimida.
+    """
+    # Buscar el trabajo (en memoria si está activo, si no en el almacén)
+    job = get_job(job_id)
     
     # Si no lo encontramos, devolver error
     if not job:
@@ -326,11 +1380,199 @@ async def get_job_result(job_id: str):
             detail=f"El trabajo aún no está completado (estado actual: {job['status']})"
         )
     
-    # Devolver el resultado
-    if not job.get("result"):
+    md_path = job.get("md_path")
+    if not md_path or not os.path.exists(md_path):
+        # Trabajos antiguos con el resultado guardado junto a su estado
+        if job.get("result"):
+            return PlainTextResponse(job["result"])
         raise HTTPException(status_code=500, detail="El trabajo está marcado como completado pero no tiene resultado")
     
-    return job["result"]
+    # Las escrituras en el almacén pueden esperar al bloqueo de otra réplica:
+    # siempre en el threadpool, nunca en el bucle de eventos
+    if not job.get("result_sha256"):
+        job.update(await run_in_threadpool(finalize_result, md_path))
+        await run_in_threadpool(save_job_state, job_id, job)
+    
+    # Última descarga: la retención por cuota expulsa primero lo menos descargado
+    now = time.time()
+    if now - (job.get("accessed_at") or 0) > ACCESS_TOUCH_INTERVAL:
+        await run_in_threadpool(job_store.touch_job, job_id, now)
+    
+    size = os.path.getsize(md_path)
+    media_type = "text/plain; charset=utf-8"
+    headers = {
+        "ETag": f'"{job["result_sha256"]}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    byte_range = parse_range(range_header, size) if range_header else None
+    if byte_range:
+        # Los rangos se refieren siempre a los bytes sin comprimir
+        first, last = byte_range
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        headers["Content-Length"] = str(last - first + 1)
+        return StreamingResponse(iter_file(md_path, first, last - first + 1),
+                                 status_code=206, media_type=media_type, headers=headers)
+    
+    gz_path = f"{md_path}.gz"
+    if "gzip" in request.headers.get("accept-encoding", "") and os.path.exists(gz_path):
+        headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(os.path.getsize(gz_path))
+        return StreamingResponse(iter_file(gz_path), media_type=media_type, headers=headers)
+    
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file(md_path), media_type=media_type, headers=headers)
+
+PAGE_HEADER = "## Página ".encode("utf-8")
+MAX_PAGES_PER_REQUEST = int(os.environ.get("MAX_PAGES_PER_REQUEST", "50"))
+
+def index_pages(md_path: str) -> List[int]:
+    """Fin en bytes de cada página de un .md ya terminado (para trabajos sin page_offsets)."""
+    starts = []
+    position = 0
+    with open(md_path, "rb") as f:
+        for line in f:
+            if line.startswith(PAGE_HEADER):
+                starts.append(position)
+            position += len(line)
+    return starts[1:] + [position] if starts else []
+
+def read_pages(md_path: str, offsets: List[int], first: int, last: int) -> List[Dict]:
+    """Lee del .md las secciones de las páginas `first`..`last` según sus desplazamientos."""
+    pages = []
+    with open(md_path, "rb") as f:
+        start = offsets[first - 2] if first > 1 else 0
+        f.seek(start)
+        for page_num in range(first, last + 1):
+            end = offsets[page_num - 1]
+            pages.append({"page": page_num, "markdown": f.read(end - start).decode("utf-8")})
+            start = end
+    return pages
+
+@app.get("/pages/{job_id}")
+async def get_job_pages(job_id: str, first: int = 1, last: Optional[int] = None):
+    """
+    Devuelve las páginas ya terminadas de un trabajo (o el rango
+    `first`..`last`), también mientras se siguen procesando las siguientes.
+    Como mucho MAX_PAGES_PER_REQUEST páginas por petición.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Trabajo con ID {job_id} no encontrado")
+    if job["status"] == "error":
+        raise HTTPException(status_code=400, detail=f"El trabajo terminó con error: {job.get('message', '')}")
+    
+    md_path = job.get("md_path")
+    offsets = job.get("page_offsets")
+    if offsets is None and job["status"] == "completed" and md_path and os.path.exists(md_path):
+        # Resultados de la caché o de trabajos anteriores: se indexan una vez
+        offsets = await run_in_threadpool(index_pages, md_path)
+        job["page_offsets"] = offsets
+        await run_in_threadpool(save_job_state, job_id, job)
+    offsets = list(offsets or [])
+    
+    pages_done = len(offsets)
+    pages_total = (job.get("progress") or {}).get("pages_total") or (job.get("report") or {}).get("total_pages")
+    first = max(1, first)
+    last = min(last or pages_done, pages_done, first + MAX_PAGES_PER_REQUEST - 1)
+    pages = await run_in_threadpool(read_pages, md_path, offsets, first, last) if first <= last else []
+    
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "pages_done": pages_done,
+        "pages_total": pages_total,
+        "pages": pages
+    }
+
+@app.get("/report/{job_id}")
+async def get_job_report(job_id: str):
+    """
+    Informe completo de un trabajo terminado: el resumen de /status y, por
+    página, su origen (capa de texto, OCR o en blanco) y sus tiempos.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Trabajo con ID {job_id} no encontrado")
+    if not job.get("report"):
+        raise HTTPException(status_code=404, detail=f"El trabajo {job_id} aún no tiene informe")
+    return {"job_id": job_id, "status": job["status"], "report": job["report"]}
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str):
+    """
+    Flujo Server-Sent Events con los cambios de estado, el progreso por
+    página y las nuevas líneas de log de un trabajo, según se producen.
+    Empieza con el estado actual y los logs ya emitidos y termina cuando el
+    trabajo se completa o falla.
+    """
+    if not get_job(job_id):
+        raise HTTPException(status_code=404, detail=f"Trabajo con ID {job_id} no encontrado")
+    
+    async def event_stream():
+        # Suscribirse antes de tomar la instantánea para no perder eventos
+        events = subscribe(job_id)
+        try:
+            last_seq = job_log_seq.get(job_id, 0)
+            logs = list(job_logs.get(job_id, ()))
+            first_seq = last_seq - len(logs) + 1
+            for offset, line in enumerate(logs):
+                yield format_sse("log", {"seq": first_seq + offset, "line": line})
+            job = get_job(job_id)
+            if job is None:
+                return  # eliminado entretanto
+            status = job_status_event(job)
+            yield format_sse("status", status)
+            if status["status"] in FINAL_STATUSES:
+                return
+            
+            while True:
+                # Los eventos sólo se publican en el nodo que procesa el trabajo:
+                # si no es este, se consulta el almacén periódicamente
+                remote = job_id not in jobs
+                try:
+                    event, data = await asyncio.wait_for(
+                        events.get(), timeout=EVENTS_POLL_INTERVAL if remote else SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if remote:
+                        job = await run_in_threadpool(get_job, job_id)
+                        if job is None:
+                            return
+                        current = await run_in_threadpool(job_status_event, job)
+                        if current != status:
+                            status = current
+                            yield format_sse("status", status)
+                            if status["status"] in FINAL_STATUSES:
+                                return
+                            continue
+                    # Comentario SSE: mantiene viva la conexión en proxies intermedios
+                    yield ": keepalive\n\n"
+                    continue
+                if event == "log" and data["seq"] <= last_seq:
+                    continue  # ya enviado en la instantánea
+                yield format_sse(event, data)
+                if event == "status":
+                    status = data
+                    if data["status"] in FINAL_STATUSES:
+                        return
+        finally:
+            unsubscribe(job_id, events)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en el formato de exposición de Prometheus."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/logs/{job_id}")
 async def get_job_logs(job_id: str, last_n: int = None):
@@ -347,54 +1589,205 @@ async def get_job_logs(job_id: str, last_n: int = None):
     
     return {"logs": logs}
 
+# Retención automática de JOBS_DIR: antigüedad máxima de los trabajos y
+# cuota total en disco (0 desactiva cada límite). La caché de resultados
+# tiene su propio límite (CACHE_MAX_BYTES) y no se cuenta aquí
+JOB_RETENTION_DAYS = float(os.environ.get("JOB_RETENTION_DAYS", "7"))
+JOBS_MAX_BYTES = int(os.environ.get("JOBS_MAX_MB", "10240")) * 1024 * 1024
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "600"))  # segundos
+# La descarga de un resultado sólo se anota si la anterior anotada tiene más
+# de estos segundos: a la cuota le basta esa precisión y así descargar no
+# escribe siempre en el almacén
+ACCESS_TOUCH_INTERVAL = int(os.environ.get("ACCESS_TOUCH_INTERVAL", "600"))  # segundos
+
+retention_lock = threading.Lock()
+retention_stats = {
+    "runs": 0,
+    "last_run": None,
+    "last_removed_jobs": 0,
+    "last_reclaimed_bytes": 0,
+    "removed_jobs_total": 0,
+    "reclaimed_bytes_total": 0,
+    "usage_bytes": None
+}
+
+def job_files(job: Dict) -> List[str]:
+    """Ficheros en disco que pertenecen a un trabajo (y se borran con él)."""
+    paths = []
+    pdf_path = job.get("pdf_path")
+    if pdf_path and job.get("owns_pdf", True):
+        paths.append(pdf_path)
+    md_path = job.get("md_path")
+    if md_path:
+        paths.extend([md_path, f"{md_path}.gz"])
+    # Las tablas de palabras sólo se borran con el trabajo que las generó
+    words_path = job.get("words_path")
+    if words_path and not job.get("source_job_id"):
+        paths.append(words_path)
+    return paths
+
+def remove_job(job: Dict) -> int:
+    """Borra los ficheros, el registro y los logs de un trabajo. Devuelve los bytes liberados."""
+    freed = 0
+    for path in job_files(job):
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+    job_store.delete_job(job["id"])
+    job_logs.pop(job["id"], None)
+    job_log_seq.pop(job["id"], None)
+    return freed
+
+def jobs_dir_usage(stored_jobs: List[Dict]) -> int:
+    """
+    Bytes ocupados por los ficheros de los trabajos del almacén. Sólo cuenta
+    lo que la retención puede liberar borrando trabajos; los ficheros que no
+    son de ninguno los borra sweep_unowned_files.
+    """
+    total = 0
+    for job in stored_jobs:
+        for path in job_files(job):
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+    return total
+
+def sweep_unowned_files(stored_jobs: List[Dict], cutoff: float) -> int:
+    """
+    Borra de JOBS_DIR los ficheros que no pertenecen a ningún trabajo del
+    almacén (trabajos antiguos sin importar, temporales de subidas fallidas,
+    resultados de intentos anteriores...) modificados antes de `cutoff`.
+    Devuelve los bytes liberados.
+    """
+    owned = set()
+    for job in stored_jobs:
+        owned.update(os.path.abspath(path) for path in job_files(job))
+        # Las tablas de palabras heredadas son del trabajo de origen, pero
+        # mientras éste exista tampoco son huérfanas
+        if job.get("words_path"):
+            owned.add(os.path.abspath(job["words_path"]))
+    db_name = os.path.basename(job_store.JOBS_DB)
+    freed = 0
+    for entry in os.scandir(JOBS_DIR):
+        if not entry.is_file() or entry.name.startswith(db_name):
+            continue
+        if os.path.abspath(entry.path) in owned:
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                os.unlink(entry.path)
+                freed += stat.st_size
+        except FileNotFoundError:
+            pass
+    return freed
+
+def run_retention() -> Dict:
+    """
+    Aplica la política de retención: primero borra los trabajos terminados
+    más antiguos que JOB_RETENTION_DAYS (y los ficheros de esa antigüedad que
+    no son de ningún trabajo) y, si los ficheros de los trabajos siguen por
+    encima de JOBS_MAX_BYTES, los descargados hace más tiempo. Los trabajos
+    en cola o en proceso nunca se tocan.
+    """
+    with retention_lock:
+        removed = 0
+        reclaimed = 0
+        
+        if JOB_RETENTION_DAYS > 0:
+            cutoff = time.time() - JOB_RETENTION_DAYS * 24 * 60 * 60
+            for job in job_store.jobs_created_before(cutoff):
+                if job["id"] in jobs or job["status"] not in FINAL_STATUSES:
+                    continue
+                reclaimed += remove_job(job)
+                removed += 1
+            job_store.delete_groups_before(cutoff)
+        
+        stored_jobs = job_store.all_jobs()
+        if JOB_RETENTION_DAYS > 0:
+            reclaimed += sweep_unowned_files(stored_jobs, cutoff)
+        usage = jobs_dir_usage(stored_jobs)
+        if JOBS_MAX_BYTES > 0 and usage > JOBS_MAX_BYTES:
+            for job in job_store.jobs_by_last_access(FINAL_STATUSES):
+                if usage <= JOBS_MAX_BYTES:
+                    break
+                if job["id"] in jobs:
+                    continue
+                freed = remove_job(job)
+                usage -= freed
+                reclaimed += freed
+                removed += 1
+        
+        retention_stats["runs"] += 1
+        retention_stats["last_run"] = time.time()
+        retention_stats["last_removed_jobs"] = removed
+        retention_stats["last_reclaimed_bytes"] = reclaimed
+        retention_stats["removed_jobs_total"] += removed
+        retention_stats["reclaimed_bytes_total"] += reclaimed
+        retention_stats["usage_bytes"] = usage
+    
+    if removed:
+        print(f"Retención: {removed} trabajos eliminados, {reclaimed} bytes liberados, "
+              f"{usage} bytes en uso en {JOBS_DIR}")
+    return {"removed_jobs": removed, "reclaimed_bytes": reclaimed, "usage_bytes": usage}
+
+def retention_worker():
+    """Hilo en segundo plano que aplica la retención cada RETENTION_INTERVAL segundos."""
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"Error en la retención de trabajos: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+@app.on_event("startup")
+def start_retention_worker():
+    if RETENTION_INTERVAL > 0 and (JOB_RETENTION_DAYS > 0 or JOBS_MAX_BYTES > 0):
+        thread = threading.Thread(target=retention_worker, name="retention", daemon=True)
+        thread.start()
+
+@app.get("/retention")
+async def get_retention_stats():
+    """Bytes liberados por la retención, uso actual de JOBS_DIR y de la caché, y límites configurados."""
+    return {
+        **retention_stats,
+        "max_age_days": JOB_RETENTION_DAYS,
+        "max_bytes": JOBS_MAX_BYTES,
+        "interval": RETENTION_INTERVAL,
+        "cache": cache_usage()
+    }
+
 # Endpoint para limpiar trabajos antiguos (podría protegerse con autenticación en producción)
 @app.post("/cleanup")
-async def cleanup_old_jobs(days: int = 1):
-    """Elimina trabajos más antiguos que el número de días especificado."""
+def cleanup_old_jobs(days: int = 1):
+    """
+    Elimina trabajos más antiguos que el número de días especificado. Es
+    síncrono (FastAPI lo ejecuta en el threadpool): borra ficheros y escribe
+    en el almacén.
+    """
     now = time.time()
     seconds = days * 24 * 60 * 60
     
     removed = 0
-    for job_id in list(jobs.keys()):
-        if now - jobs[job_id]["created_at"] > seconds:
-            # Eliminar archivos asociados
-            pdf_path = jobs[job_id].get("pdf_path")
-            md_path = jobs[job_id].get("md_path")
-            
-            if pdf_path and os.path.exists(pdf_path):
-                os.unlink(pdf_path)
-            if md_path and os.path.exists(md_path):
-                os.unlink(md_path)
-                
-            # Eliminar archivos de estado
-            job_path = os.path.join(JOBS_DIR, f"{job_id}.json")
-            result_path = os.path.join(JOBS_DIR, f"{job_id}_result.txt")
-            
-            if os.path.exists(job_path):
-                os.unlink(job_path)
-            if os.path.exists(result_path):
-                os.unlink(result_path)
-            
-            # Eliminar de memoria
-            del jobs[job_id]
-            # También eliminar los logs
-            if job_id in job_logs:
-                del job_logs[job_id]
-            removed += 1
+    reclaimed = 0
+    # Consulta por el índice de fecha; los trabajos activos no se tocan
+    for job in job_store.jobs_created_before(now - seconds):
+        if job["id"] in jobs or job["status"] not in FINAL_STATUSES:
+            continue
+        reclaimed += remove_job(job)
+        removed += 1
     
-    return {"message": f"Se eliminaron {removed} trabajos antiguos"}
+    return {
+        "message": f"Se eliminaron {removed} trabajos antiguos",
+        "reclaimed_bytes": reclaimed
+    }
 
 if __name__ == "__main__":
     import uvicorn
     
-    # Cargar trabajos existentes al iniciar
-    if os.path.exists(JOBS_DIR):
-        for filename in os.listdir(JOBS_DIR):
-            if filename.endswith(".json"):
-                job_id = filename.replace(".json", "")
-                job_data = load_job_state(job_id)
-                if job_data:
-                    jobs[job_id] = job_data
-    
     # Iniciar el servidor
     uvicorn.run(app, host="0.0.0.0", port=5001)
\ No newline at end of file
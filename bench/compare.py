@@ -0,0 +1,100 @@
+"""
+Compara dos ficheros de resultados de run_bench.py.
+
+Empareja las ejecuciones por destino (cli/api) y documento, promedia las
+repeticiones y muestra la variación de páginas/s, latencia por etapa, pico
+de RSS y WER. Con --max-regression sale con código 1 si el rendimiento o la
+precisión empeoran más del porcentaje indicado.
+
+Uso:
+    python bench/compare.py bench/results/base.json bench/results/nuevo.json
+"""
+import argparse
+import json
+import sys
+
+from run_bench import STAGES
+
+
+def load_runs(path: str) -> dict:
+    """{(destino, documento): métricas medias de las repeticiones sin error}."""
+    with open(path, encoding="utf-8") as f:
+        results = json.load(f)
+    grouped = {}
+    for run in results["runs"]:
+        if "error" not in run:
+            grouped.setdefault((run["target"], run["document"]), []).append(run)
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+
+    metrics = {}
+    for key, runs in grouped.items():
+        metrics[key] = {
+            "pages_per_second": mean([r["pages_per_second"] for r in runs]),
+            "peak_rss_mb": mean([r["peak_rss_mb"] for r in runs]),
+            "wer": mean([r["accuracy"]["wer"] for r in runs]),
+            # Resultados anteriores a una etapa no la incluyen
+            **{f"{stage}_ms": mean([r["stages"].get(stage, {}).get("per_page_ms") for r in runs])
+               for stage in STAGES},
+        }
+    return metrics
+
+
+def change(old, new):
+    """Variación relativa en %, o None si no se puede calcular."""
+    if old is None or new is None or old == 0:
+        return None
+    return 100 * (new - old) / old
+
+
+def format_change(old, new) -> str:
+    if old is None or new is None:
+        return "-"
+    pct = change(old, new)
+    return f"{old:.3g} → {new:.3g}" + (f" ({pct:+.1f}%)" if pct is not None else "")
+
+
+def compare(base_path: str, new_path: str, max_regression: float = None) -> int:
+    base = load_runs(base_path)
+    new = load_runs(new_path)
+    regressions = []
+    columns = ["pages_per_second", "peak_rss_mb", "wer"] + [f"{stage}_ms" for stage in STAGES]
+
+    for key in sorted(set(base) & set(new)):
+        print(f"[{key[0]}] {key[1]}")
+        for column in columns:
+            print(f"  {column:<18} {format_change(base[key][column], new[key][column])}")
+        if max_regression is not None:
+            # Menos páginas/s o más WER que el margen permitido
+            pps = change(base[key]["pages_per_second"], new[key]["pages_per_second"])
+            if pps is not None and pps < -max_regression:
+                regressions.append(f"{key[0]}/{key[1]}: páginas/s {pps:+.1f}%")
+            wer = change(base[key]["wer"], new[key]["wer"])
+            if wer is not None and wer > max_regression:
+                regressions.append(f"{key[0]}/{key[1]}: WER {wer:+.1f}%")
+
+    for key in sorted(set(base) ^ set(new)):
+        print(f"[{key[0]}] {key[1]}: sólo en {'la base' if key in base else 'la nueva ejecución'}")
+
+    if regressions:
+        print("\nRegresiones:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compara dos resultados del benchmark")
+    parser.add_argument("base", help="Resultados de referencia (JSON de run_bench.py)")
+    parser.add_argument("new", help="Resultados a comparar")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Porcentaje de empeoramiento de páginas/s o WER a partir del que se falla")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(compare(args.base, args.new, args.max_regression))
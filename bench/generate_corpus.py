@@ -0,0 +1,321 @@
+"""
+Genera un corpus sintético de PDF para el benchmark, con su verdad de referencia.
+
+Cada página es una imagen rasterizada (como un documento escaneado) de uno de
+estos tipos:
+- 'printed': texto impreso limpio en varios tamaños de letra y en español o inglés.
+- 'noisy': texto impreso con ruido, ligera rotación y desenfoque (escaneo de mala calidad).
+- 'handwriting': texto impreso con regiones de trazos a mano alzada intercalados.
+- 'blank': página en blanco con algo de ruido de escaneo.
+
+Los documentos van de 1 a 500 páginas según el perfil. Todo se deriva de una
+semilla, de modo que el mismo perfil produce siempre el mismo corpus. Junto a
+los PDF se escribe `manifest.json` con el texto esperado de cada página, que
+es lo que usa run_bench.py para medir la precisión.
+
+Uso:
+    python bench/generate_corpus.py bench/corpus --profile quick
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from PyPDF2 import PdfMerger
+
+# Tamaño A4 en pulgadas y resolución a la que se "escanean" las páginas
+PAGE_INCHES = (8.27, 11.69)
+DEFAULT_DPI = 200
+# Páginas que se guardan en cada PDF parcial antes de unirlos (limita la memoria)
+CHUNK_PAGES = 25
+
+FONT_CANDIDATES = (
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "Arial.ttf",
+)
+
+WORDS = {
+    "spa": (
+        "el la los las de del en con por para sobre entre según durante año "
+        "documento página archivo registro expediente información análisis "
+        "resultado proceso sistema servicio administración ciudadano región "
+        "comisión acuerdo solicitud período económico público técnico jurídico "
+        "núcleo evaluación revisión dirección pequeño grande nuevo último general "
+        "señor señora niño compañía camión árbol corazón acción educación "
+        "presentó aprobó firmó recibió indicó señaló también además después "
+        "antes mañana tarde siempre nunca aquí allí mientras aunque porque"
+    ).split(),
+    "eng": (
+        "the of and to in for on with by from about between during year "
+        "document page file record report information analysis result process "
+        "system service administration citizen region committee agreement "
+        "request period economic public technical legal review evaluation "
+        "direction small large new last general company truck tree heart "
+        "action education presented approved signed received indicated noted "
+        "also moreover after before morning evening always never here there "
+        "while although because"
+    ).split(),
+}
+
+# Mezcla de tipos de página de cada documento (peso relativo)
+KIND_MIX = {
+    "printed": {"printed": 1.0},
+    "noisy": {"noisy": 1.0},
+    "handwriting": {"handwriting": 1.0},
+    "blank": {"blank": 1.0},
+    "mixed": {"printed": 0.55, "noisy": 0.2, "handwriting": 0.15, "blank": 0.1},
+}
+
+# Documentos de cada perfil: (nombre, páginas, mezcla, idioma, tamaño de letra en puntos)
+PROFILES = {
+    "quick": [
+        ("printed_spa_12pt", 1, "printed", "spa", 12),
+        ("printed_eng_10pt", 1, "printed", "eng", 10),
+        ("printed_spa_18pt", 1, "printed", "spa", 18),
+        ("noisy_spa_12pt", 1, "noisy", "spa", 12),
+        ("handwriting_spa_12pt", 1, "handwriting", "spa", 12),
+        ("blank", 1, "blank", "spa", 12),
+        ("mixed_spa_10p", 10, "mixed", "spa", None),
+    ],
+    "full": [
+        ("printed_spa_9pt", 1, "printed", "spa", 9),
+        ("printed_spa_12pt", 1, "printed", "spa", 12),
+        ("printed_spa_18pt", 1, "printed", "spa", 18),
+        ("printed_eng_9pt", 1, "printed", "eng", 9),
+        ("printed_eng_12pt", 1, "printed", "eng", 12),
+        ("printed_eng_18pt", 1, "printed", "eng", 18),
+        ("noisy_spa_12pt", 5, "noisy", "spa", 12),
+        ("noisy_eng_12pt", 5, "noisy", "eng", 12),
+        ("handwriting_spa_12pt", 5, "handwriting", "spa", 12),
+        ("blank_5p", 5, "blank", "spa", 12),
+        ("mixed_spa_50p", 50, "mixed", "spa", None),
+        ("mixed_eng_100p", 100, "mixed", "eng", None),
+        ("mixed_spa_500p", 500, "mixed", "spa", None),
+    ],
+}
+
+FONT_SIZES = (9, 10, 12, 14, 18)
+
+
+def load_font(size_px: int):
+    """Fuente TrueType disponible en el sistema o, si no hay ninguna, la de Pillow."""
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size_px)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size_px)
+
+
+def make_lines(rng: random.Random, lang: str, font, max_width: int, n_lines: int) -> list:
+    """Frases aleatorias del vocabulario de `lang` ajustadas al ancho de la línea."""
+    words = WORDS[lang]
+    lines = []
+    for _ in range(n_lines):
+        line = []
+        while True:
+            word = rng.choice(words)
+            if not line and rng.random() < 0.5:
+                word = word.capitalize()
+            candidate = " ".join(line + [word])
+            if font.getlength(candidate) > max_width:
+                break
+            line.append(word)
+        if line and rng.random() < 0.3:
+            line[-1] += rng.choice((".", ",", ";"))
+        lines.append(" ".join(line))
+    return lines
+
+
+def draw_text_block(draw, rng, lang, font, size_px, x, y, width, height) -> list:
+    """Dibuja líneas de texto en el rectángulo y devuelve las líneas escritas."""
+    line_height = int(size_px * 1.5)
+    n_lines = max(0, height // line_height)
+    lines = make_lines(rng, lang, font, width, n_lines)
+    for i, line in enumerate(lines):
+        draw.text((x, y + i * line_height), line, fill=0, font=font)
+    return lines
+
+
+def draw_scribble(draw, rng, x, y, width, height, stroke):
+    """Trazos continuos de curvas de Bézier que imitan una línea manuscrita."""
+    cx = x
+    while cx < x + width - height:
+        points = []
+        word_width = rng.randint(height, height * 4)
+        p0 = (cx, y + height * rng.uniform(0.4, 0.8))
+        for _ in range(rng.randint(3, 7)):
+            p1 = (p0[0] + rng.uniform(0, word_width / 4), y + rng.uniform(0, height))
+            p2 = (p1[0] + rng.uniform(0, word_width / 4), y + rng.uniform(0, height))
+            p3 = (p2[0] + rng.uniform(0, word_width / 6), y + height * rng.uniform(0.3, 0.9))
+            for step in range(12):
+                t = step / 11
+                points.append((
+                    (1 - t) ** 3 * p0[0] + 3 * (1 - t) ** 2 * t * p1[0] + 3 * (1 - t) * t ** 2 * p2[0] + t ** 3 * p3[0],
+                    (1 - t) ** 3 * p0[1] + 3 * (1 - t) ** 2 * t * p1[1] + 3 * (1 - t) * t ** 2 * p2[1] + t ** 3 * p3[1],
+                ))
+            p0 = p3
+        draw.line(points, fill=rng.randint(0, 80), width=stroke, joint="curve")
+        cx = p0[0] + rng.randint(height // 2, height)
+
+
+def add_scan_noise(img: Image.Image, rng: random.Random, amount: float) -> Image.Image:
+    """
+    Motas, fondo grisáceo, rotación leve y desenfoque, como en un mal escaneo.
+    Todo sale de `rng` (no de Image.effect_noise) para que sea reproducible.
+    """
+    width, height = img.size
+    draw = ImageDraw.Draw(img)
+    for _ in range(int(width * height * amount * 0.001)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.choice((0, 0, 0, 1, 2))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=rng.randint(0, 120))
+    if amount >= 1:
+        img = img.point(lambda v: min(v, 235))
+        img = img.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, fillcolor=255)
+        img = img.filter(ImageFilter.GaussianBlur(radius=0.6 * amount))
+    return img
+
+
+def render_page(kind: str, rng: random.Random, lang: str, font_pt: int, dpi: int):
+    """Genera una página del tipo indicado. Devuelve (imagen, verdad de referencia)."""
+    width, height = (int(PAGE_INCHES[0] * dpi), int(PAGE_INCHES[1] * dpi))
+    img = Image.new("L", (width, height), 255)
+    truth = {"kind": kind, "lang": lang, "font_pt": font_pt, "text": "", "handwriting_regions": 0}
+    if kind == "blank":
+        return add_scan_noise(img, rng, 0.3), truth
+
+    draw = ImageDraw.Draw(img)
+    size_px = max(8, round(font_pt * dpi / 72))
+    font = load_font(size_px)
+    margin = dpi  # una pulgada
+    text_width = width - 2 * margin
+    y = margin
+    bottom = height - margin
+    lines = []
+
+    if kind == "handwriting":
+        # Alterna bloques impresos y regiones manuscritas
+        block = (bottom - margin) // 5
+        for i in range(5):
+            if i % 2:
+                draw_scribble(draw, rng, margin, y + size_px, text_width, int(size_px * 1.6), max(2, dpi // 60))
+                truth["handwriting_regions"] += 1
+            else:
+                lines += draw_text_block(draw, rng, lang, font, size_px, margin, y, text_width, block)
+            y += block
+    else:
+        lines = draw_text_block(draw, rng, lang, font, size_px, margin, y, text_width, bottom - y)
+
+    truth["text"] = "\n".join(lines)
+    if kind == "noisy":
+        img = add_scan_noise(img, rng, 1.0)
+    return img, truth
+
+
+def pick_kind(rng: random.Random, mix: dict) -> str:
+    kinds = list(mix)
+    return rng.choices(kinds, weights=[mix[k] for k in kinds])[0]
+
+
+def write_document(path: str, images, dpi: int):
+    """
+    Guarda las imágenes (un iterable, consumido sobre la marcha) como PDF.
+    Se escriben PDF parciales de CHUNK_PAGES páginas que luego se unen, para
+    no tener todo el documento en memoria.
+    """
+    with tempfile.TemporaryDirectory(prefix="pdf2md_corpus_") as tmp_dir:
+        chunks = []
+        pending = []
+
+        def flush():
+            chunk_path = os.path.join(tmp_dir, f"{len(chunks):05d}.pdf")
+            pending[0].save(chunk_path, "PDF", save_all=True, append_images=pending[1:], resolution=dpi)
+            chunks.append(chunk_path)
+            pending.clear()
+
+        for img in images:
+            pending.append(img)
+            if len(pending) == CHUNK_PAGES:
+                flush()
+        if pending:
+            flush()
+        if len(chunks) == 1:
+            os.replace(chunks[0], path)
+            return
+        merger = PdfMerger()
+        for chunk_path in chunks:
+            merger.append(chunk_path)
+        with open(path, "wb") as f:
+            merger.write(f)
+        merger.close()
+
+
+def generate_corpus(output_dir: str, profile: str = "quick", seed: int = 1234,
+                    dpi: int = DEFAULT_DPI, max_pages: int = None) -> dict:
+    """
+    Genera los PDF del perfil en `output_dir` y devuelve el manifiesto
+    (también escrito en `manifest.json`). `max_pages` recorta los documentos
+    más largos para pruebas rápidas.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Perfil no válido: {profile} (opciones: {', '.join(PROFILES)})")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {"profile": profile, "seed": seed, "dpi": dpi, "documents": []}
+
+    for doc_index, (name, n_pages, mix_name, lang, font_pt) in enumerate(PROFILES[profile]):
+        if max_pages:
+            n_pages = min(n_pages, max_pages)
+        rng = random.Random(seed * 1000 + doc_index)
+        truths = []
+
+        def pages():
+            for _ in range(n_pages):
+                kind = pick_kind(rng, KIND_MIX[mix_name])
+                img, truth = render_page(kind, rng, lang, font_pt or rng.choice(FONT_SIZES), dpi)
+                truths.append(truth)
+                yield img
+
+        filename = f"{name}.pdf"
+        write_document(os.path.join(output_dir, filename), pages(), dpi)
+        manifest["documents"].append({
+            "name": name,
+            "file": filename,
+            "lang": lang,
+            "pages": truths,
+        })
+        print(f"{filename}: {n_pages} páginas")
+
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Genera el corpus sintético del benchmark")
+    parser.add_argument("output_dir", help="Directorio donde se escriben los PDF y manifest.json")
+    parser.add_argument("--profile", choices=list(PROFILES), default="quick",
+                        help="Conjunto de documentos a generar (por defecto: quick)")
+    parser.add_argument("--seed", type=int, default=1234, help="Semilla (por defecto: 1234)")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI,
+                        help=f"Resolución de las páginas escaneadas (por defecto: {DEFAULT_DPI})")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Recorta los documentos a este número de páginas")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        generate_corpus(args.output_dir, profile=args.profile, seed=args.seed,
+                        dpi=args.dpi, max_pages=args.max_pages)
+    except Exception as e:
+        print(f"Error al generar el corpus: {e}", file=sys.stderr)
+        sys.exit(1)
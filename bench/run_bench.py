@@ -0,0 +1,484 @@
+"""
+Benchmark del conversor sobre el corpus generado con generate_corpus.py.
+
+Convierte cada documento del manifiesto con la CLI (process_pdf.py) y/o con
+la API HTTP (api.py) y mide, por documento:
+- páginas por segundo (tiempo de reloj de extremo a extremo);
+- latencia por etapa (render, preprocesado, traspaso, OCR, montaje del texto
+  y escritura)
+  a partir del informe que genera process_pdf_to_markdown;
+- pico de memoria residente (RSS);
+- precisión frente a la verdad de referencia: tasa de error por palabra
+  (WER), similitud por caracteres, texto espurio en páginas en blanco y
+  regiones manuscritas marcadas como '[texto manuscrito]'.
+
+El resultado se guarda en JSON para poder comparar ejecuciones con compare.py.
+
+Uso:
+    python bench/run_bench.py bench/corpus --target cli --output bench/results/base.json
+    python bench/run_bench.py bench/corpus --target api --start-api
+"""
+import argparse
+import difflib
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESS_PDF = os.path.join(REPO_DIR, "process_pdf.py")
+
+STAGES = ("render", "preprocess", "layout", "handoff", "ocr", "assemble", "write")
+PAGE_SECTION = re.compile(r"^## Página (\d+)\s*$", re.MULTILINE)
+HANDWRITING_MARK = "[texto manuscrito]"
+BLANK_MARK = "[página en blanco]"
+STATUS_POLL_INTERVAL = 0.5  # segundos
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# --- Precisión -------------------------------------------------------------
+
+def split_pages(markdown: str) -> dict:
+    """Separa el Markdown generado en {número de página: texto}."""
+    pages = {}
+    matches = list(PAGE_SECTION.finditer(markdown))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        body = markdown[match.end():end].strip()
+        if body.endswith("---"):
+            body = body[:-3]
+        pages[int(match.group(1))] = body.strip()
+    return pages
+
+
+def normalize_words(text: str) -> list:
+    return text.replace(HANDWRITING_MARK, " ").replace(BLANK_MARK, " ").split()
+
+
+def word_errors(reference: list, hypothesis: list) -> int:
+    """Distancia de edición (sustituciones, inserciones y borrados) entre listas de palabras."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1]
+
+
+def score_page(truth: dict, output: str) -> dict:
+    """Compara el texto extraído de una página con su verdad de referencia."""
+    reference = truth["text"].split()
+    hypothesis = normalize_words(output)
+    score = {
+        "kind": truth["kind"],
+        "reference_words": len(reference),
+        "word_errors": word_errors(reference, hypothesis),
+        "char_similarity": difflib.SequenceMatcher(
+            None, " ".join(reference), " ".join(hypothesis), autojunk=False).ratio(),
+    }
+    if truth["kind"] == "blank":
+        score["spurious_chars"] = len("".join(hypothesis))
+        score["marked_blank"] = BLANK_MARK in output
+    if truth.get("handwriting_regions"):
+        score["handwriting_regions"] = truth["handwriting_regions"]
+        score["handwriting_marked"] = min(output.count(HANDWRITING_MARK), truth["handwriting_regions"])
+    return score
+
+
+def summarize_accuracy(scores: list) -> dict:
+    """Agrega las puntuaciones por página, en total y por tipo de página."""
+    def aggregate(items):
+        ref_words = sum(s["reference_words"] for s in items)
+        summary = {
+            "pages": len(items),
+            "wer": sum(s["word_errors"] for s in items) / ref_words if ref_words else None,
+            "char_similarity": sum(s["char_similarity"] for s in items) / len(items) if items else None,
+        }
+        blanks = [s for s in items if "spurious_chars" in s]
+        if blanks:
+            summary["blank_spurious_chars"] = sum(s["spurious_chars"] for s in blanks)
+            summary["blank_recall"] = sum(1 for s in blanks if s["marked_blank"]) / len(blanks)
+        regions = sum(s.get("handwriting_regions", 0) for s in items)
+        if regions:
+            summary["handwriting_recall"] = sum(s.get("handwriting_marked", 0) for s in items) / regions
+        return summary
+
+    by_kind = {}
+    for score in scores:
+        by_kind.setdefault(score["kind"], []).append(score)
+    result = aggregate(scores)
+    result["by_kind"] = {kind: aggregate(items) for kind, items in sorted(by_kind.items())}
+    return result
+
+
+def score_document(document: dict, markdown: str) -> dict:
+    pages = split_pages(markdown)
+    scores = [score_page(truth, pages.get(i, "")) for i, truth in enumerate(document["pages"], 1)]
+    accuracy = summarize_accuracy(scores)
+    accuracy["missing_pages"] = sum(1 for i in range(1, len(document["pages"]) + 1) if i not in pages)
+    return accuracy
+
+
+# --- Métricas de tiempo y memoria -----------------------------------------
+
+def stage_latency(report: dict, pages: int) -> dict:
+    """Segundos totales y por página de cada etapa según el informe del conversor."""
+    timings = (report or {}).get("timings") or {}
+    return {
+        stage: {
+            "total_seconds": round(timings.get(stage, 0.0), 4),
+            "per_page_ms": round(1000 * timings.get(stage, 0.0) / pages, 2) if pages else None,
+        }
+        for stage in STAGES
+    }
+
+
+def process_tree_rss(root_pid: int) -> int:
+    """RSS actual (bytes) de un proceso y todos sus descendientes, leyendo /proc."""
+    children = {}
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * PAGE_SIZE
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+def run_result(target: str, document: dict, wall: float, report: dict, peak_rss: int, markdown: str) -> dict:
+    pages = len(document["pages"])
+    return {
+        "target": target,
+        "document": document["name"],
+        "pages": pages,
+        "wall_seconds": round(wall, 3),
+        "pages_per_second": round(pages / wall, 3) if wall else None,
+        "stages": stage_latency(report, pages),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss else None,
+        "ocr_pages": (report or {}).get("ocr_pages"),
+        "blank_pages": (report or {}).get("blank_pages"),
+        "text_pages": (report or {}).get("text_pages"),
+        "accuracy": score_document(document, markdown),
+    }
+
+
+# --- Ejecución por CLI -----------------------------------------------------
+
+def run_cli(pdf_path: str, document: dict, options: dict, work_dir: str) -> dict:
+    """
+    Convierte el documento lanzando process_pdf.py. El pico de RSS se muestrea
+    sobre el proceso y sus subprocesos de OCR mientras dura la conversión.
+    """
+    output_md = os.path.join(work_dir, f"{document['name']}.md")
+    report_path = os.path.join(work_dir, f"{document['name']}.report.json")
+    cmd = [sys.executable, PROCESS_PDF, pdf_path, output_md, "--report", report_path,
+           "--dpi", str(options["dpi"]), "--lang", options["lang"] or document["lang"],
+           "--workers", str(options["workers"]), "--mode", options["mode"]]
+    if options.get("ocr_backend"):
+        cmd += ["--ocr-backend", options["ocr_backend"]]
+    if options.get("preprocess"):
+        cmd += ["--preprocess", options["preprocess"]]
+    if options.get("blank_threshold") is not None:
+        cmd += ["--blank-threshold", str(options["blank_threshold"])]
+    if options.get("layout"):
+        cmd += ["--layout"]
+    if options.get("adaptive"):
+        cmd.append("--adaptive")
+
+    # stderr a un temporal: con una tubería que nadie lee mientras se muestrea
+    # el RSS, el proceso podría bloquearse al llenarla
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=stderr)
+        peak_rss = 0
+        while proc.poll() is None:
+            peak_rss = max(peak_rss, process_tree_rss(proc.pid))
+            time.sleep(0.05)
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"process_pdf.py terminó con código {proc.returncode}: {stderr.read().strip()[-500:]}")
+
+    with open(report_path, encoding="utf-8") as f:
+        report = json.load(f)
+    with open(output_md, encoding="utf-8") as f:
+        markdown = f.read()
+    return run_result("cli", document, wall, report, peak_rss, markdown)
+
+
+# --- Ejecución por la API HTTP ---------------------------------------------
+
+def http_request(url: str, data: bytes = None, headers: dict = None, timeout: float = 60):
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def encode_multipart(fields: dict, file_field: str, file_path: str):
+    """Cuerpo multipart/form-data con los campos y el PDF (sin dependencias externas)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    with open(file_path, "rb") as f:
+        content = f.read()
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{os.path.basename(file_path)}"\r\nContent-Type: application/pdf\r\n\r\n'.encode()
+        + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def run_api(pdf_path: str, document: dict, options: dict, api_url: str, api_pid: int = None,
+            timeout: float = 3600) -> dict:
+    """
+    Sube el documento a /process, sigue /status hasta que termina y descarga
+    /result. El tiempo incluye la subida y la descarga. El RSS sólo se mide
+    si se conoce el PID del servidor (--start-api o --api-pid).
+    """
+    fields = {"dpi": options["dpi"], "lang": options["lang"] or document["lang"],
+              "mode": options["mode"], "workers": options["workers"],
+              "adaptive": str(bool(options.get("adaptive"))).lower()}
+    if options.get("preprocess"):
+        fields["preprocess"] = options["preprocess"]
+    if options.get("blank_threshold") is not None:
+        fields["blank_threshold"] = str(options["blank_threshold"])
+    if options.get("layout"):
+        fields["layout"] = "true"
+    body, content_type = encode_multipart(fields, "file", pdf_path)
+
+    start = time.perf_counter()
+    peak_rss = process_tree_rss(api_pid) if api_pid else 0
+    while True:
+        try:
+            job = json.loads(http_request(f"{api_url}/process", body, {"Content-Type": content_type}))
+            break
+        except urllib.error.HTTPError as e:
+            # Cola llena: esperar lo que indique el servidor
+            if e.code not in (429, 503):
+                raise
+            time.sleep(float(e.headers.get("Retry-After", 5)))
+    job_id = job["job_id"]
+
+    while True:
+        status = json.loads(http_request(f"{api_url}/status/{job_id}"))
+        if api_pid:
+            peak_rss = max(peak_rss, process_tree_rss(api_pid))
+        if status["status"] in ("completed", "error"):
+            break
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"El trabajo {job_id} no terminó en {timeout} s")
+        time.sleep(STATUS_POLL_INTERVAL)
+    if status["status"] == "error":
+        raise RuntimeError(f"El trabajo {job_id} terminó con error: {status.get('message')}")
+
+    markdown = http_request(f"{api_url}/result/{job_id}").decode("utf-8")
+    wall = time.perf_counter() - start
+    result = run_result("api", document, wall, status.get("report"), peak_rss, markdown)
+    if status.get("cache"):
+        # Resultado servido desde la caché: los tiempos no son del OCR
+        result["cache"] = status["cache"]
+    return result
+
+
+def start_api_server(port: int, jobs_dir: str):
+    """Arranca api.py con uvicorn y un JOBS_DIR propio (caché vacía) y espera a que responda."""
+    env = dict(os.environ, JOBS_DIR=jobs_dir, CACHE_DIR=os.path.join(jobs_dir, "cache"))
+    env.pop("JOBS_DB", None)
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--port", str(port)],
+                            cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"La API terminó al arrancar (código {proc.returncode})")
+        try:
+            http_request(f"{url}/retention", timeout=2)
+            return proc, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("La API no respondió en 60 s")
+
+
+# --- Informe --------------------------------------------------------------
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize_runs(runs: list) -> dict:
+    """Totales por destino (cli/api): páginas/s globales, etapas por página, RSS y precisión."""
+    summary = {}
+    for target in sorted({run["target"] for run in runs}):
+        ok = [run for run in runs if run["target"] == target and "error" not in run]
+        if not ok:
+            continue
+        pages = sum(run["pages"] for run in ok)
+        wall = sum(run["wall_seconds"] for run in ok)
+
+        def weighted(key):
+            # Media ponderada por páginas de los documentos que tienen ese valor
+            scored = [run for run in ok if run["accuracy"].get(key) is not None]
+            scored_pages = sum(run["pages"] for run in scored)
+            if not scored_pages:
+                return None
+            return round(sum(run["accuracy"][key] * run["pages"] for run in scored) / scored_pages, 4)
+
+        summary[target] = {
+            "documents": len(ok),
+            "pages": pages,
+            "wall_seconds": round(wall, 3),
+            "pages_per_second": round(pages / wall, 3) if wall else None,
+            "stages_per_page_ms": {
+                stage: round(1000 * sum(run["stages"][stage]["total_seconds"] for run in ok) / pages, 2)
+                for stage in STAGES
+            },
+            "peak_rss_mb": max((run["peak_rss_mb"] or 0 for run in ok), default=None),
+            "wer": weighted("wer"),
+            "char_similarity": weighted("char_similarity"),
+        }
+    return summary
+
+
+def run_benchmark(corpus_dir: str, targets: list, options: dict, api_url: str = None,
+                  api_pid: int = None, documents: list = None, repeat: int = 1) -> dict:
+    with open(os.path.join(corpus_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    selected = [d for d in manifest["documents"] if not documents or d["name"] in documents]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "corpus": {"profile": manifest.get("profile"), "seed": manifest.get("seed"),
+                       "dpi": manifest.get("dpi")},
+            "targets": targets,
+            "options": options,
+            "repeat": repeat,
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pdf2md_bench_") as work_dir:
+        for document in selected:
+            pdf_path = os.path.join(corpus_dir, document["file"])
+            for target in targets:
+                for iteration in range(repeat):
+                    try:
+                        if target == "cli":
+                            run = run_cli(pdf_path, document, options, work_dir)
+                        else:
+                            run = run_api(pdf_path, document, options, api_url, api_pid)
+                    except Exception as e:
+                        run = {"target": target, "document": document["name"],
+                               "pages": len(document["pages"]), "error": str(e)}
+                    run["iteration"] = iteration
+                    results["runs"].append(run)
+                    if "error" in run:
+                        print(f"[{target}] {document['name']}: error: {run['error']}", file=sys.stderr)
+                    else:
+                        wer = run["accuracy"]["wer"]
+                        print(f"[{target}] {document['name']}: {run['pages']} páginas, "
+                              f"{run['pages_per_second']} pág/s, RSS {run['peak_rss_mb']} MB, "
+                              f"WER {wer if wer is None else round(wer, 3)}")
+
+    results["summary"] = summarize_runs(results["runs"])
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de PDF2MD sobre el corpus sintético")
+    parser.add_argument("corpus_dir", help="Directorio generado por generate_corpus.py")
+    parser.add_argument("--target", action="append", choices=("cli", "api"),
+                        help="Qué medir: la CLI, la API HTTP o ambas (se puede repetir; por defecto: cli)")
+    parser.add_argument("--output", default=None,
+                        help="Fichero JSON de resultados (por defecto: bench/results/<fecha>.json)")
+    parser.add_argument("--document", action="append",
+                        help="Limita el benchmark a este documento del manifiesto (se puede repetir)")
+    parser.add_argument("--repeat", type=int, default=1, help="Ejecuciones por documento (por defecto: 1)")
+    parser.add_argument("--dpi", type=int, default=300, help="DPI de renderizado (por defecto: 300)")
+    parser.add_argument("--lang", default=None,
+                        help="Idioma de Tesseract (por defecto: el de cada documento del manifiesto)")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos de OCR (por defecto: 1)")
+    parser.add_argument("--mode", default="auto", help="Modo de extracción (por defecto: auto)")
+    parser.add_argument("--adaptive", action="store_true", help="Usa el modo adaptativo")
+    parser.add_argument("--ocr-backend", default=None, help="Motor de OCR para la CLI")
+    parser.add_argument("--preprocess", default=None,
+                        help="Pasos de preprocesado antes del OCR ('none', 'all' o lista separada por comas; "
+                             "por defecto: el del conversor)")
+    parser.add_argument("--blank-threshold", type=float, default=None,
+                        help="Proporción de tinta bajo la que una página se da por en blanco "
+                             "(0 desactiva la detección; por defecto: la del conversor)")
+    parser.add_argument("--layout", action="store_true",
+                        help="Segmenta las páginas en bloques antes del OCR (manuscritos sin OCR)")
+    parser.add_argument("--api-url", default="http://127.0.0.1:5001", help="URL de la API ya en marcha")
+    parser.add_argument("--api-pid", type=int, default=None,
+                        help="PID del servidor de la API para medir su RSS (si corre en esta máquina)")
+    parser.add_argument("--start-api", action="store_true",
+                        help="Arranca una API local con JOBS_DIR temporal en lugar de usar --api-url")
+    parser.add_argument("--api-port", type=int, default=5099, help="Puerto de la API con --start-api")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    targets = args.target or ["cli"]
+    options = {"dpi": args.dpi, "lang": args.lang, "workers": args.workers, "mode": args.mode,
+               "adaptive": args.adaptive, "ocr_backend": args.ocr_backend, "preprocess": args.preprocess,
+               "blank_threshold": args.blank_threshold, "layout": args.layout}
+    output = args.output or os.path.join(
+        REPO_DIR, "bench", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+
+    server = None
+    api_url, api_pid = args.api_url.rstrip("/"), args.api_pid
+    with tempfile.TemporaryDirectory(prefix="pdf2md_bench_api_") as jobs_dir:
+        try:
+            if "api" in targets and args.start_api:
+                server, api_url = start_api_server(args.api_port, jobs_dir)
+                api_pid = server.pid
+            results = run_benchmark(args.corpus_dir, targets, options, api_url=api_url, api_pid=api_pid,
+                                    documents=args.document, repeat=args.repeat)
+        except Exception as e:
+            print(f"Error durante el benchmark: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {output}")
+    sys.exit(1 if any("error" in run for run in results["runs"]) else 0)
@@ -0,0 +1,78 @@
+"""
+Difusión de eventos de los trabajos (Server-Sent Events).
+
+Los hilos que procesan trabajos publican aquí los cambios de estado, el
+progreso por página y las líneas de log; cada cliente suscrito a un trabajo
+tiene su propia asyncio.Queue en el bucle de eventos del servidor. La
+publicación es segura desde cualquier hilo (`loop.call_soon_threadsafe`) y
+no bloquea nunca: si un cliente no consume, se descartan sus eventos más
+antiguos en lugar de acumularlos.
+"""
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+# Eventos pendientes por cliente antes de empezar a descartar
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "200"))
+# Segundos sin eventos tras los que se envía un comentario para mantener viva la conexión
+SSE_KEEPALIVE = float(os.environ.get("SSE_KEEPALIVE", "15"))
+# Estados tras los que ya no habrá más eventos
+FINAL_STATUSES = ("completed", "error")
+
+_subscribers: Dict[str, set] = {}
+_lock = threading.Lock()
+
+
+def subscribe(job_id: str) -> asyncio.Queue:
+    """Registra un cliente para los eventos de `job_id`. Debe llamarse desde el bucle de eventos."""
+    subscription = (asyncio.get_running_loop(), asyncio.Queue(maxsize=EVENT_QUEUE_SIZE))
+    with _lock:
+        _subscribers.setdefault(job_id, set()).add(subscription)
+    return subscription[1]
+
+
+def unsubscribe(job_id: str, events: asyncio.Queue):
+    """Da de baja la cola `events` devuelta por `subscribe`."""
+    with _lock:
+        subscriptions = _subscribers.get(job_id, set())
+        for subscription in [s for s in subscriptions if s[1] is events]:
+            subscriptions.discard(subscription)
+        if not subscriptions:
+            _subscribers.pop(job_id, None)
+
+
+def subscriber_count(job_id: Optional[str] = None) -> int:
+    """Clientes suscritos a un trabajo o, sin `job_id`, en total."""
+    with _lock:
+        if job_id is not None:
+            return len(_subscribers.get(job_id, ()))
+        return sum(len(s) for s in _subscribers.values())
+
+
+def _offer(events: asyncio.Queue, item):
+    """Encola sin bloquear; si la cola está llena descarta el evento más antiguo."""
+    if events.full():
+        try:
+            events.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    events.put_nowait(item)
+
+
+def publish(job_id: str, event: str, data: Dict):
+    """Envía un evento a todos los clientes de `job_id`. Se puede llamar desde cualquier hilo."""
+    with _lock:
+        subscriptions = list(_subscribers.get(job_id, ()))
+    for loop, events in subscriptions:
+        try:
+            loop.call_soon_threadsafe(_offer, events, (event, data))
+        except RuntimeError:
+            # El bucle ya se ha cerrado (parada del servidor)
+            pass
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """Serializa un evento en el formato text/event-stream."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
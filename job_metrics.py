@@ -0,0 +1,111 @@
+"""
+Métricas Prometheus del servicio transcriber.
+
+Se registran al terminar cada trabajo (a partir de su desglose de tiempos) y
+se exponen en `/metrics` (api.py):
+- pdf2md_job_stage_seconds{stage}: segundos por trabajo en cada etapa
+  (subida, recuento de páginas, espera en cola, detección de páginas en
+  blanco, render, preprocesado, segmentación en bloques, traspaso, OCR,
+  montaje del texto, escritura del Markdown, persistencia y total).
+- pdf2md_page_stage_seconds{stage}: segundos por página de las etapas de OCR.
+- pdf2md_jobs_total{status,cache}, pdf2md_pages_total{path}.
+- pdf2md_job_pages_per_second y pdf2md_job_peak_rss_bytes.
+Las métricas de estado (profundidad de la cola, trabajos activos) son
+Gauge que api.py enlaza con su propio estado.
+"""
+import os
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Etapas de un trabajo, en orden, tal como aparecen en `timings` de /status
+JOB_STAGES = ("upload", "page_count", "queue_wait", "blank_check", "render", "preprocess", "layout", "handoff",
+              "ocr", "second_pass", "assemble", "write", "persist")
+# Etapas que process_pdf mide página a página
+PAGE_STAGES = ("render", "preprocess", "layout", "handoff", "ocr", "assemble")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+JOB_STAGE_SECONDS = Histogram(
+    "pdf2md_job_stage_seconds", "Segundos por trabajo en cada etapa", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+PAGE_STAGE_SECONDS = Histogram(
+    "pdf2md_page_stage_seconds", "Segundos por página en cada etapa de OCR", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+JOBS_TOTAL = Counter("pdf2md_jobs_total", "Trabajos terminados", ["status", "cache"])
+PAGES_TOTAL = Counter("pdf2md_pages_total", "Páginas procesadas según la vía usada", ["path"])
+JOB_PAGES_PER_SECOND = Histogram(
+    "pdf2md_job_pages_per_second", "Páginas por segundo de cada trabajo procesado",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100))
+JOB_PEAK_RSS_BYTES = Histogram(
+    "pdf2md_job_peak_rss_bytes", "Pico de memoria residente del servicio durante cada trabajo",
+    buckets=tuple(mb * 1024 * 1024 for mb in (128, 256, 512, 1024, 2048, 4096, 8192, 16384)))
+QUEUE_DEPTH = Gauge("pdf2md_queue_depth", "Trabajos esperando en la cola")
+ACTIVE_JOBS = Gauge("pdf2md_active_jobs", "Hilos del pool procesando un trabajo")
+JOB_WORKERS = Gauge("pdf2md_job_workers", "Hilos del pool de trabajos")
+OCR_WORKERS = Gauge("pdf2md_ocr_workers", "Procesos máximos del pool de OCR compartido")
+
+
+def process_tree_rss(root_pid: int = None) -> int:
+    """
+    Memoria residente (bytes) del proceso y todos sus descendientes (los
+    procesos del pool de OCR), leyendo /proc. Devuelve 0 si no hay /proc.
+    """
+    root_pid = root_pid or os.getpid()
+    children = {}
+    rss = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * _PAGE_SIZE
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+def job_timings(job: dict) -> dict:
+    """
+    Desglose de tiempos de un trabajo: las etapas propias del servicio
+    (`job["timings"]`) más las de conversión del informe de process_pdf.
+    """
+    timings = dict(job.get("timings") or {})
+    for stage, seconds in ((job.get("report") or {}).get("timings") or {}).items():
+        timings[stage] = seconds
+    return {stage: round(timings[stage], 4) for stage in JOB_STAGES + ("total",) if stage in timings}
+
+
+def observe_job(job: dict):
+    """Registra en las métricas un trabajo terminado (completado o con error)."""
+    JOBS_TOTAL.labels(status=job["status"], cache=job.get("cache") or "miss").inc()
+    for stage, seconds in job_timings(job).items():
+        JOB_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+    report = job.get("report") or {}
+    for page in report.get("pages", ()):
+        if page.get("timings"):
+            for stage in PAGE_STAGES:
+                if stage in page["timings"]:
+                    PAGE_STAGE_SECONDS.labels(stage=stage).observe(page["timings"][stage])
+    if report:
+        PAGES_TOTAL.labels(path="ocr").inc(report.get("ocr_pages") or 0)
+        PAGES_TOTAL.labels(path="text").inc(report.get("text_pages") or 0)
+        PAGES_TOTAL.labels(path="blank").inc(report.get("blank_pages") or 0)
+
+    if job.get("pages_per_second"):
+        JOB_PAGES_PER_SECOND.observe(job["pages_per_second"])
+    if job.get("peak_rss_bytes"):
+        JOB_PEAK_RSS_BYTES.observe(job["peak_rss_bytes"])
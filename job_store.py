@@ -0,0 +1,373 @@
+"""
+Almacén persistente de trabajos en SQLite.
+
+Sustituye a los ficheros `{job_id}.json` / `{job_id}_result.txt`: cada
+trabajo es una fila con las columnas por las que se consulta (estado y
+fechas, indexadas) y el resto de campos serializados en JSON. El Markdown
+no se guarda aquí; sigue en su fichero `md_path` y se lee sólo al servirlo.
+
+La base de datos usa el modo WAL, de modo que las lecturas (status, result)
+no esperan a las escrituras de los hilos que procesan trabajos. Cada hilo
+tiene su propia conexión.
+
+La tabla hace también de cola compartida entre réplicas del servicio (mismo
+JOBS_DIR): un trabajo se encola marcando `queued_at` y un nodo lo reclama
+con una concesión (`lease_owner`, `lease_expires`) que renueva mientras lo
+procesa. Reclamar, encolar y renovar son transacciones IMMEDIATE, así que
+dos nodos nunca se llevan el mismo trabajo; si un nodo cae, su concesión
+caduca y otro retoma el trabajo. WAL necesita que todos los nodos vean el
+fichero en la misma máquina; en un sistema de ficheros de red hay que usar
+JOBS_DB_JOURNAL_MODE=DELETE (bloqueos de fichero de SQLite).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+JOBS_DB = os.environ.get("JOBS_DB", os.path.join(os.environ.get("JOBS_DIR", "/app/jobs"), "jobs.sqlite3"))
+JOURNAL_MODE = os.environ.get("JOBS_DB_JOURNAL_MODE", "WAL")
+
+# Campos con columna propia; el resto va en `data`. `accessed_at` es la
+# última descarga del resultado (o la última actualización si no se ha
+# descargado) y ordena la expulsión por cuota de disco
+_COLUMNS = ("id", "status", "created_at", "updated_at", "accessed_at")
+_SELECT = "SELECT id, status, created_at, updated_at, accessed_at, data FROM jobs"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    accessed_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS job_groups (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_groups_created_at ON job_groups (created_at);
+"""
+
+_ACCESS_INDEX = "CREATE INDEX IF NOT EXISTS jobs_accessed_at ON jobs (status, accessed_at)"
+
+# Columnas de la cola compartida. No forman parte del trabajo que se guarda
+# con save_job (que no las modifica): sólo las cambian las funciones de la cola
+_QUEUE_COLUMNS = (
+    ("queued_at", "REAL"),
+    ("lease_owner", "TEXT"),
+    ("lease_expires", "REAL"),
+    ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("in_batch", "INTEGER NOT NULL DEFAULT 0"),
+)
+_QUEUE_INDEX = "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, queued_at)"
+# Trabajos en cola: pendientes y ya encolados (los de un lote esperan sin
+# `queued_at` hasta que hay hueco para ellos)
+_QUEUED = "status = 'pending' AND queued_at IS NOT NULL"
+# Trabajos en proceso cuya concesión ha caducado (o de antes de las concesiones)
+_EXPIRED = "status = 'processing' AND (lease_expires IS NULL OR lease_expires < ?)"
+
+
+
+class LeaseLost(Exception):
+    """El nodo ha perdido la concesión del trabajo: otro nodo lo ha retomado."""
+
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Conexión del hilo actual, creando el esquema la primera vez."""
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(JOBS_DB) or ".", exist_ok=True)
+        conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+        conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(_SCHEMA)
+                # Bases de datos creadas antes de existir accessed_at
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+                if "accessed_at" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN accessed_at REAL")
+                    conn.execute("UPDATE jobs SET accessed_at = updated_at")
+                # Bases de datos creadas antes de la cola compartida
+                if "queued_at" not in columns:
+                    for name, definition in _QUEUE_COLUMNS:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+                    # Lo que estaba esperando entra en la cola por orden de llegada
+                    conn.execute("UPDATE jobs SET queued_at = created_at WHERE status = 'pending'")
+                conn.execute(_ACCESS_INDEX)
+                conn.execute(_QUEUE_INDEX)
+                _initialized = True
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _transaction():
+    """
+    Transacción con el bloqueo de escritura tomado desde el principio
+    (BEGIN IMMEDIATE): lo que se lee dentro no cambia hasta el COMMIT,
+    tampoco desde otros procesos.
+    """
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _row_to_job(row) -> Dict:
+    job = json.loads(row[5])
+    job.update(zip(_COLUMNS, row[:5]))
+    return job
+
+
+def save_job(job: Dict, owner: Optional[str] = None):
+    """
+    Inserta o actualiza un trabajo sin tocar su estado en la cola. Con
+    `owner` sólo se actualiza si ese nodo tiene la concesión del trabajo;
+    si no la tiene (la perdió y otro nodo lo ha retomado) lanza LeaseLost.
+    """
+    data = json.dumps({k: v for k, v in job.items() if k not in _COLUMNS}, ensure_ascii=False)
+    accessed_at = max(job.get("accessed_at") or 0, job["updated_at"])
+    if owner is not None:
+        updated = _connect().execute(
+            "UPDATE jobs SET status = ?, created_at = ?, updated_at = ?, accessed_at = ?, data = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (job["status"], job["created_at"], job["updated_at"], accessed_at, data, job["id"], owner)
+        ).rowcount
+        if updated != 1:
+            raise LeaseLost(job["id"])
+        return
+    _connect().execute(
+        "INSERT INTO jobs (id, status, created_at, updated_at, accessed_at, data, in_batch) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET status = excluded.status, created_at = excluded.created_at, "
+        "updated_at = excluded.updated_at, accessed_at = excluded.accessed_at, data = excluded.data",
+        (job["id"], job["status"], job["created_at"], job["updated_at"], accessed_at, data,
+         1 if job.get("group_id") else 0)
+    )
+
+
+def load_job(job_id: str) -> Optional[Dict]:
+    """Devuelve el trabajo o None si no existe."""
+    row = _connect().execute(f"{_SELECT} WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def touch_job(job_id: str, accessed_at: float):
+    """Marca la última descarga del resultado de un trabajo."""
+    _connect().execute("UPDATE jobs SET accessed_at = ? WHERE id = ?", (accessed_at, job_id))
+
+
+def delete_job(job_id: str):
+    _connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+def jobs_created_before(cutoff: float, limit: Optional[int] = None) -> List[Dict]:
+    """Trabajos creados antes de `cutoff` (timestamp), los más antiguos primero."""
+    query = f"{_SELECT} WHERE created_at < ? ORDER BY created_at"
+    params = [cutoff]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return [_row_to_job(row) for row in _connect().execute(query, params)]
+
+
+def all_jobs() -> List[Dict]:
+    """Todos los trabajos del almacén, en cualquier estado."""
+    return [_row_to_job(row) for row in _connect().execute(_SELECT)]
+
+
+def jobs_with_status(statuses: Iterable[str]) -> List[Dict]:
+    """Trabajos en alguno de los estados indicados."""
+    statuses = list(statuses)
+    placeholders = ", ".join("?" for _ in statuses)
+    rows = _connect().execute(f"{_SELECT} WHERE status IN ({placeholders})", statuses)
+    return [_row_to_job(row) for row in rows]
+
+
+def jobs_by_last_access(statuses: Iterable[str], limit: Optional[int] = None) -> List[Dict]:
+    """Trabajos en los estados indicados, del menos al más recientemente descargado."""
+    statuses = list(statuses)
+    placeholders = ", ".join("?" for _ in statuses)
+    query = f"{_SELECT} WHERE status IN ({placeholders}) ORDER BY accessed_at"
+    if limit is not None:
+        query += " LIMIT ?"
+        statuses.append(limit)
+    return [_row_to_job(row) for row in _connect().execute(query, statuses)]
+
+
+def load_jobs(job_ids: Iterable[str]) -> List[Dict]:
+    """Varios trabajos por ID en una sola consulta (los que no existen se omiten)."""
+    job_ids = list(job_ids)
+    jobs = []
+    # SQLite limita el número de parámetros por consulta
+    for start in range(0, len(job_ids), 500):
+        chunk = job_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        jobs.extend(_row_to_job(row) for row in _connect().execute(f"{_SELECT} WHERE id IN ({placeholders})", chunk))
+    return jobs
+
+
+def save_group(group: Dict):
+    """Inserta o actualiza un grupo de trabajos (lote)."""
+    data = {k: v for k, v in group.items() if k not in ("id", "created_at")}
+    _connect().execute(
+        "INSERT OR REPLACE INTO job_groups (id, created_at, data) VALUES (?, ?, ?)",
+        (group["id"], group["created_at"], json.dumps(data, ensure_ascii=False))
+    )
+
+
+def load_group(group_id: str) -> Optional[Dict]:
+    row = _connect().execute("SELECT id, created_at, data FROM job_groups WHERE id = ?", (group_id,)).fetchone()
+    if not row:
+        return None
+    group = json.loads(row[2])
+    group.update(id=row[0], created_at=row[1])
+    return group
+
+
+def delete_groups_before(cutoff: float) -> int:
+    """Borra los grupos creados antes de `cutoff`. Devuelve cuántos."""
+    return _connect().execute("DELETE FROM job_groups WHERE created_at < ?", (cutoff,)).rowcount
+
+
+def count_jobs() -> int:
+    return _connect().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+def enqueue_job(job_id: str, max_pending: int) -> bool:
+    """
+    Encola un trabajo pendiente si hay menos de `max_pending` trabajos
+    individuales (no de lotes) en la cola. Devuelve False si está llena.
+    """
+    with _transaction() as conn:
+        queued = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED} AND in_batch = 0").fetchone()[0]
+        if queued >= max_pending:
+            return False
+        conn.execute("UPDATE jobs SET queued_at = ? WHERE id = ? AND status = 'pending'", (time.time(), job_id))
+    return True
+
+
+def count_queued(batch: Optional[bool] = None) -> int:
+    """Trabajos en la cola: todos o, con `batch`, sólo los de lotes o sólo los individuales."""
+    query = f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED}"
+    if batch is not None:
+        query += f" AND in_batch = {int(batch)}"
+    return _connect().execute(query).fetchone()[0]
+
+
+def queued_job_ids() -> List[str]:
+    """IDs de los trabajos en cola, en el orden en que se van a reclamar."""
+    return [row[0] for row in _connect().execute(
+        f"SELECT id FROM jobs WHERE {_QUEUED} ORDER BY queued_at, created_at")]
+
+
+def queue_position(job_id: str) -> Optional[int]:
+    """Posición (empezando en 1) de un trabajo en la cola, o None si no está en ella."""
+    conn = _connect()
+    row = conn.execute(f"SELECT queued_at, created_at FROM jobs WHERE id = ? AND {_QUEUED}", (job_id,)).fetchone()
+    if row is None:
+        return None
+    ahead = conn.execute(
+        f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED} AND (queued_at < ? OR (queued_at = ? AND created_at < ?))",
+        (row[0], row[0], row[1])
+    ).fetchone()[0]
+    return ahead + 1
+
+
+def claim_job(owner: str, lease_seconds: float, batch_slots: int, max_attempts: int) -> Optional[Dict]:
+    """
+    Reclama para `owner` el siguiente trabajo con una concesión de
+    `lease_seconds`: primero los que se estaban procesando en un nodo cuya
+    concesión caducó (si no han agotado `max_attempts` intentos) y después
+    los de la cola, por orden de llegada. Antes, si hay menos de
+    `batch_slots` trabajos de lotes en la cola, se encolan los siguientes.
+
+    Devuelve el trabajo (ya en estado 'processing', con `attempts`, el
+    número de este intento) o None si no hay nada que hacer.
+    """
+    now = time.time()
+    with _transaction() as conn:
+        queued_batch = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED} AND in_batch = 1").fetchone()[0]
+        if queued_batch < batch_slots:
+            conn.execute(
+                "UPDATE jobs SET queued_at = ? WHERE id IN (SELECT id FROM jobs WHERE status = 'pending' "
+                "AND queued_at IS NULL AND in_batch = 1 ORDER BY created_at LIMIT ?)",
+                (now, batch_slots - queued_batch)
+            )
+        row = conn.execute(
+            f"SELECT id, attempts FROM jobs WHERE ({_EXPIRED} AND attempts < ?) OR ({_QUEUED}) "
+            "ORDER BY status = 'pending', queued_at, created_at LIMIT 1",
+            (now, max_attempts)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'processing', lease_owner = ?, lease_expires = ?, attempts = ? WHERE id = ?",
+            (owner, now + lease_seconds, row[1] + 1, row[0])
+        )
+        job = _row_to_job(conn.execute(f"{_SELECT} WHERE id = ?", (row[0],)).fetchone())
+    job["attempts"] = row[1] + 1
+    return job
+
+
+def renew_lease(job_id: str, owner: str, lease_seconds: float, **fields) -> bool:
+    """
+    Prorroga la concesión de un trabajo en proceso y guarda de paso los
+    `fields` indicados (progreso, páginas escritas) para que cualquier nodo
+    pueda informar de ellos. Devuelve False si `owner` ya no la tiene.
+    """
+    with _transaction() as conn:
+        row = conn.execute("SELECT data FROM jobs WHERE id = ? AND lease_owner = ? AND status = 'processing'",
+                           (job_id, owner)).fetchone()
+        if row is None:
+            return False
+        data = json.loads(row[0])
+        data.update(fields)
+        conn.execute("UPDATE jobs SET lease_expires = ?, data = ? WHERE id = ?",
+                     (time.time() + lease_seconds, json.dumps(data, ensure_ascii=False), job_id))
+    return True
+
+
+def release_lease(job_id: str, owner: str):
+    """Libera la concesión de un trabajo terminado."""
+    _connect().execute("UPDATE jobs SET lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                       (job_id, owner))
+
+
+def abandoned_jobs(max_attempts: int) -> List[Dict]:
+    """Trabajos con la concesión caducada que ya agotaron sus `max_attempts` intentos."""
+    rows = _connect().execute(f"{_SELECT} WHERE {_EXPIRED} AND attempts >= ?", (time.time(), max_attempts))
+    return [_row_to_job(row) for row in rows]
+
+
+def fail_abandoned_job(job: Dict, max_attempts: int) -> bool:
+    """
+    Guarda como fallido un trabajo de abandoned_jobs (con su `status` y
+    mensaje ya puestos) y le quita la concesión, pero sólo si sigue abandonado:
+    devuelve False si entretanto otro nodo lo ha retomado, terminado o ya dado
+    por fallido, de modo que cada trabajo se da por fallido una sola vez.
+    """
+    data = json.dumps({k: v for k, v in job.items() if k not in _COLUMNS}, ensure_ascii=False)
+    return _connect().execute(
+        "UPDATE jobs SET status = ?, updated_at = ?, accessed_at = ?, data = ?, "
+        f"lease_owner = NULL, lease_expires = NULL WHERE id = ? AND {_EXPIRED} AND attempts >= ?",
+        (job["status"], job["updated_at"], job["updated_at"], data, job["id"], time.time(), max_attempts)
+    ).rowcount == 1
@@ -0,0 +1,303 @@
+"""
+Segmentación de la página en bloques antes del OCR (OpenCV + numpy).
+
+En lugar de pasar la página entera a Tesseract:
+1. Se calcula la máscara de tinta y se descartan las motas (componentes
+   conexas mucho más pequeñas que una letra).
+2. La página se corta recursivamente por los huecos de los perfiles de
+   proyección (XY-cut): en cada región, por los huecos entre columnas o
+   entre párrafos, según en qué dirección esté el hueco más ancho. Las
+   hojas son los bloques, ya en orden de lectura (de arriba abajo y, dentro
+   de cada franja, de izquierda a derecha).
+3. Cada bloque se clasifica por la forma de sus componentes de tinta: la
+   escritura a mano tiene trazos finos y ligados (componentes anchas, con
+   poca tinta dentro de su caja y alturas irregulares), la letra impresa
+   son glifos sueltos, compactos y de altura regular. Los bloques
+   manuscritos se marcan sin pasar por el OCR.
+4. Los bloques impresos se reconocen en paralelo (hilos; Tesseract libera
+   el GIL) con el modo de segmentación adecuado: una línea (PSM 7) o un
+   bloque uniforme de texto (PSM 6). Los hilos son de un pool que dura lo
+   que el proceso, de modo que cada uno conserva su motor de OCR cargado
+   (ver ocr_backends) entre páginas.
+
+Las páginas sin contraste entre tinta y fondo (ruido, fondos uniformes) no
+se segmentan, y los bloques más pequeños que una letra se descartan: ni unas
+ni otros acaban en cientos de llamadas a Tesseract.
+
+La segmentación se activa con la variable de entorno OCR_LAYOUT o con el
+parámetro `layout`.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from preprocess import to_gray, ink_mask, MIN_GLYPHS
+
+DEFAULT_LAYOUT = os.environ.get("OCR_LAYOUT", "0").lower() in ("1", "true", "yes")
+# Hilos para los bloques de una página (el pool de páginas ya reparte procesos)
+DEFAULT_LAYOUT_WORKERS = int(os.environ.get("OCR_LAYOUT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Huecos mínimos (en alturas de letra) para cortar entre párrafos y entre
+# columnas, margen que se deja alrededor de cada bloque y área mínima (en
+# alturas de letra al cuadrado) de una componente para no tomarla por una mota
+ROW_GAP = 1.8
+COLUMN_GAP = 2.5
+BLOCK_MARGIN = 0.5
+MIN_SPECK_AREA = 0.05
+# Área mínima de un bloque, en alturas de letra al cuadrado (una cifra suelta
+# ronda 0.6): lo más pequeño son restos de ruido que no merecen un OCR
+MIN_BLOCK_AREA = 0.5
+# Diferencia mínima (niveles de gris) entre la tinta y el fondo que separa
+# Otsu: por debajo la página es ruido o un fondo uniforme, no texto
+MIN_INK_CONTRAST = 50
+# Altura de letra supuesta si la página tiene muy pocas letras para estimarla
+FALLBACK_X_HEIGHT_RATIO = 1 / 150
+
+# Modos de segmentación de Tesseract para los bloques impresos
+PSM_SINGLE_LINE = 7
+PSM_BLOCK = 6
+
+# Rasgos de escritura a mano: relación ancho/alto mediana de las componentes,
+# proporción de tinta dentro de su caja y variación de sus alturas. Un bloque
+# es manuscrito si cumple al menos HANDWRITING_VOTES de los tres
+HANDWRITING_MIN_ASPECT = 1.6
+HANDWRITING_MAX_FILL = 0.22
+HANDWRITING_MIN_HEIGHT_CV = 0.45
+HANDWRITING_VOTES = 2
+
+# Texto y confianza con que se guarda un bloque manuscrito en la tabla de
+# palabras: al quedar siempre por debajo del umbral se convierte en
+# '[texto manuscrito]' con cualquier umbral
+HANDWRITING_WORD = '[texto manuscrito]'
+HANDWRITING_CONF = -1
+
+# Pools de hilos para los bloques, uno por número de hilos y de larga duración
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_block_pool(workers: int) -> ThreadPoolExecutor:
+    """Pool de `workers` hilos para los bloques, creado la primera vez que se pide."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                        thread_name_prefix="layout-ocr")
+        return pool
+
+
+def _gaps(profile: np.ndarray, min_gap: int) -> list:
+    """
+    Tramos [inicio, fin) sin tinta de al menos `min_gap` en un perfil de
+    proyección (True donde la fila o columna tiene tinta), sin contar los bordes.
+    """
+    empty = np.concatenate(([False], ~profile, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(empty))
+    starts, ends = edges[0::2], edges[1::2]
+    return [(s, e) for s, e in zip(starts, ends)
+            if e - s >= min_gap and s > 0 and e < len(profile)]
+
+
+def _split(length: int, gaps: list) -> list:
+    """Trozos [inicio, fin) de un perfil de `length` entre los huecos."""
+    bounds = [0] + [v for gap in gaps for v in gap] + [length]
+    return list(zip(bounds[0::2], bounds[1::2]))
+
+
+def xy_cut(mask: np.ndarray, row_gap: int, column_gap: int) -> list:
+    """
+    Corta recursivamente la máscara por los huecos de sus perfiles de
+    proyección y devuelve las cajas (left, upper, right, lower) de los
+    bloques en orden de lectura.
+    """
+    blocks = []
+    pending = [(0, 0, mask.shape[1], mask.shape[0])]
+    while pending:
+        left, upper, right, lower = pending.pop()
+        region = mask[upper:lower, left:right]
+        rows = region.any(axis=1)
+        if not rows.any():
+            continue
+        # Ajustar la región a su tinta
+        top, bottom = np.flatnonzero(rows)[[0, -1]]
+        first, last = np.flatnonzero(region.any(axis=0))[[0, -1]]
+        left, right = left + first, left + last + 1
+        upper, lower = upper + top, upper + bottom + 1
+        region = mask[upper:lower, left:right]
+
+        # Se corta por la dirección con el hueco más ancho (relativo a su mínimo)
+        column_gaps = _gaps(region.any(axis=0), column_gap)
+        row_gaps = _gaps(region.any(axis=1), row_gap)
+        widest_column = max((e - s for s, e in column_gaps), default=0) / column_gap
+        widest_row = max((e - s for s, e in row_gaps), default=0) / row_gap
+        if column_gaps and widest_column >= widest_row:
+            parts = [(left + s, upper, left + e, lower) for s, e in _split(right - left, column_gaps)]
+        elif row_gaps:
+            parts = [(left, upper + s, right, upper + e) for s, e in _split(lower - upper, row_gaps)]
+        else:
+            parts = []
+        if parts:
+            # La pila saca el último: se apilan al revés para mantener el orden
+            pending.extend(reversed(parts))
+        else:
+            blocks.append((int(left), int(upper), int(right), int(lower)))
+    return blocks
+
+
+def glyph_height(stats: np.ndarray, page_height: int):
+    """
+    Altura típica de las letras: mediana de las alturas de las componentes
+    ponderada por su área, para que las motas del escaneo (muchas, pero
+    diminutas) no la arrastren. None si no hay suficientes componentes.
+    """
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    glyphs = (heights >= 4) & (heights <= page_height // 20) & (widths <= heights * 4)
+    if np.count_nonzero(glyphs) < MIN_GLYPHS:
+        return None
+    order = np.argsort(heights[glyphs])
+    weights = np.cumsum(stats[glyphs, cv2.CC_STAT_AREA][order])
+    return float(heights[glyphs][order][np.searchsorted(weights, weights[-1] / 2)])
+
+
+def block_features(stats: np.ndarray) -> dict:
+    """Rasgos de forma de las componentes de tinta de un bloque (filas de `stats`)."""
+    widths = stats[:, cv2.CC_STAT_WIDTH].astype(float)
+    heights = stats[:, cv2.CC_STAT_HEIGHT].astype(float)
+    areas = stats[:, cv2.CC_STAT_AREA].astype(float)
+    return {
+        "components": len(stats),
+        "aspect": float(np.median(widths / heights)),
+        "fill": float(np.median(areas / (widths * heights))),
+        "height_cv": float(np.std(heights) / np.mean(heights)),
+    }
+
+
+def is_handwriting(features: dict) -> bool:
+    votes = ((features["aspect"] >= HANDWRITING_MIN_ASPECT)
+             + (features["fill"] <= HANDWRITING_MAX_FILL)
+             + (features["height_cv"] >= HANDWRITING_MIN_HEIGHT_CV))
+    return votes >= HANDWRITING_VOTES
+
+
+def text_lines(mask: np.ndarray) -> int:
+    """Número de líneas de un bloque: tramos con tinta del perfil horizontal."""
+    rows = np.concatenate(([0], mask.any(axis=1).astype(np.int8), [0]))
+    return int(np.count_nonzero(np.diff(rows) == 1))
+
+
+def segment_page(gray: np.ndarray) -> list:
+    """
+    Divide una página en bloques en orden de lectura. Devuelve una lista de
+    dicts con la caja (left, upper, right, lower, con margen), el tipo
+    ('printed' o 'handwriting'), el número de líneas y los rasgos de forma.
+    """
+    height, width = gray.shape
+    mask = ink_mask(gray)
+    # Sin contraste entre las dos clases de Otsu no hay texto que segmentar
+    if not mask.any() or mask.all() or \
+            cv2.mean(gray, cv2.bitwise_not(mask))[0] - cv2.mean(gray, mask)[0] < MIN_INK_CONTRAST:
+        return []
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    x_height = glyph_height(stats[1:], height) or max(8.0, height * FALLBACK_X_HEIGHT_RATIO)
+    # Fuera las motas: componentes mucho más pequeñas que una letra
+    keep = stats[:, cv2.CC_STAT_AREA] >= MIN_SPECK_AREA * x_height ** 2
+    keep[0] = False
+    clean = keep[labels]
+    stats = stats[1:][keep[1:]]
+
+    margin = int(BLOCK_MARGIN * x_height)
+    min_area = MIN_BLOCK_AREA * x_height ** 2
+    blocks = []
+    for left, upper, right, lower in xy_cut(clean, max(1, int(ROW_GAP * x_height)),
+                                            max(1, int(COLUMN_GAP * x_height))):
+        if (right - left) * (lower - upper) < min_area:
+            continue
+        # Componentes cuya caja cae dentro del bloque
+        inside = ((stats[:, cv2.CC_STAT_LEFT] >= left) & (stats[:, cv2.CC_STAT_TOP] >= upper)
+                  & (stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] <= right)
+                  & (stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] <= lower))
+        if not inside.any():
+            continue
+        features = block_features(stats[inside])
+        blocks.append({
+            "box": (max(0, left - margin), max(0, upper - margin),
+                    min(width, right + margin), min(height, lower + margin)),
+            "kind": "handwriting" if is_handwriting(features) else "printed",
+            "lines": text_lines(clean[upper:lower, left:right]),
+            "features": features,
+        })
+    return blocks
+
+
+def handwriting_words(block_num: int, box: tuple) -> dict:
+    """Tabla de palabras de un bloque manuscrito: una entrada sin reconocer."""
+    left, upper, right, lower = box
+    return {'text': [HANDWRITING_WORD], 'conf': [HANDWRITING_CONF], 'block_num': [block_num],
+            'par_num': [1], 'line_num': [1], 'left': [left], 'top': [upper],
+            'width': [right - left], 'height': [lower - upper]}
+
+
+def ocr_blocks(img, recognize, columns: tuple, workers: int = None, timings: dict = None):
+    """
+    Segmenta `img` (PIL) y reconoce sus bloques impresos con
+    `recognize(imagen, psm, timings)`, que devuelve la tabla columnar de
+    palabras del recorte. Los bloques se reparten entre `workers` hilos del
+    pool del proceso; con un solo hilo se reconocen en el que llama, con su
+    propio motor.
+
+    Devuelve (palabras, info): la tabla de la página con las cajas en
+    coordenadas de `img` y los bloques numerados en orden de lectura, e info
+    con el número de bloques y de bloques manuscritos. En `timings` se
+    acumulan 'layout' (segmentación) y los tiempos de cada bloque.
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    blocks = segment_page(to_gray(img))
+    timings['layout'] = timings.get('layout', 0.0) + time.perf_counter() - start
+
+    def run(block):
+        block_timings = {}
+        psm = PSM_SINGLE_LINE if block["lines"] <= 1 else PSM_BLOCK
+        words = recognize(img.crop(block["box"]), psm, block_timings)
+        return words, block_timings
+
+    printed = [block for block in blocks if block["kind"] == "printed"]
+    workers = max(1, min(workers or DEFAULT_LAYOUT_WORKERS, len(printed) or 1))
+    if workers > 1:
+        results = dict(zip(map(id, printed), get_block_pool(workers).map(run, printed)))
+    else:
+        results = {id(block): run(block) for block in printed}
+
+    page = {col: [] for col in columns}
+    block_num = 0
+    previous = None
+    for block in blocks:
+        # Los bloques manuscritos seguidos comparten número: un único marcador
+        if not (block["kind"] == previous == "handwriting"):
+            block_num += 1
+        previous = block["kind"]
+        if block["kind"] == "handwriting":
+            words = handwriting_words(block_num, block["box"])
+        else:
+            words, block_timings = results[id(block)]
+            for stage, seconds in block_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            left, upper = block["box"][:2]
+            n = len(words['text'])
+            # Tesseract numera los bloques de cada recorte desde 1: se agrupan
+            # bajo el bloque de la página conservando párrafos y líneas
+            words['par_num'] = [b * 1000 + p for b, p in zip(words['block_num'], words['par_num'])]
+            words['block_num'] = [block_num] * n
+            words['left'] = [v + left for v in words['left']]
+            words['top'] = [v + upper for v in words['top']]
+        for col in columns:
+            page[col].extend(words[col])
+    info = {"layout_blocks": len(blocks),
+            "handwriting_blocks": sum(1 for block in blocks if block["kind"] == "handwriting")}
+    return page, info
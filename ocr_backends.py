@@ -0,0 +1,187 @@
+"""
+Motores de OCR intercambiables.
+
+- 'pytesseract': lanza un proceso `tesseract` por imagen (comportamiento
+  original). No necesita nada más que el binario de Tesseract.
+- 'tesserocr': usa libtesseract dentro del propio proceso. El modelo de cada
+  idioma se carga una única vez por hilo y se reutiliza entre páginas y
+  trabajos, evitando el arranque del proceso y la carga del traineddata.
+
+El motor se elige con la variable de entorno OCR_BACKEND o con el parámetro
+`backend`. Si 'tesserocr' no está instalado se usa 'pytesseract'.
+
+Traspaso de la imagen al motor (OCR_HANDOFF):
+- 'raw': sin recompresión. Con tesserocr se pasa el buffer de píxeles sin
+  comprimir; con pytesseract se entrega a `tesseract` la ruta del PPM que ya
+  generó poppler o, si la imagen se ha modificado, un PPM/PGM sin comprimir
+  escrito en memoria compartida (/dev/shm) cuando existe.
+- 'png': comportamiento original (PNG temporal en disco), útil para comparar.
+"""
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import pytesseract
+from pytesseract import Output
+
+OCR_BACKENDS = ('pytesseract', 'tesserocr')
+DEFAULT_OCR_BACKEND = os.environ.get("OCR_BACKEND", "pytesseract")
+
+# Columnas del TSV de Tesseract, en el mismo orden que image_to_data
+TSV_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+
+HANDOFF_MODES = ('raw', 'png')
+DEFAULT_HANDOFF = os.environ.get("OCR_HANDOFF", "raw")
+# Directorio para los ficheros intermedios (render y traspaso): tmpfs si hay
+RENDER_TMPDIR = os.environ.get("RENDER_TMPDIR") or ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+# Formatos sin comprimir que Tesseract (Leptonica) lee directamente
+_RAW_FORMATS = ('PPM', 'PGM', 'PBM')
+
+# Un motor por hilo e idioma: PyTessBaseAPI no admite llamadas concurrentes
+_local = threading.local()
+_tesserocr_available = None
+
+
+def tesserocr_available() -> bool:
+    """Indica si el módulo tesserocr se puede importar (se comprueba una vez)."""
+    global _tesserocr_available
+    if _tesserocr_available is None:
+        try:
+            import tesserocr  # noqa: F401
+            _tesserocr_available = True
+        except ImportError:
+            _tesserocr_available = False
+            print("tesserocr no está disponible; se usará pytesseract como motor de OCR")
+    return _tesserocr_available
+
+
+def resolve_backend(backend: str = None) -> str:
+    """Devuelve el motor efectivo teniendo en cuenta la configuración y lo instalado."""
+    backend = backend or DEFAULT_OCR_BACKEND
+    if backend not in OCR_BACKENDS:
+        raise ValueError(f"Motor de OCR no válido: {backend} (opciones: {', '.join(OCR_BACKENDS)})")
+    if backend == 'tesserocr' and not tesserocr_available():
+        return 'pytesseract'
+    return backend
+
+
+def get_tesserocr_engine(lang: str):
+    """Devuelve el motor tesserocr del hilo actual para `lang`, creándolo la primera vez."""
+    engines = getattr(_local, 'engines', None)
+    if engines is None:
+        engines = _local.engines = {}
+    engine = engines.get(lang)
+    if engine is None:
+        import tesserocr
+        engine = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.AUTO)
+        engines[lang] = engine
+    return engine
+
+
+def parse_tsv(tsv: str) -> dict:
+    """Convierte el TSV de Tesseract al mismo dict por columnas que image_to_data."""
+    data = {col: [] for col in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        fields = row.split('\t')
+        # La cabecera (sólo la emite el binario) y las filas incompletas se ignoran
+        if len(fields) < len(TSV_COLUMNS) - 1 or not fields[0].isdigit():
+            continue
+        if len(fields) == len(TSV_COLUMNS) - 1:
+            fields.append('')
+        for col, value in zip(TSV_COLUMNS[:-2], fields):
+            data[col].append(int(value))
+        try:
+            data['conf'].append(float(fields[10]))
+        except ValueError:
+            data['conf'].append(-1)
+        data['text'].append(fields[11])
+    return data
+
+
+@contextmanager
+def ocr_input_path(img, handoff: str = 'raw'):
+    """
+    Devuelve una ruta de fichero con la imagen para el binario `tesseract`.
+    Si la imagen es tal cual la dejó poppler se reutiliza su fichero; si no,
+    se escribe un temporal (PPM sin comprimir en modo 'raw', PNG en 'png')
+    que se borra al salir.
+    """
+    filename = getattr(img, 'filename', '')
+    if handoff == 'raw' and filename and img.format in _RAW_FORMATS and os.path.exists(filename):
+        yield filename
+        return
+
+    if handoff == 'raw':
+        if img.mode not in ('1', 'L', 'RGB'):
+            img = img.convert('RGB')
+        suffix, fmt = '.ppm', 'PPM'
+    else:
+        suffix, fmt = '.png', 'PNG'
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='pdf2md_ocr_', dir=RENDER_TMPDIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, format=fmt)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def set_raw_image(engine, img):
+    """Pasa a tesserocr el buffer de píxeles sin comprimir (sin BMP intermedio)."""
+    if img.mode == '1' or img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('L' if img.mode in ('1', 'LA', 'I', 'I;16', 'F') else 'RGB')
+    bytes_per_pixel = {'L': 1, 'RGB': 3, 'RGBA': 4}[img.mode]
+    width, height = img.size
+    engine.SetImageBytes(img.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+
+
+def image_to_data(img, lang: str = None, backend: str = None,
+                  handoff: str = None, timings: dict = None, psm: int = None) -> dict:
+    """
+    Aplica OCR a una imagen PIL y devuelve el dict por columnas de Tesseract
+    (level, block_num, par_num, line_num, conf, text, cajas...). `psm` fija
+    el modo de segmentación de página de Tesseract (por defecto, automático).
+
+    Si se pasa `timings`, se acumulan en él los segundos dedicados al
+    traspaso de la imagen ('handoff') y al reconocimiento ('ocr').
+    """
+    handoff = handoff or DEFAULT_HANDOFF
+    if handoff not in HANDOFF_MODES:
+        raise ValueError(f"Modo de traspaso no válido: {handoff} (opciones: {', '.join(HANDOFF_MODES)})")
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+
+    if resolve_backend(backend) == 'tesserocr':
+        engine = get_tesserocr_engine(lang or 'eng')
+        try:
+            if psm is not None:
+                engine.SetPageSegMode(psm)
+            if handoff == 'raw':
+                set_raw_image(engine, img)
+            else:
+                engine.SetImage(img)
+            handed_off = time.perf_counter()
+            engine.Recognize()
+            data = parse_tsv(engine.GetTSVText(0))
+        finally:
+            # Liberar la imagen y los resultados, pero mantener el modelo cargado
+            engine.Clear()
+            if psm is not None:
+                import tesserocr
+                engine.SetPageSegMode(tesserocr.PSM.AUTO)
+    else:
+        kwargs = {'lang': lang} if lang else {}
+        if psm is not None:
+            kwargs['config'] = f'--psm {psm}'
+        with ocr_input_path(img, handoff) as path:
+            handed_off = time.perf_counter()
+            data = pytesseract.image_to_data(path, output_type=Output.DICT, **kwargs)
+
+    end = time.perf_counter()
+    timings['handoff'] = timings.get('handoff', 0.0) + (handed_off - start)
+    timings['ocr'] = timings.get('ocr', 0.0) + (end - handed_off)
+    return data
@@ -0,0 +1,257 @@
+"""
+Preprocesado de las páginas rasterizadas antes del OCR (OpenCV + numpy).
+
+Pasos disponibles (se aplican en este orden, sólo los elegidos):
+- 'grayscale': la página se rasteriza ya en escala de grises (poppler) y se
+  trabaja con un único canal.
+- 'denoise': filtro de mediana 3x3, elimina las motas sueltas del escaneo.
+- 'deskew': endereza la página buscando el ángulo (±MAX_SKEW_ANGLE) que
+  maximiza la varianza del perfil de proyección horizontal de la tinta.
+- 'downscale': reduce la imagen para que la altura típica de las letras
+  quede en `target_x_height` píxeles (nunca amplía).
+- 'threshold': binarización adaptativa (gaussiana), robusta a fondos
+  irregulares y sombras.
+
+Tesseract recibe así una imagen de un canal, más pequeña y limpia. Las cajas
+de las palabras se devuelven siempre en coordenadas de la imagen original:
+preprocess_image devuelve la transformación aplicada (giro y reducción) y
+`boxes_to_original` la deshace, de modo que la segunda pasada adaptativa y
+las tablas de palabras guardadas apuntan a la página sin procesar.
+
+Los pasos se eligen con la variable de entorno OCR_PREPROCESS o con el
+parámetro `preprocess` ('none', 'all' o una lista separada por comas). Por
+defecto no se preprocesa, como antes de existir estos pasos; el
+docker-compose activa 'grayscale' en el transcriber.
+
+`ink_ratio` mide la tinta de una miniatura de la página para detectar las
+páginas en blanco antes de rasterizarlas a alta resolución.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PREPROCESS_STEPS = ('grayscale', 'denoise', 'deskew', 'downscale', 'threshold')
+DEFAULT_PREPROCESS = os.environ.get("OCR_PREPROCESS", "none")
+# Altura objetivo (px) de las letras minúsculas al reducir la imagen
+DEFAULT_TARGET_X_HEIGHT = int(os.environ.get("OCR_TARGET_X_HEIGHT", "24"))
+
+# Enderezado: ángulo máximo buscado, paso de la búsqueda y ancho de la miniatura
+MAX_SKEW_ANGLE = 5.0
+SKEW_STEP = 0.25
+SKEW_THUMB_WIDTH = 800
+# Por debajo de este ángulo no compensa girar la página
+MIN_SKEW_ANGLE = 0.3
+
+# Binarización adaptativa: tamaño de la vecindad (impar) y constante restada
+THRESHOLD_BLOCK_SIZE = 31
+THRESHOLD_C = 15
+
+# Mínimo de componentes de tinta para estimar la altura de las letras
+MIN_GLYPHS = 30
+
+
+def parse_preprocess(value=None) -> tuple:
+    """
+    Normaliza la configuración de preprocesado a una tupla de pasos en orden
+    de aplicación. Acepta una cadena ('none', 'all', 'grayscale,deskew'...),
+    una lista de pasos o None (valor por defecto de OCR_PREPROCESS).
+    """
+    if value is None:
+        value = DEFAULT_PREPROCESS
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('', 'none'):
+            return ()
+        if value == 'all':
+            return PREPROCESS_STEPS
+        value = [step.strip() for step in value.split(',') if step.strip()]
+    unknown = [step for step in value if step not in PREPROCESS_STEPS]
+    if unknown:
+        raise ValueError(f"Paso de preprocesado no válido: {', '.join(unknown)} "
+                         f"(opciones: {', '.join(PREPROCESS_STEPS)}, 'all' o 'none')")
+    return tuple(step for step in PREPROCESS_STEPS if step in value)
+
+
+def to_gray(img: Image.Image) -> np.ndarray:
+    """Array de un canal (uint8) de la imagen; sin copia si ya está en gris."""
+    if img.mode != 'L':
+        img = img.convert('L')
+    return np.asarray(img)
+
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Máscara binaria (255 = tinta) por el umbral de Otsu."""
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask
+
+
+def estimate_skew(gray: np.ndarray) -> float:
+    """
+    Ángulo (grados) en que está girado el texto. Sobre una miniatura se
+    prueban los ángulos de ±MAX_SKEW_ANGLE y se elige el que deja las líneas
+    más marcadas en el perfil de proyección horizontal.
+    """
+    height, width = gray.shape
+    factor = min(1.0, SKEW_THUMB_WIDTH / width)
+    thumb = cv2.resize(gray, (max(1, int(width * factor)), max(1, int(height * factor))),
+                       interpolation=cv2.INTER_AREA)
+    mask = ink_mask(thumb)
+    if not mask.any():
+        return 0.0
+    center = (mask.shape[1] / 2, mask.shape[0] / 2)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_ANGLE, MAX_SKEW_ANGLE + SKEW_STEP / 2, SKEW_STEP):
+        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rotated = cv2.warpAffine(mask, matrix, (mask.shape[1], mask.shape[0]), flags=cv2.INTER_NEAREST)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.int64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(gray: np.ndarray):
+    """
+    Gira la imagen para enderezar el texto si está torcido al menos
+    MIN_SKEW_ANGLE. Devuelve (imagen, matriz afín 2x3 del giro), con la
+    matriz a None si no se ha girado.
+    """
+    angle = estimate_skew(gray)
+    if abs(angle) < MIN_SKEW_ANGLE:
+        return gray, None
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    rotated = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+    return rotated, matrix
+
+
+def estimate_x_height(gray: np.ndarray):
+    """
+    Altura típica (mediana) de los componentes de tinta con tamaño de letra,
+    o None si no hay suficientes para estimarla (página casi vacía, dibujos).
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink_mask(gray), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Fuera ruido (muy pequeño) y líneas, marcos o imágenes (muy grande o alargado)
+    glyphs = heights[(heights >= 4) & (heights <= gray.shape[0] // 20) & (widths <= heights * 4)]
+    if len(glyphs) < MIN_GLYPHS:
+        return None
+    return float(np.median(glyphs))
+
+
+def preprocess_image(img: Image.Image, steps=None, target_x_height: int = None,
+                     timings: dict = None):
+    """
+    Aplica los pasos de preprocesado a una imagen PIL. Devuelve (imagen,
+    transformación), donde transformación es la matriz afín 2x3 (giro del
+    enderezado y reducción) que lleva las coordenadas de la imagen original a
+    las de la procesada, o None si no ha cambiado la geometría; con ella
+    `boxes_to_original` devuelve las cajas de las palabras a la imagen
+    original. Sin pasos devuelve la imagen tal cual. Si se pasa `timings`,
+    acumula los segundos en 'preprocess'.
+    """
+    steps = parse_preprocess(steps)
+    if not steps:
+        return img, None
+    start = time.perf_counter()
+    if steps == ('grayscale',):
+        # Sin más pasos, una página ya rasterizada en gris se entrega tal cual
+        # (el traspaso 'raw' puede reutilizar el fichero de poppler)
+        result = img if img.mode == 'L' else img.convert('L')
+        if timings is not None:
+            timings['preprocess'] = timings.get('preprocess', 0.0) + time.perf_counter() - start
+        return result, None
+    gray = to_gray(img)
+    # Transformación acumulada (coordenadas homogéneas, 3x3)
+    transform = np.eye(3)
+
+    if 'denoise' in steps:
+        gray = cv2.medianBlur(gray, 3)
+    if 'deskew' in steps:
+        gray, rotation = deskew(gray)
+        if rotation is not None:
+            transform = np.vstack([rotation, [0, 0, 1]]) @ transform
+    if 'downscale' in steps:
+        x_height = estimate_x_height(gray)
+        target = target_x_height or DEFAULT_TARGET_X_HEIGHT
+        if x_height and x_height > target:
+            scale = target / x_height
+            gray = cv2.resize(gray, (max(1, int(gray.shape[1] * scale)), max(1, int(gray.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+            transform = np.diag([scale, scale, 1.0]) @ transform
+    if 'threshold' in steps:
+        gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     THRESHOLD_BLOCK_SIZE, THRESHOLD_C)
+
+    result = Image.fromarray(gray)
+    if timings is not None:
+        timings['preprocess'] = timings.get('preprocess', 0.0) + time.perf_counter() - start
+    return result, (None if np.allclose(transform, np.eye(3)) else transform[:2])
+
+
+def boxes_to_original(words: dict, transform) -> dict:
+    """
+    Pasa a coordenadas de la imagen original las cajas (left, top, width,
+    height) de una tabla de palabras reconocida sobre la imagen procesada con
+    `transform` (ver preprocess_image). Con giro, cada caja pasa a ser el
+    rectángulo que contiene la caja girada. Modifica y devuelve `words`.
+    """
+    if transform is None or not words['left']:
+        return words
+    inverse = cv2.invertAffineTransform(np.asarray(transform, dtype=np.float64))
+    left = np.asarray(words['left'], dtype=np.float64)
+    top = np.asarray(words['top'], dtype=np.float64)
+    right = left + np.asarray(words['width'], dtype=np.float64)
+    bottom = top + np.asarray(words['height'], dtype=np.float64)
+    # Las cuatro esquinas de cada caja
+    xs = np.stack([left, right, left, right])
+    ys = np.stack([top, top, bottom, bottom])
+    orig_x = inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]
+    orig_y = inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]
+    x0 = np.maximum(np.floor(orig_x.min(axis=0)), 0)
+    y0 = np.maximum(np.floor(orig_y.min(axis=0)), 0)
+    x1 = np.maximum(np.ceil(orig_x.max(axis=0)), x0)
+    y1 = np.maximum(np.ceil(orig_y.max(axis=0)), y0)
+    words['left'] = x0.astype(int).tolist()
+    words['top'] = y0.astype(int).tolist()
+    words['width'] = (x1 - x0).astype(int).tolist()
+    words['height'] = (y1 - y0).astype(int).tolist()
+    return words
+
+
+# Detección de páginas en blanco: resolución de la miniatura, margen que se
+# ignora (sombras del borde del escaneo), contraste mínimo respecto al fondo
+# para contar un píxel como tinta y área mínima (en píxeles de la miniatura)
+# de una mancha de tinta para no contar motas sueltas
+BLANK_THUMB_DPI = 50
+BLANK_MARGIN = 0.05
+BLANK_INK_CONTRAST = 40
+BLANK_MIN_BLOB_AREA = 60
+
+
+def ink_ratio(img: Image.Image) -> float:
+    """
+    Proporción de la página cubierta por tinta, calculada sobre una miniatura
+    (BLANK_THUMB_DPI). Sólo cuentan las manchas que, unidas con sus vecinas,
+    tienen tamaño de palabra: el polvo y las motas del escaneo no suman.
+    """
+    gray = to_gray(img)
+    height, width = gray.shape
+    mh, mw = int(height * BLANK_MARGIN), int(width * BLANK_MARGIN)
+    gray = gray[mh:height - mh, mw:width - mw]
+    if not gray.size:
+        return 0.0
+    background = np.percentile(gray, 90)
+    ink = (gray < background - BLANK_INK_CONTRAST).astype(np.uint8)
+    if not ink.any():
+        return 0.0
+    # Unir las letras de una misma palabra antes de medir las manchas
+    merged = cv2.dilate(ink, np.ones((3, 7), np.uint8))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_AREA] >= BLANK_MIN_BLOB_AREA
+    keep[0] = False
+    return float(ink[keep[labels]].sum() / ink.size)
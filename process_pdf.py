@@ -1,14 +1,88 @@
 import argparse
+import gzip
+import json
+import glob
 import os
+import subprocess
 import sys
-from pdf2image import convert_from_path
+import tempfile
+import time
+import uuid
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 import pytesseract
-from pytesseract import Output
+from ocr_backends import image_to_data, resolve_backend, OCR_BACKENDS, HANDOFF_MODES, RENDER_TMPDIR
+from preprocess import (preprocess_image, boxes_to_original, parse_preprocess, ink_ratio, DEFAULT_PREPROCESS,
+                        DEFAULT_TARGET_X_HEIGHT, BLANK_THUMB_DPI)
+from layout import ocr_blocks, DEFAULT_LAYOUT, DEFAULT_LAYOUT_WORKERS, HANDWRITING_WORD, HANDWRITING_CONF
 
-def ocr_impreso_con_placeholder(img: Image.Image, conf_threshold: int = 60, log_callback = None) -> str:
+# Columnas que se conservan de la salida de Tesseract para cada palabra
+WORD_COLUMNS = ('text', 'conf', 'block_num', 'par_num', 'line_num',
+                'left', 'top', 'width', 'height')
+
+def words_from_data(data: dict) -> dict:
     """
-    Aplica OCR a una imagen, devuelve un texto donde:
+    Reduce la salida de `image_to_data` a una tabla columnar con sólo las
+    palabras (nivel 5) no vacías, que es todo lo necesario para reconstruir
+    las líneas con cualquier umbral de confianza.
+    """
+    words = {col: [] for col in WORD_COLUMNS}
+    for i in range(len(data['level'])):
+        if int(data['level'][i]) != 5:
+            continue
+        txt = str(data['text'][i]).strip()
+        if not txt:
+            continue
+        try:
+            conf = int(float(data['conf'][i]))
+        except (ValueError, TypeError):
+            conf = -1
+        words['text'].append(txt)
+        words['conf'].append(conf)
+        for col in WORD_COLUMNS[2:]:
+            words[col].append(int(data[col][i]))
+    return words
+
+def ocr_words(img: Image.Image, lang: str = None, backend: str = None,
+              handoff: str = None, timings: dict = None,
+              preprocess: tuple = (), target_x_height: int = None,
+              layout: bool = False, layout_workers: int = None, counters: dict = None,
+              psm: int = None) -> dict:
+    """
+    Aplica OCR a una imagen y devuelve la tabla columnar de palabras.
+    `backend` elige el motor ('pytesseract' o 'tesserocr') y `handoff` cómo
+    se le entrega la imagen (ver ocr_backends). Si se pasa `timings`, se
+    acumulan en él los tiempos de preprocesado, traspaso y OCR.
+
+    `preprocess` son los pasos de preprocesado a aplicar antes del OCR (ver
+    preprocess); si la imagen se gira o se reduce, las cajas de las palabras
+    se devuelven igualmente en coordenadas de la imagen recibida. `psm` fija
+    el modo de segmentación de Tesseract (sin `layout`).
+
+    Con `layout` la página se divide antes en bloques: los impresos se
+    reconocen por separado en `layout_workers` hilos y los manuscritos se
+    marcan sin OCR (ver layout). Si se pasa `counters`, se suman en él los
+    bloques encontrados ('layout_blocks' y 'handwriting_blocks').
+    """
+    img, transform = preprocess_image(img, preprocess, target_x_height=target_x_height, timings=timings)
+    if layout:
+        def recognize(block, psm, block_timings):
+            return words_from_data(image_to_data(block, lang=lang, backend=backend, handoff=handoff,
+                                                 timings=block_timings, psm=psm))
+        words, info = ocr_blocks(img, recognize, WORD_COLUMNS, workers=layout_workers, timings=timings)
+        if counters is not None:
+            for counter, value in info.items():
+                counters[counter] = counters.get(counter, 0) + value
+    else:
+        data = image_to_data(img, lang=lang, backend=backend, handoff=handoff, timings=timings, psm=psm)
+        words = words_from_data(data)
+    return boxes_to_original(words, transform)
+
+def words_to_text(words: dict, conf_threshold: int = 60, log_callback = None) -> str:
+    """
+    Construye el texto de una página a partir de la tabla de palabras:
     - Se mantienen las palabras con conf >= conf_threshold.
     - Si una línea está compuesta solo por palabras con conf < threshold,
       se sustituye por '[texto manuscrito]'.
@@ -16,30 +90,20 @@ def ocr_impreso_con_placeholder(img: Image.Image, conf_threshold: int = 60, log_
     def log(message):
         if log_callback:
             log_callback(message)
-    
-    log("Aplicando OCR al fragmento de imagen...")
-    data = pytesseract.image_to_data(img, output_type=Output.DICT)
-    n = len(data['level'])
-    log(f"OCR completado. Se detectaron {n} elementos")
-    
+
     lines = []
-    current_line = 1
+    current_line = None
     buffer = []
     manuscrito = False
     
     detected_text = 0
     detected_manuscript = 0
     
-    for i in range(n):
-        line_num = data['line_num'][i]
-        txt = data['text'][i].strip()
-        try:
-            conf = int(data['conf'][i])
-        except (ValueError, TypeError):
-            conf = -1
+    for i in range(len(words['text'])):
+        line_key = (words['block_num'][i], words['par_num'][i], words['line_num'][i])
 
         # Cuando cambia de línea, volcamos el buffer o el placeholder
-        if line_num != current_line:
+        if line_key != current_line:
             if buffer:
                 lines.append(' '.join(buffer))
                 detected_text += 1
@@ -48,13 +112,10 @@ def ocr_impreso_con_placeholder(img: Image.Image, conf_threshold: int = 60, log_
                 detected_manuscript += 1
             buffer = []
             manuscrito = False
-            current_line = line_num
-
-        if not txt:
-            continue
+            current_line = line_key
 
-        if conf >= conf_threshold:
-            buffer.append(txt)
+        if words['conf'][i] >= conf_threshold:
+            buffer.append(words['text'][i])
         else:
             manuscrito = True
 
@@ -69,58 +130,900 @@ def ocr_impreso_con_placeholder(img: Image.Image, conf_threshold: int = 60, log_
     log(f"Análisis completado. Se detectaron {detected_text} líneas de texto impreso y {detected_manuscript} fragmentos manuscritos")
     return '\n'.join(lines)
 
+def areas_to_text(area_texts: dict) -> str:
+    """Une el texto de varias áreas con nombre en subsecciones `### nombre`."""
+    sections = []
+    for name, texto in area_texts.items():
+        sections.append(f'### {name}\n\n{texto}' if texto else f'### {name}\n')
+    return '\n\n'.join(sections)
+
+def page_text_from_words(words: dict, conf_threshold: int = 60) -> str:
+    """
+    Texto de una página a partir de su tabla de palabras o, si se procesó
+    por áreas con nombre, de las tablas de cada área ({"areas": {...}}).
+    """
+    if "areas" in words:
+        return areas_to_text({name: words_to_text(area_words, conf_threshold=conf_threshold)
+                              for name, area_words in words["areas"].items()})
+    return words_to_text(words, conf_threshold=conf_threshold)
+
+def ocr_impreso_con_placeholder(img: Image.Image, conf_threshold: int = 60, log_callback = None,
+                                lang: str = None, backend: str = None) -> str:
+    """
+    Aplica OCR a una imagen, devuelve un texto donde:
+    - Se mantienen las palabras con conf >= conf_threshold.
+    - Si una línea está compuesta solo por palabras con conf < threshold,
+      se sustituye por '[texto manuscrito]'.
+    """
+    def log(message):
+        if log_callback:
+            log_callback(message)
+    
+    log("Aplicando OCR al fragmento de imagen...")
+    words = ocr_words(img, lang=lang, backend=backend)
+    log(f"OCR completado. Se detectaron {len(words['text'])} palabras")
+    return words_to_text(words, conf_threshold=conf_threshold, log_callback=log_callback)
+
+def write_page_words(sidecar, page_num: int, words: dict = None, text: str = None):
+    """
+    Añade una página al fichero auxiliar de palabras (JSON Lines comprimido
+    con gzip, un registro columnar por página). Las páginas que salieron de
+    la capa de texto del PDF guardan directamente su texto.
+    """
+    record = {"page": page_num}
+    if words is not None:
+        record["words"] = words
+    else:
+        record["text"] = text or ''
+    sidecar.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+def read_words_sidecar(words_path: str):
+    """Recorre el fichero auxiliar de palabras devolviendo los registros de cada página."""
+    with gzip.open(words_path, 'rt', encoding='utf-8') as sidecar:
+        for line in sidecar:
+            if line.strip():
+                yield json.loads(line)
+
+def rebuild_markdown_from_words(words_path: str,
+                                output_md: str,
+                                conf_threshold: int = 60,
+                                log_callback = None):
+    """
+    Regenera el .md con otro umbral de confianza a partir del fichero de
+    palabras guardado en un procesamiento anterior, sin rasterizar ni OCR.
+    """
+    def log(message):
+        if log_callback:
+            log_callback(message)
+        print(message)
+
+    log(f"Reconstruyendo Markdown desde {os.path.basename(words_path)} con umbral {conf_threshold}")
+    pages = 0
+    with open(output_md, 'w', encoding='utf-8') as md:
+        for record in read_words_sidecar(words_path):
+            if "words" in record:
+                texto = page_text_from_words(record["words"], conf_threshold=conf_threshold)
+            else:
+                texto = record.get("text", '')
+            write_page(md, record["page"], texto)
+            pages += 1
+    log(f"Markdown reconstruido ({pages} páginas): {os.path.basename(output_md)}")
+
+# Modos de extracción: 'auto' usa la capa de texto del PDF cuando es
+# aprovechable y OCR en el resto, 'ocr' aplica siempre OCR y 'text' sólo
+# usa la capa de texto
+EXTRACTION_MODES = ('auto', 'ocr', 'text')
+# Mínimo de caracteres no blancos para considerar útil la capa de texto
+MIN_TEXT_LAYER_CHARS = 20
+# Proporción mínima de caracteres "normales" (letras, cifras, puntuación)
+MIN_TEXT_LAYER_QUALITY = 0.8
+
+def clean_text_layer(text: str) -> str:
+    """Normaliza el texto extraído del PDF al formato de línea del OCR."""
+    lines = [' '.join(line.split()) for line in (text or '').splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+def has_usable_text_layer(text: str) -> bool:
+    """
+    Decide si el texto embebido de una página sirve en lugar del OCR: debe
+    tener un mínimo de caracteres y no estar dominado por símbolos de
+    control o glifos sin mapear (típico de fuentes sin tabla ToUnicode).
+    """
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < MIN_TEXT_LAYER_CHARS:
+        return False
+    good = sum(1 for c in chars if c.isalnum() or c in '.,;:¿?¡!()-–—"\'«»/%€$&@#*+=[]')
+    return good / len(chars) >= MIN_TEXT_LAYER_QUALITY
+
+def extract_text_layer(input_pdf: str, total_pages: int, mode: str = 'auto', log_callback = None) -> dict:
+    """
+    Clasifica las páginas según su capa de texto. Devuelve {página: texto}
+    con las páginas que no necesitan OCR; el resto se rasterizan y se les
+    aplica OCR. En modo 'ocr' no se lee el PDF y se devuelve un dict vacío.
+    """
+    def log(message):
+        if log_callback:
+            log_callback(message)
+
+    if mode == 'ocr':
+        return {}
+
+    # Intentamos importar PyPDF2 o PyPDF4 según esté disponible
+    try:
+        import PyPDF2 as pdf_module
+    except ImportError:
+        try:
+            import PyPDF4 as pdf_module
+        except ImportError:
+            log("No se pudo importar librería para leer la capa de texto; se aplicará OCR a todas las páginas")
+            return {}
+
+    text_pages = {}
+    with open(input_pdf, 'rb') as pdf_file:
+        reader = pdf_module.PdfReader(pdf_file)
+        for page_num in range(1, total_pages + 1):
+            try:
+                text = clean_text_layer(reader.pages[page_num - 1].extract_text())
+            except Exception as e:
+                log(f"No se pudo leer la capa de texto de la página {page_num}: {e}")
+                text = ''
+            # En modo 'text' se usa la capa de texto aunque esté vacía
+            if mode == 'text' or has_usable_text_layer(text):
+                text_pages[page_num] = text
+    return text_pages
+
+def get_page_count(input_pdf: str) -> int:
+    """Devuelve el número de páginas del PDF sin rasterizarlo."""
+    info = pdfinfo_from_path(input_pdf)
+    return int(info["Pages"])
+
+def validate_area(area) -> tuple:
+    """Comprueba un área (left, upper, right, lower) en píxeles y la devuelve como tupla."""
+    left, upper, right, lower = (int(v) for v in area)
+    if left < 0 or upper < 0 or right <= left or lower <= upper:
+        raise ValueError(f"Área no válida: {area} (se espera left < right y upper < lower, sin negativos)")
+    return left, upper, right, lower
+
+def render_window(input_pdf: str, first_page: int, last_page: int, dpi: int,
+                  output_dir: str, area: tuple = None, grayscale: bool = False) -> list:
+    """
+    Rasteriza un rango de páginas en `output_dir` y devuelve las rutas en
+    orden de página. Con `area` (left, upper, right, lower, en píxeles a
+    `dpi`) poppler sólo rasteriza esa región de cada página, sin generar la
+    página completa. Con `grayscale` poppler genera directamente imágenes de
+    un canal (PGM), un tercio de los bytes de una página RGB.
+    """
+    if not area:
+        # pdf2image nombra los ficheros con el número de página, así que
+        # el orden alfabético coincide con el orden del documento
+        return sorted(convert_from_path(input_pdf,
+                                        dpi=dpi,
+                                        first_page=first_page,
+                                        last_page=last_page,
+                                        output_folder=output_dir,
+                                        grayscale=grayscale,
+                                        paths_only=True))
+
+    left, upper, right, lower = area
+    prefix = os.path.join(output_dir, uuid.uuid4().hex)
+    subprocess.run(['pdftoppm', '-r', str(dpi),
+                    '-f', str(first_page), '-l', str(last_page),
+                    '-x', str(left), '-y', str(upper),
+                    '-W', str(right - left), '-H', str(lower - upper)]
+                   + (['-gray'] if grayscale else []) + [input_pdf, prefix],
+                   check=True, capture_output=True)
+    # pdftoppm genera {prefix}-{página}.ppm (.pgm en gris, con ceros a la izquierda)
+    ext = '.pgm' if grayscale else '.ppm'
+    paths = glob.glob(f"{prefix}-*{ext}")
+    return sorted(paths, key=lambda path: int(path[len(prefix) + 1:-len(ext)]))
+
+def iter_pdf_pages(input_pdf: str,
+                   dpi: int = 300,
+                   batch_size: int = 1,
+                   first_page: int = 1,
+                   last_page: int = None,
+                   pages: list = None,
+                   area: tuple = None,
+                   grayscale: bool = False):
+    """
+    Rasteriza el PDF por ventanas de `batch_size` páginas y devuelve
+    (número de página, imagen) de una en una. Con `pages` (lista ordenada)
+    se rasterizan sólo esas páginas, agrupando las consecutivas. Con `area`
+    sólo se rasteriza esa región de cada página y con `grayscale`, en escala
+    de grises (ver render_window).
+
+    Cada ventana se renderiza en un directorio temporal (sólo rutas, sin
+    decodificar) y cada imagen se abre justo antes de entregarla y se cierra
+    y borra en cuanto el consumidor termina con ella. Así el consumo de
+    memoria depende del tamaño de una página, no de la longitud del documento.
+    """
+    if pages is None:
+        if last_page is None:
+            last_page = get_page_count(input_pdf)
+        pages = range(first_page, last_page + 1)
+    batch_size = max(1, batch_size)
+
+    # Ventanas de páginas consecutivas de como mucho batch_size páginas
+    windows = []
+    for page_num in pages:
+        if windows and page_num == windows[-1][1] + 1 and page_num - windows[-1][0] < batch_size:
+            windows[-1][1] = page_num
+        else:
+            windows.append([page_num, page_num])
+
+    # Con RENDER_TMPDIR en tmpfs (/dev/shm) las imágenes no llegan a disco
+    with tempfile.TemporaryDirectory(prefix="pdf2md_", dir=RENDER_TMPDIR) as tmp_dir:
+        for start, end in windows:
+            paths = render_window(input_pdf, start, end, dpi, tmp_dir, area=area, grayscale=grayscale)
+            for page_num, path in zip(range(start, end + 1), paths):
+                img = Image.open(path)
+                try:
+                    yield page_num, img
+                finally:
+                    img.close()
+                    os.unlink(path)
+
+# Modo adaptativo: DPI de la primera pasada, margen (en píxeles de la primera
+# pasada) alrededor de cada línea dudosa y número de regiones a partir del
+# cual sale más a cuenta rasterizar la página entera a alta resolución
+ADAPTIVE_LOW_DPI = 150
+ADAPTIVE_MARGIN = 4
+ADAPTIVE_FULL_PAGE_REGIONS = 4
+# Segmentación de Tesseract para las regiones de la segunda pasada (bloque uniforme)
+ADAPTIVE_PSM = 6
+
+def scale_box(box: tuple, factor: float) -> tuple:
+    """Escala una caja (left, upper, right, lower) entre resoluciones."""
+    return tuple(int(round(v * factor)) for v in box)
+
+def low_confidence_lines(words: dict, conf_threshold: int) -> list:
+    """
+    Devuelve [(clave de línea, caja)] de las líneas en las que ninguna palabra
+    llega al umbral, es decir, las que acabarían como '[texto manuscrito]'.
+    """
+    lines = {}
+    for i in range(len(words['text'])):
+        # Los bloques que la segmentación ya dio por manuscritos no se repiten
+        if words['conf'][i] == HANDWRITING_CONF and words['text'][i] == HANDWRITING_WORD:
+            continue
+        key = (words['block_num'][i], words['par_num'][i], words['line_num'][i])
+        left, top = words['left'][i], words['top'][i]
+        right, bottom = left + words['width'][i], top + words['height'][i]
+        line = lines.get(key)
+        if line is None:
+            lines[key] = [words['conf'][i], left, top, right, bottom]
+        else:
+            line[0] = max(line[0], words['conf'][i])
+            line[1], line[2] = min(line[1], left), min(line[2], top)
+            line[3], line[4] = max(line[3], right), max(line[4], bottom)
+    return [(key, tuple(line[1:])) for key, line in lines.items() if line[0] < conf_threshold]
+
+def refine_low_confidence_lines(input_pdf: str, page_num: int, words: dict, conf_threshold: int,
+                                low_dpi: int, dpi: int, origin: tuple = (0, 0),
+                                lang: str = None, backend: str = None, handoff: str = None,
+                                timings: dict = None, preprocess: tuple = (),
+                                target_x_height: int = None):
+    """
+    Segunda pasada del modo adaptativo: las líneas que en la primera pasada
+    (a `low_dpi`) no llegan al umbral se vuelven a rasterizar a `dpi` y se
+    reconocen de nuevo. Si en alta resolución alguna palabra supera el umbral,
+    la línea se sustituye; si no, se mantiene y acabará como manuscrita.
+
+    `origin` es la esquina (en píxeles a `low_dpi`) de la imagen de la primera
+    pasada dentro de la página, por si se rasterizó sólo un área. Las
+    regiones pasan por el mismo `preprocess` que la primera pasada.
+
+    Devuelve (palabras, regiones re-procesadas, líneas recuperadas).
+    """
+    doubtful = low_confidence_lines(words, conf_threshold)
+    if not doubtful:
+        return words, 0, 0
+
+    scale = dpi / low_dpi
+    ox, oy = origin
+    regions = []
+    for key, (left, top, right, bottom) in doubtful:
+        box = (max(0, left - ADAPTIVE_MARGIN + ox), max(0, top - ADAPTIVE_MARGIN + oy),
+               right + ADAPTIVE_MARGIN + ox, bottom + ADAPTIVE_MARGIN + oy)
+        regions.append((key, scale_box(box, scale)))
+
+    def region_images(tmp_dir):
+        # Con muchas regiones, una sola página a alta resolución sale más barata
+        if len(regions) >= ADAPTIVE_FULL_PAGE_REGIONS:
+            path = render_window(input_pdf, page_num, page_num, dpi, tmp_dir)[0]
+            with Image.open(path) as page_img:
+                for key, box in regions:
+                    yield key, box, page_img.crop(box)
+        else:
+            for key, box in regions:
+                path = render_window(input_pdf, page_num, page_num, dpi, tmp_dir, area=box)[0]
+                with Image.open(path) as img:
+                    yield key, box, img
+
+    start = time.perf_counter()
+    replacements = {}
+    with tempfile.TemporaryDirectory(prefix="pdf2md_", dir=RENDER_TMPDIR) as tmp_dir:
+        for key, box, img in region_images(tmp_dir):
+            region = ocr_words(img, lang=lang, backend=backend, handoff=handoff,
+                               preprocess=preprocess, target_x_height=target_x_height, psm=ADAPTIVE_PSM)
+            if region['conf'] and max(region['conf']) >= conf_threshold:
+                # Asignar las palabras a la línea original y pasar sus cajas a
+                # coordenadas de la imagen de la primera pasada
+                n = len(region['text'])
+                region['block_num'], region['par_num'], region['line_num'] = \
+                    [key[0]] * n, [key[1]] * n, [key[2]] * n
+                region['left'] = [int((v + box[0]) / scale) - ox for v in region['left']]
+                region['top'] = [int((v + box[1]) / scale) - oy for v in region['top']]
+                region['width'] = [int(v / scale) for v in region['width']]
+                region['height'] = [int(v / scale) for v in region['height']]
+                replacements[key] = region
+    if timings is not None:
+        timings['second_pass'] = timings.get('second_pass', 0.0) + time.perf_counter() - start
+
+    if not replacements:
+        return words, len(regions), 0
+
+    # Reconstruir la tabla sustituyendo las palabras de las líneas recuperadas
+    recovered = set(replacements)
+    refined = {col: [] for col in WORD_COLUMNS}
+    for i in range(len(words['text'])):
+        key = (words['block_num'][i], words['par_num'][i], words['line_num'][i])
+        if key in recovered:
+            # La línea nueva se inserta en la posición de su primera palabra
+            region = replacements.pop(key, None)
+            if region is not None:
+                for col in WORD_COLUMNS:
+                    refined[col].extend(region[col])
+            continue
+        for col in WORD_COLUMNS:
+            refined[col].append(words[col][i])
+    return refined, len(regions), len(recovered)
+
+def ocr_page(input_pdf: str,
+             page_num: int,
+             dpi: int = 300,
+             conf_threshold: int = 60,
+             area: tuple = None,
+             keep_words: bool = False,
+             lang: str = None,
+             backend: str = None,
+             handoff: str = None,
+             areas: dict = None,
+             low_dpi: int = None,
+             preprocess: tuple = (),
+             target_x_height: int = None,
+             layout: bool = False,
+             layout_workers: int = None):
+    """
+    Rasteriza y aplica OCR a una única página. Está pensada para ejecutarse
+    en un proceso del pool, por eso sólo recibe y devuelve datos serializables;
+    con el motor 'tesserocr' cada proceso del pool conserva su modelo cargado.
+
+    Con `area` sólo se rasteriza esa región; con `areas` ({nombre: área}) se
+    rasteriza y reconoce cada región por separado y el texto se agrupa en
+    subsecciones con su nombre.
+
+    Con `low_dpi` se usa el modo adaptativo: primera pasada a `low_dpi` y
+    segunda pasada a `dpi` sólo de las líneas que no llegan al umbral.
+
+    `preprocess` son los pasos de preprocesado antes del OCR (ver preprocess)
+    y `layout` activa la segmentación en bloques (ver ocr_words).
+
+    Devuelve (número de página, texto, palabras, info); las palabras sólo se
+    devuelven si `keep_words` es True. `info` contiene los tiempos por etapa
+    y, en modo adaptativo, las regiones de la segunda pasada; con `layout`,
+    los bloques encontrados.
+    """
+    timings = {}
+    info = {"timings": timings}
+    render_dpi = low_dpi or dpi
+    regions = areas if areas else {None: area}
+    region_words = {}
+    for name, box in regions.items():
+        # Las áreas están en píxeles a `dpi`; en la primera pasada se escalan
+        render_box = scale_box(box, render_dpi / dpi) if box and low_dpi else box
+        start = time.perf_counter()
+        for _, img in iter_pdf_pages(input_pdf, dpi=render_dpi, first_page=page_num,
+                                     last_page=page_num, area=render_box,
+                                     grayscale='grayscale' in preprocess):
+            timings['render'] = timings.get('render', 0.0) + time.perf_counter() - start
+            region_words[name] = ocr_words(img, lang=lang, backend=backend,
+                                           handoff=handoff, timings=timings,
+                                           preprocess=preprocess, target_x_height=target_x_height,
+                                           layout=layout, layout_workers=layout_workers, counters=info)
+        if low_dpi and name in region_words:
+            origin = render_box[:2] if render_box else (0, 0)
+            region_words[name], second_pass, recovered = refine_low_confidence_lines(
+                input_pdf, page_num, region_words[name], conf_threshold, low_dpi, dpi,
+                origin=origin, lang=lang, backend=backend, handoff=handoff, timings=timings,
+                preprocess=preprocess, target_x_height=target_x_height)
+            info["second_pass_regions"] = info.get("second_pass_regions", 0) + second_pass
+            info["recovered_lines"] = info.get("recovered_lines", 0) + recovered
+
+    words = {"areas": region_words} if areas else region_words.get(None, {col: [] for col in WORD_COLUMNS})
+    start = time.perf_counter()
+    texto = page_text_from_words(words, conf_threshold=conf_threshold)
+    timings['assemble'] = time.perf_counter() - start
+    return page_num, texto, words if keep_words else None, info
+
+# Páginas en blanco: proporción de tinta por debajo de la cual una página no
+# pasa por el OCR (0 desactiva la detección) y texto con el que se marca
+DEFAULT_BLANK_THRESHOLD = float(os.environ.get("BLANK_PAGE_THRESHOLD", "0.0002"))
+BLANK_PAGE_TEXT = '[página en blanco]'
+# Páginas que se rasterizan a la vez al generar las miniaturas
+BLANK_THUMB_BATCH = 50
+
+def detect_blank_pages(input_pdf: str, pages: list, threshold: float, dpi: int,
+                       area: tuple = None) -> dict:
+    """
+    Rasteriza `pages` a BLANK_THUMB_DPI en gris y devuelve {página: tinta}
+    de las que no llegan a `threshold` (ver preprocess.ink_ratio). Con `area`
+    (en píxeles a `dpi`) sólo se mira esa región.
+    """
+    if not pages or threshold <= 0:
+        return {}
+    thumb_area = scale_box(area, BLANK_THUMB_DPI / dpi) if area else None
+    blank = {}
+    for page_num, img in iter_pdf_pages(input_pdf, dpi=BLANK_THUMB_DPI, batch_size=BLANK_THUMB_BATCH,
+                                        pages=pages, area=thumb_area, grayscale=True):
+        ratio = ink_ratio(img)
+        if ratio < threshold:
+            blank[page_num] = ratio
+    return blank
+
+def record_page_info(report: dict, page_num: int, info: dict):
+    """Añade al informe los tiempos y contadores de una página procesada con OCR."""
+    report["pages"][page_num - 1].update(info)
+    add_timings(report["timings"], info["timings"])
+    for counter in ("second_pass_regions", "recovered_lines", "layout_blocks", "handwriting_blocks"):
+        if counter in info:
+            report[counter] = report.get(counter, 0) + info[counter]
+
+def add_timings(total: dict, timings: dict):
+    """Suma los tiempos por etapa de una página a los totales del documento."""
+    for stage, seconds in timings.items():
+        total[stage] = total.get(stage, 0.0) + seconds
+
+def format_timings(timings: dict) -> str:
+    """Resumen legible de los tiempos por etapa (para los logs)."""
+    return ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items())
+
+def write_page(md, page_num: int, texto: str):
+    """Escribe la sección Markdown de una página."""
+    md.write(f'## Página {page_num}\n\n')
+    # Escapamos líneas vacías
+    for line in texto.split('\n'):
+        md.write(line + '\n')
+    md.write('\n---\n\n')
+
 def process_pdf_to_markdown(input_pdf: str,
                            output_md: str,
                            dpi: int = 300,
                            lang: str = 'spa',
                            conf_threshold: int = 60,
                            area: tuple = None,
-                           log_callback = None):
+                           log_callback = None,
+                           batch_size: int = 1,
+                           workers: int = 1,
+                           words_path: str = None,
+                           mode: str = 'auto',
+                           ocr_backend: str = None,
+                           executor = None,
+                           ocr_handoff: str = None,
+                           areas: dict = None,
+                           adaptive: bool = False,
+                           low_dpi: int = ADAPTIVE_LOW_DPI,
+                           progress_callback = None,
+                           preprocess = None,
+                           target_x_height: int = None,
+                           blank_threshold: float = None,
+                           layout: bool = None,
+                           layout_workers: int = None) -> dict:
     """
     Convierte cada página de un PDF en imagen, extrae el texto impreso
     y genera un .md con marcadores para manuscritos.
+
+    Con `area` (left, upper, right, lower, en píxeles a `dpi`) sólo se
+    rasteriza esa región de cada página. Con `areas` ({nombre: área}) se
+    extraen varias regiones con nombre por página en una sola pasada, cada
+    una en su subsección `### nombre`.
+
+    Con `adaptive` las páginas se reconocen primero a `low_dpi` y sólo las
+    líneas que no llegan a `conf_threshold` se vuelven a rasterizar a `dpi`
+    antes de marcarlas como '[texto manuscrito]'.
+
+    Las páginas se rasterizan en ventanas de `batch_size` páginas y se
+    escriben en el .md según se procesan, por lo que el pico de memoria no
+    crece con el número de páginas. Con `workers` > 1 el renderizado y el OCR
+    de varias páginas se reparten en un pool de procesos; las secciones se
+    siguen escribiendo en orden de página.
+
+    Con `mode` 'auto' las páginas que ya tienen una capa de texto aprovechable
+    no se rasterizan: se usa directamente su texto. 'ocr' fuerza el OCR en
+    todas y 'text' usa sólo la capa de texto.
+
+    Si se indica `words_path`, las palabras detectadas en cada página se
+    guardan en ese fichero para poder regenerar el .md con otro umbral
+    mediante `rebuild_markdown_from_words`.
+
+    `ocr_backend` elige el motor de OCR (por defecto, OCR_BACKEND) y
+    `ocr_handoff` cómo se le pasa la imagen (por defecto, OCR_HANDOFF). Se puede
+    pasar un `executor` (ProcessPoolExecutor) de larga duración para que los
+    motores de OCR de sus procesos sigan cargados entre trabajos; en ese caso
+    `workers` sólo limita las páginas en vuelo de este documento.
+
+    `preprocess` elige los pasos de preprocesado de las páginas antes del OCR
+    (gris, limpieza, enderezado, reducción a `target_x_height` píxeles de
+    altura de letra y binarización; por defecto, OCR_PREPROCESS). Ver
+    preprocess.
+
+    Antes del OCR se mira una miniatura de cada página: las que tienen menos
+    tinta que `blank_threshold` (proporción de la página; por defecto,
+    BLANK_PAGE_THRESHOLD; 0 desactiva la detección) no se rasterizan a `dpi`
+    ni pasan por el OCR y se marcan como '[página en blanco]'.
+
+    Con `layout` (por defecto, OCR_LAYOUT) cada página se divide en bloques
+    en orden de lectura; los impresos se reconocen en paralelo en
+    `layout_workers` hilos y los manuscritos se marcan sin OCR (ver layout).
+    Si las páginas ya se reparten entre procesos, cada página usa un hilo
+    salvo que se indique `layout_workers`.
+
+    `progress_callback(pages_done, total_pages, md_bytes)` se llama cada vez
+    que una página queda escrita (y volcada a disco) en el .md; `md_bytes` es
+    el tamaño del .md en ese momento, es decir, el final de esa página. Como
+    las páginas se escriben en orden, con esos desplazamientos se pueden leer
+    las páginas terminadas mientras se procesan las siguientes.
+
+    Devuelve un informe con la vía (capa de texto u OCR) usada en cada página,
+    los tiempos por etapa (render, preprocesado, segmentación, traspaso de la
+    imagen, OCR, montaje del texto y escritura), en modo adaptativo cuántas
+    regiones pasaron a la segunda pasada y, con `layout`, cuántos bloques se
+    encontraron y cuántos se marcaron como manuscritos.
     """
     # Si hay una función de log, la usamos
     def log(message):
         if log_callback:
             log_callback(message)
         print(message)  # También imprimimos en consola
+
+    def progress(pages_done):
+        # Volcar la página para que sea legible desde fuera mientras seguimos
+        md.flush()
+        if progress_callback:
+            progress_callback(pages_done, total_pages, md.tell())
     
-    log(f"Iniciando conversión del PDF {os.path.basename(input_pdf)}")
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Modo de extracción no válido: {mode} (opciones: {', '.join(EXTRACTION_MODES)})")
+
+    backend = resolve_backend(ocr_backend)
+    log(f"Iniciando conversión del PDF {os.path.basename(input_pdf)} (motor de OCR: {backend})")
+    preprocess = parse_preprocess(preprocess)
+    target_x_height = target_x_height or DEFAULT_TARGET_X_HEIGHT
+    if preprocess:
+        log(f"Preprocesado antes del OCR: {', '.join(preprocess)}"
+            + (f" (altura de letra objetivo: {target_x_height} px)" if 'downscale' in preprocess else ""))
+    if layout is None:
+        layout = DEFAULT_LAYOUT
+    parallel_pages = workers > 1 or executor is not None
+    if layout:
+        # Con las páginas ya en paralelo, más hilos por página sólo compiten por la CPU
+        layout_workers = layout_workers or (1 if parallel_pages else DEFAULT_LAYOUT_WORKERS)
+        log(f"Segmentación en bloques antes del OCR ({layout_workers} hilos por página)")
     
-    # convierte PDF a imágenes
-    log("Convirtiendo PDF a imágenes...")
-    images = convert_from_path(input_pdf, dpi=dpi)
-    log(f"PDF convertido a {len(images)} imágenes")
+    total_pages = get_page_count(input_pdf)
 
-    with open(output_md, 'w', encoding='utf-8') as md:
-        for page_num, img in enumerate(images, start=1):
-            log(f"Procesando página {page_num}/{len(images)}")
-            
-            # Si se pasa un área (left, upper, right, lower), recortamos
-            if area:
-                log(f"Recortando área específica: {area}")
-                img = img.crop(area)
-
-            md.write(f'## Página {page_num}\n\n')
-            
-            # Extraemos texto con placeholders
-            log(f"Aplicando OCR a la página {page_num}...")
-            texto = ocr_impreso_con_placeholder(img, conf_threshold=conf_threshold)
-            log(f"OCR completado para página {page_num}")
-            
-            # Escapamos líneas vacías
-            for line in texto.split('\n'):
-                md.write(line + '\n')
-            md.write('\n---\n\n')
+    if area:
+        area = validate_area(area)
+    if areas:
+        areas = {name: validate_area(box) for name, box in areas.items()}
+        log(f"Se extraerán {len(areas)} áreas con nombre por página: {', '.join(areas)}")
+
+    # Modo adaptativo: sólo tiene sentido si la primera pasada es más barata
+    if adaptive and low_dpi >= dpi:
+        log(f"Modo adaptativo desactivado: el DPI bajo ({low_dpi}) no es menor que {dpi}")
+        adaptive = False
+    first_pass_dpi = low_dpi if adaptive else None
+    if adaptive:
+        log(f"Modo adaptativo: primera pasada a {low_dpi} DPI y segunda a {dpi} DPI para las líneas dudosas")
+
+    # La capa de texto no se puede recortar a un área en píxeles
+    if (area or areas) and mode == 'auto':
+        log("Se han indicado áreas: se aplicará OCR a todas las páginas")
+        mode = 'ocr'
+
+    # Páginas que ya tienen texto embebido y no necesitan OCR
+    text_pages = extract_text_layer(input_pdf, total_pages, mode=mode, log_callback=log)
+    ocr_pages = [p for p in range(1, total_pages + 1) if p not in text_pages]
+    if mode != 'ocr':
+        log(f"Capa de texto aprovechable en {len(text_pages)} de {total_pages} páginas; "
+            f"{len(ocr_pages)} páginas necesitan OCR")
+
+    # Páginas en blanco: se descartan con una miniatura, sin render a `dpi` ni OCR
+    if blank_threshold is None:
+        blank_threshold = DEFAULT_BLANK_THRESHOLD
+    start = time.perf_counter()
+    blank_pages = detect_blank_pages(input_pdf, ocr_pages, blank_threshold, dpi, area=area)
+    blank_check_seconds = time.perf_counter() - start
+    if blank_pages:
+        ocr_pages = [p for p in ocr_pages if p not in blank_pages]
+        log(f"Páginas en blanco omitidas (sin OCR): {len(blank_pages)} "
+            f"({', '.join(str(p) for p in sorted(blank_pages))})")
+
+    report = {
+        "mode": mode,
+        "total_pages": total_pages,
+        "text_pages": len(text_pages),
+        "ocr_pages": len(ocr_pages),
+        "blank_pages": len(blank_pages),
+        "pages": [{"page": p, "source": "text" if p in text_pages else "blank" if p in blank_pages else "ocr"}
+                  for p in range(1, total_pages + 1)],
+        "timings": {'blank_check': blank_check_seconds} if blank_threshold > 0 and (ocr_pages or blank_pages) else {},
+        "adaptive": adaptive,
+        "preprocess": list(preprocess),
+        "layout": layout
+    }
+    if adaptive:
+        report["second_pass_regions"] = 0
+        report["recovered_lines"] = 0
+    if layout:
+        report["layout_blocks"] = 0
+        report["handwriting_blocks"] = 0
+    for page_num, ratio in blank_pages.items():
+        report["pages"][page_num - 1]["ink_ratio"] = round(ratio, 6)
+
+    with open(output_md, 'w', encoding='utf-8') as md, \
+            (gzip.open(words_path, 'wt', encoding='utf-8') if words_path else nullcontext()) as sidecar:
+        if parallel_pages and ocr_pages:
+            log(f"El PDF tiene {total_pages} páginas. Se procesarán en paralelo con {workers} procesos")
+            _process_pages_parallel(input_pdf, md, sidecar, total_pages, text_pages, dpi,
+                                    conf_threshold, area, workers, log, lang, backend, executor,
+                                    ocr_handoff, report, areas, first_pass_dpi, progress,
+                                    preprocess, target_x_height, blank_pages, layout, layout_workers)
+        else:
+            log(f"El PDF tiene {total_pages} páginas. Se convertirán a imagen en bloques de {max(1, batch_size)}")
+            # Las imágenes sólo se generan para las páginas que necesitan OCR
+            # (con áreas con nombre o en modo adaptativo, en ocr_page)
+            images = iter_pdf_pages(input_pdf, dpi=dpi, batch_size=batch_size,
+                                    pages=[] if areas or adaptive else ocr_pages, area=area,
+                                    grayscale='grayscale' in preprocess)
+            for page_num in range(1, total_pages + 1):
+                log(f"Procesando página {page_num}/{total_pages}")
+
+                if page_num in text_pages:
+                    log(f"Página {page_num}: se usa la capa de texto del PDF (sin OCR)")
+                    texto = text_pages.pop(page_num)
+                    start = time.perf_counter()
+                    write_page(md, page_num, texto)
+                    if sidecar:
+                        write_page_words(sidecar, page_num, text=texto)
+                    progress(page_num)
+                    add_timings(report["timings"], {'write': time.perf_counter() - start})
+                    continue
+
+                if page_num in blank_pages:
+                    log(f"Página {page_num}: en blanco, se omite el OCR")
+                    start = time.perf_counter()
+                    write_page(md, page_num, BLANK_PAGE_TEXT)
+                    if sidecar:
+                        write_page_words(sidecar, page_num, text=BLANK_PAGE_TEXT)
+                    progress(page_num)
+                    add_timings(report["timings"], {'write': time.perf_counter() - start})
+                    continue
+
+                if areas or adaptive:
+                    log(f"Aplicando OCR a la página {page_num}...")
+                    _, texto, words, info = ocr_page(input_pdf, page_num, dpi=dpi,
+                                                     conf_threshold=conf_threshold, area=area,
+                                                     keep_words=True, lang=lang,
+                                                     backend=backend, handoff=ocr_handoff,
+                                                     areas=areas, low_dpi=first_pass_dpi,
+                                                     preprocess=preprocess,
+                                                     target_x_height=target_x_height,
+                                                     layout=layout, layout_workers=layout_workers)
+                    timings = info["timings"]
+                else:
+                    timings = {}
+                    info = {"timings": timings}
+                    start = time.perf_counter()
+                    _, img = next(images)
+                    timings['render'] = time.perf_counter() - start
+                    if area:
+                        log(f"Área específica renderizada: {area}")
+
+                    # Extraemos texto con placeholders
+                    log(f"Aplicando OCR a la página {page_num}...")
+                    words = ocr_words(img, lang=lang, backend=backend, handoff=ocr_handoff, timings=timings,
+                                      preprocess=preprocess, target_x_height=target_x_height,
+                                      layout=layout, layout_workers=layout_workers, counters=info)
+                    start = time.perf_counter()
+                    texto = words_to_text(words, conf_threshold=conf_threshold)
+                    timings['assemble'] = time.perf_counter() - start
+                log(f"OCR completado para página {page_num} ({format_timings(timings)})")
+                if info.get("layout_blocks"):
+                    log(f"Página {page_num}: {info['layout_blocks']} bloques, "
+                        f"{info['handwriting_blocks']} manuscritos (sin OCR)")
+                if info.get("second_pass_regions"):
+                    log(f"Página {page_num}: {info['second_pass_regions']} regiones en segunda pasada, "
+                        f"{info['recovered_lines']} líneas recuperadas")
+                record_page_info(report, page_num, info)
+
+                start = time.perf_counter()
+                write_page(md, page_num, texto)
+                if sidecar:
+                    write_page_words(sidecar, page_num, words)
+                progress(page_num)
+                add_timings(report["timings"], {'write': time.perf_counter() - start})
+            images.close()
     
+    if blank_pages:
+        log(f"Se omitió el OCR de {len(blank_pages)} páginas en blanco")
+    if report["timings"]:
+        log(f"Tiempo total por etapa: {format_timings(report['timings'])}")
+    if layout:
+        log(f"Segmentación: {report['layout_blocks']} bloques, "
+            f"{report['handwriting_blocks']} marcados como manuscritos sin OCR")
+    if adaptive:
+        log(f"Modo adaptativo: {report['second_pass_regions']} regiones en segunda pasada, "
+            f"{report['recovered_lines']} líneas recuperadas como texto impreso")
     log(f"Procesamiento completado. Archivo Markdown generado: {os.path.basename(output_md)}")
+    return report
+
+def _process_pages_parallel(input_pdf, md, sidecar, total_pages, text_pages, dpi,
+                            conf_threshold, area, workers, log, lang=None, backend=None,
+                            executor=None, handoff=None, report=None, areas=None,
+                            low_dpi=None, progress=None, preprocess=(), target_x_height=None,
+                            blank_pages=(), layout=False, layout_workers=None):
+    """
+    Reparte las páginas entre `workers` procesos y escribe los resultados en
+    orden. Como mucho hay 2 * workers páginas en vuelo, de modo que los
+    resultados pendientes de escribir tampoco crecen con el documento. Las
+    páginas de `text_pages` y `blank_pages` no pasan por el pool. Si no se pasa un
+    `executor` compartido se crea uno sólo para este documento. Si el proceso se
+    interrumpe, se cancelan las páginas que aún no han empezado.
+    """
+    max_in_flight = workers * 2
+    next_to_submit = 1
+    next_to_write = 1
+    done_pages = 0
+    finished = {}
+    in_flight = set()
+    keep_words = sidecar is not None
+
+    with (nullcontext(executor) if executor is not None
+          else ProcessPoolExecutor(max_workers=workers)) as executor:
+        try:
+            while next_to_write <= total_pages:
+                # Mantener el pool ocupado sin adelantarse demasiado a la escritura
+                while next_to_submit <= total_pages and len(in_flight) + len(finished) < max_in_flight:
+                    if next_to_submit in text_pages:
+                        finished[next_to_submit] = (text_pages.pop(next_to_submit), None)
+                        done_pages += 1
+                        log(f"Página {next_to_submit}: se usa la capa de texto del PDF ({done_pages}/{total_pages})")
+                    elif next_to_submit in blank_pages:
+                        finished[next_to_submit] = (BLANK_PAGE_TEXT, None)
+                        done_pages += 1
+                        log(f"Página {next_to_submit}: en blanco, se omite el OCR ({done_pages}/{total_pages})")
+                    else:
+                        in_flight.add(executor.submit(ocr_page, input_pdf, next_to_submit,
+                                                      dpi, conf_threshold, area, keep_words,
+                                                      lang, backend, handoff, areas, low_dpi,
+                                                      preprocess, target_x_height, layout,
+                                                      layout_workers))
+                    next_to_submit += 1
+
+                if in_flight:
+                    completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        page_num, texto, words, info = future.result()
+                        finished[page_num] = (texto, words)
+                        done_pages += 1
+                        log(f"OCR completado para página {page_num} ({done_pages}/{total_pages}; "
+                            f"{format_timings(info['timings'])})")
+                        if report is not None:
+                            record_page_info(report, page_num, info)
+
+                # Volcar al .md todas las páginas consecutivas ya disponibles
+                while next_to_write in finished:
+                    texto, words = finished.pop(next_to_write)
+                    start = time.perf_counter()
+                    write_page(md, next_to_write, texto)
+                    if sidecar:
+                        if words is not None:
+                            write_page_words(sidecar, next_to_write, words)
+                        else:
+                            write_page_words(sidecar, next_to_write, text=texto)
+                    if progress:
+                        progress(next_to_write)
+                    if report is not None:
+                        add_timings(report["timings"], {'write': time.perf_counter() - start})
+                    next_to_write += 1
+        except BaseException:
+            # Si se aborta el trabajo (error, concesión perdida...), no dejar
+            # páginas encoladas ocupando el pool compartido
+            for future in in_flight:
+                future.cancel()
+            raise
+
+def expand_inputs(pattern: str) -> list:
+    """PDF a procesar: el fichero indicado, los .pdf de un directorio o los que casan con un glob."""
+    if os.path.isdir(pattern):
+        return sorted(glob.glob(os.path.join(pattern, '*.pdf')) + glob.glob(os.path.join(pattern, '*.PDF')))
+    if glob.has_magic(pattern):
+        return sorted(p for p in glob.glob(pattern, recursive=True) if p.lower().endswith('.pdf'))
+    return [pattern]
+
+def is_batch_input(pattern: str) -> bool:
+    return os.path.isdir(pattern) or glob.has_magic(pattern)
+
+def process_pdf_batch(input_pdfs: list, output_dir: str, workers: int = 1,
+                      words_dir: str = None, log_callback=None, **options) -> dict:
+    """
+    Convierte varios PDF, cada uno a `{output_dir}/{nombre}.md`. Con
+    `workers` > 1 todos los documentos comparten un mismo pool de procesos,
+    que se crea una sola vez. Un documento que falla no detiene el lote.
+    Devuelve el informe de cada documento y las páginas hechas/totales.
+    """
+    def log(message):
+        if log_callback:
+            log_callback(message)
+        print(message)
+
+    os.makedirs(output_dir, exist_ok=True)
+    if words_dir:
+        os.makedirs(words_dir, exist_ok=True)
+
+    # Páginas totales del lote para el progreso conjunto
+    page_counts = {}
+    for pdf in input_pdfs:
+        try:
+            page_counts[pdf] = get_page_count(pdf)
+        except Exception:
+            page_counts[pdf] = 0
+    pages_total = sum(page_counts.values())
+    pages_before = 0
+    log(f"Lote de {len(input_pdfs)} documentos ({pages_total} páginas)")
+
+    summary = {"documents": [], "pages_total": pages_total, "pages_done": 0}
+    used_names = set()
+    with (ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()) as executor:
+        for index, pdf in enumerate(input_pdfs, start=1):
+            stem = os.path.splitext(os.path.basename(pdf))[0]
+            name, suffix = stem, 2
+            while name in used_names:
+                name = f'{stem}_{suffix}'
+                suffix += 1
+            used_names.add(name)
+            output_md = os.path.join(output_dir, f'{name}.md')
+            words_path = os.path.join(words_dir, f'{name}.words.jsonl.gz') if words_dir else None
+
+            def progress(pages_done, total_pages, md_bytes=None, offset=pages_before):
+                log(f"Lote: {offset + pages_done}/{pages_total} páginas")
+
+            log(f"[{index}/{len(input_pdfs)}] {pdf} -> {output_md}")
+            entry = {"input": pdf, "output": output_md}
+            try:
+                entry["report"] = process_pdf_to_markdown(
+                    pdf, output_md, workers=workers, words_path=words_path, executor=executor,
+                    log_callback=log_callback, progress_callback=progress, **options)
+                summary["pages_done"] += page_counts[pdf]
+            except Exception as e:
+                log(f"Error al procesar {pdf}: {e}")
+                entry["error"] = str(e)
+            pages_before += page_counts[pdf]
+            summary["documents"].append(entry)
+
+    failed = sum(1 for entry in summary["documents"] if "error" in entry)
+    log(f"Lote completado: {len(input_pdfs) - failed} documentos convertidos, {failed} con errores")
+    return summary
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description='OCR avanzado: texto impreso + marcadores para manuscrito')
-    parser.add_argument('input_pdf', help='PDF de entrada')
-    parser.add_argument('output_md', help='Archivo Markdown de salida')
+    parser.add_argument('input_pdf',
+                        help='PDF de entrada (o fichero de palabras si se usa --from-words). '
+                             'Con un directorio o un glob entre comillas (p. ej. "docs/*.pdf") se procesa un lote')
+    parser.add_argument('output_md',
+                        help='Archivo Markdown de salida (en modo lote, directorio de salida)')
     parser.add_argument('--dpi', type=int, default=300,
                         help='Resolución en DPI para el renderizado (por defecto: 300)')
     parser.add_argument('--lang', default='spa',
@@ -129,6 +1032,48 @@ def parse_args():
                         help='Umbral de confianza para considerar texto impreso (0–100)')
     parser.add_argument('--area', nargs=4, type=int, metavar=('L','U','R','B'),
                         help='Área para recortar cada página (left upper right bottom)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Primera pasada a baja resolución y segunda a --dpi sólo para las líneas dudosas')
+    parser.add_argument('--low-dpi', type=int, default=ADAPTIVE_LOW_DPI,
+                        help=f'DPI de la primera pasada en modo adaptativo (por defecto: {ADAPTIVE_LOW_DPI})')
+    parser.add_argument('--named-area', nargs=5, action='append', metavar=('NAME', 'L', 'U', 'R', 'B'),
+                        help='Área con nombre a extraer de cada página; se puede repetir')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Páginas que se rasterizan a la vez (por defecto: 1)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos que aplican OCR en paralelo (por defecto: 1)')
+    parser.add_argument('--save-words', metavar='WORDS_PATH',
+                        help='Guarda las palabras detectadas para reconstruir luego el .md con otro umbral '
+                             '(en modo lote, directorio donde guardarlas)')
+    parser.add_argument('--from-words', action='store_true',
+                        help='Reconstruye el .md desde un fichero de palabras (sin OCR) con --conf-threshold')
+    parser.add_argument('--mode', choices=EXTRACTION_MODES, default='auto',
+                        help="'auto': capa de texto del PDF si es aprovechable y OCR en el resto; "
+                             "'ocr': siempre OCR; 'text': sólo capa de texto (por defecto: auto)")
+    parser.add_argument('--report', metavar='REPORT_JSON',
+                        help='Guarda en JSON el informe por página (vía usada en cada una)')
+    parser.add_argument('--ocr-backend', choices=OCR_BACKENDS, default=None,
+                        help="Motor de OCR: 'pytesseract' (un proceso por página) o 'tesserocr' "
+                             "(modelo cargado una vez por proceso). Por defecto: variable OCR_BACKEND o pytesseract")
+    parser.add_argument('--ocr-handoff', choices=HANDOFF_MODES, default=None,
+                        help="Traspaso de la imagen al OCR: 'raw' (sin recompresión) o 'png' "
+                             "(PNG temporal, comportamiento anterior). Por defecto: variable OCR_HANDOFF o raw")
+    parser.add_argument('--blank-threshold', type=float, default=None,
+                        help='Proporción de tinta por debajo de la cual una página se considera en blanco '
+                             f'y no pasa por el OCR; 0 desactiva la detección (por defecto: {DEFAULT_BLANK_THRESHOLD})')
+    parser.add_argument('--preprocess', default=None,
+                        help="Preprocesado antes del OCR: 'none', 'all' o pasos separados por comas "
+                             "(grayscale, denoise, deskew, downscale, threshold). "
+                             f"Por defecto: variable OCR_PREPROCESS o {DEFAULT_PREPROCESS}")
+    parser.add_argument('--target-x-height', type=int, default=None,
+                        help='Altura de letra (px) a la que se reduce la página con el paso downscale '
+                             f'(por defecto: {DEFAULT_TARGET_X_HEIGHT})')
+    parser.add_argument('--layout', action='store_true', default=None,
+                        help='Divide cada página en bloques antes del OCR: los impresos se reconocen en paralelo '
+                             'y los manuscritos se marcan sin OCR (por defecto: variable OCR_LAYOUT)')
+    parser.add_argument('--layout-workers', type=int, default=None,
+                        help='Hilos por página para los bloques con --layout '
+                             f'(por defecto: {DEFAULT_LAYOUT_WORKERS}, o 1 con --workers > 1)')
     return parser.parse_args()
 
 
@@ -143,16 +1088,71 @@ if __name__ == '__main__':
     pytesseract.pytesseract.run_and_get_output  # noqa: ensure library is loaded
 
     area = tuple(args.area) if args.area else None
+    areas = {name: tuple(int(v) for v in box) for name, *box in args.named_area} if args.named_area else None
 
     try:
-        process_pdf_to_markdown(
+        if args.from_words:
+            rebuild_markdown_from_words(args.input_pdf, args.output_md,
+                                        conf_threshold=args.conf_threshold)
+            print(f'Markdown regenerado en {args.output_md}')
+            sys.exit(0)
+
+        if is_batch_input(args.input_pdf):
+            input_pdfs = expand_inputs(args.input_pdf)
+            if not input_pdfs:
+                print(f'No se encontraron PDF en {args.input_pdf}', file=sys.stderr)
+                sys.exit(1)
+            summary = process_pdf_batch(
+                input_pdfs, args.output_md,
+                workers=args.workers,
+                words_dir=args.save_words,
+                dpi=args.dpi,
+                lang=args.lang,
+                conf_threshold=args.conf_threshold,
+                area=area,
+                batch_size=args.batch_size,
+                mode=args.mode,
+                ocr_backend=args.ocr_backend,
+                ocr_handoff=args.ocr_handoff,
+                areas=areas,
+                adaptive=args.adaptive,
+                low_dpi=args.low_dpi,
+                preprocess=args.preprocess,
+                target_x_height=args.target_x_height,
+                blank_threshold=args.blank_threshold,
+                layout=args.layout,
+                layout_workers=args.layout_workers
+            )
+            if args.report:
+                with open(args.report, 'w', encoding='utf-8') as f:
+                    json.dump(summary, f, ensure_ascii=False, indent=2)
+            sys.exit(1 if any('error' in entry for entry in summary['documents']) else 0)
+
+        report = process_pdf_to_markdown(
             input_pdf=args.input_pdf,
             output_md=args.output_md,
             dpi=args.dpi,
             lang=args.lang,
             conf_threshold=args.conf_threshold,
-            area=area
+            area=area,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            words_path=args.save_words,
+            mode=args.mode,
+            ocr_backend=args.ocr_backend,
+            ocr_handoff=args.ocr_handoff,
+            areas=areas,
+            adaptive=args.adaptive,
+            low_dpi=args.low_dpi,
+            preprocess=args.preprocess,
+            target_x_height=args.target_x_height,
+            blank_threshold=args.blank_threshold,
+            layout=args.layout,
+            layout_workers=args.layout_workers
         )
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
         print(f'OCR completado. Markdown generado en {args.output_md}')
     except Exception as e:
         print(f'Error durante el procesamiento: {e}', file=sys.stderr)
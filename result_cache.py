@@ -0,0 +1,109 @@
+"""
+Caché en disco de resultados Markdown direccionada por contenido.
+
+La clave de cada entrada es el SHA-256 de los bytes del PDF junto con los
+parámetros que afectan al resultado (dpi, idioma, umbral, área...). Cada
+resultado se guarda como `{clave}{sufijo}` dentro de CACHE_DIR (`.md` para
+el Markdown, `.words.jsonl.gz` para las tablas de palabras); la fecha de
+modificación del fichero hace de marca de último uso y, cuando el tamaño
+total supera CACHE_MAX_BYTES, se eliminan primero las entradas usadas hace
+más tiempo (LRU).
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict
+
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(os.environ.get("JOBS_DIR", "/app/jobs"), "cache"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_cache_lock = threading.Lock()
+
+
+def compute_cache_key(pdf_digest: str, params: Dict) -> str:
+    """
+    Combina el hash del PDF con los parámetros efectivos en una única clave.
+    `pdf_digest` es el SHA-256 (hex) de los bytes del PDF.
+    """
+    params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{pdf_digest}:{params_json}".encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str, suffix: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}{suffix}")
+
+
+def cache_lookup(key: str, dest_path: str, suffix: str = ".md") -> bool:
+    """
+    Si la clave está en caché copia el resultado a `dest_path`, marca la
+    entrada como usada y devuelve True. En caso contrario devuelve False.
+    """
+    entry = _entry_path(key, suffix)
+    with _cache_lock:
+        # Otra réplica puede expulsar la entrada entre la comprobación y la copia
+        try:
+            shutil.copyfile(entry, dest_path)
+            now = time.time()
+            os.utime(entry, (now, now))
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def cache_store(key: str, src_path: str, suffix: str = ".md"):
+    """Guarda una copia del fichero en caché y aplica el límite de tamaño."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Copia a un temporal y rename atómico para no dejar entradas a medias
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=CACHE_DIR)
+    os.close(fd)
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        with _cache_lock:
+            os.replace(tmp_path, _entry_path(key, suffix))
+            _evict_locked()
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _evict_locked() -> int:
+    """Elimina las entradas menos usadas hasta cumplir CACHE_MAX_BYTES. Devuelve los bytes liberados."""
+    entries = []
+    total = 0
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # expulsada entretanto por otra réplica
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    freed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        freed += size
+    return freed
+
+
+def cache_usage() -> Dict:
+    """Número de entradas y bytes ocupados por la caché."""
+    count = 0
+    total = 0
+    if os.path.isdir(CACHE_DIR):
+        for entry in os.scandir(CACHE_DIR):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                count += 1
+                total += entry.stat().st_size
+    return {"entries": count, "bytes": total, "max_bytes": CACHE_MAX_BYTES}
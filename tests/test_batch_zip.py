@@ -0,0 +1,110 @@
+"""
+Pruebas de la extracción de los PDF de un lote ZIP (api.extract_zip_pdfs):
+límites de tamaño y de documentos y nombres de miembros que no son PDF o
+intentan salir del directorio.
+"""
+import io
+import os
+import sys
+import tempfile
+import zipfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# api crea JOBS_DIR (y el almacén) al importarse
+os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="pdf2md-tests-"))
+
+import api  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+PDF = b"%PDF-1.4\n" + b"0" * 1000 + b"\n%%EOF\n"
+
+
+@pytest.fixture
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "JOBS_DIR", str(tmp_path / "jobs"))
+    os.makedirs(api.JOBS_DIR)
+    return api.JOBS_DIR
+
+
+def make_zip(tmp_path, members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    path = tmp_path / "lote.zip"
+    path.write_bytes(buffer.getvalue())
+    return str(path)
+
+
+def test_extracts_only_pdfs_inside_jobs_dir(tmp_path, jobs_dir):
+    zip_path = make_zip(tmp_path, [
+        ("a.pdf", PDF),
+        ("docs/B.PDF", PDF),
+        ("../../fuera.pdf", PDF),
+        ("/abs/ruta.pdf", PDF),
+        ("notas.txt", b"texto"),
+        ("__MACOSX/._a.pdf", b"metadatos"),
+        ("carpeta/", b""),
+    ])
+    created = []
+    api.extract_zip_pdfs(zip_path, created, max_files=10, max_bytes=10 ** 6)
+
+    assert [name for _, name, _, _ in created] == ["a.pdf", "B.PDF", "fuera.pdf", "ruta.pdf"]
+    for job_id, _, pdf_path, _ in created:
+        assert os.path.dirname(pdf_path) == jobs_dir
+        assert os.path.basename(pdf_path) == f"{job_id}.pdf"
+    assert sorted(os.listdir(jobs_dir)) == sorted(f"{job_id}.pdf" for job_id, _, _, _ in created)
+    assert not os.path.exists(tmp_path / "fuera.pdf")
+
+
+def test_too_many_documents(tmp_path, jobs_dir):
+    zip_path = make_zip(tmp_path, [(f"{i}.pdf", PDF) for i in range(3)])
+    created = []
+    with pytest.raises(HTTPException) as error:
+        api.extract_zip_pdfs(zip_path, created, max_files=2, max_bytes=10 ** 6)
+    assert error.value.status_code == 400
+    # Lo ya extraído queda en `created` para que el llamante lo deshaga
+    assert len(created) == 2
+
+
+def test_total_size_over_the_cap(tmp_path, jobs_dir):
+    # Muy comprimible: el ZIP es pequeño pero descomprimido pasa del límite
+    zip_path = make_zip(tmp_path, [("a.pdf", PDF), ("b.pdf", PDF + b"0" * 50000)])
+    assert os.path.getsize(zip_path) < 5000
+    created = []
+    with pytest.raises(HTTPException) as error:
+        api.extract_zip_pdfs(zip_path, created, max_files=10, max_bytes=20000)
+    assert error.value.status_code == 413
+    assert [name for _, name, _, _ in created] == ["a.pdf"]
+    assert len(os.listdir(jobs_dir)) == 1
+
+
+def test_cap_counts_documents_already_extracted(tmp_path, jobs_dir):
+    first = make_zip(tmp_path, [("a.pdf", PDF)])
+    created = []
+    api.extract_zip_pdfs(first, created, max_files=10, max_bytes=1500)
+    with pytest.raises(HTTPException) as error:
+        api.extract_zip_pdfs(first, created, max_files=10, max_bytes=1500)
+    assert error.value.status_code == 413
+    assert len(created) == 1
+
+
+def test_member_over_upload_limit(tmp_path, jobs_dir, monkeypatch):
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 500)
+    zip_path = make_zip(tmp_path, [("a.pdf", PDF)])
+    with pytest.raises(HTTPException) as error:
+        api.extract_zip_pdfs(zip_path, [], max_files=10, max_bytes=10 ** 6)
+    assert error.value.status_code == 413
+    assert os.listdir(jobs_dir) == []
+
+
+def test_invalid_zip(tmp_path, jobs_dir):
+    path = tmp_path / "roto.zip"
+    path.write_bytes(b"no es un zip")
+    with pytest.raises(HTTPException) as error:
+        api.extract_zip_pdfs(str(path), [], max_files=10, max_bytes=10 ** 6)
+    assert error.value.status_code == 400
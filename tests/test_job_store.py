@@ -0,0 +1,115 @@
+"""
+Pruebas de la cola compartida de job_store (concesiones y reintentos) sobre
+una base de datos SQLite temporal.
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import job_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def temp_store(tmp_path, monkeypatch):
+    """Cada prueba con su propia base de datos y conexiones nuevas."""
+    monkeypatch.setattr(job_store, "JOBS_DB", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_store, "_initialized", False)
+    monkeypatch.setattr(job_store, "_local", threading.local())
+
+
+def make_job(job_id):
+    now = time.time()
+    job_store.save_job({"id": job_id, "status": "pending", "created_at": now,
+                        "updated_at": now, "pdf_path": f"/tmp/{job_id}.pdf"})
+    assert job_store.enqueue_job(job_id, max_pending=100)
+
+
+def test_two_claimers_get_one_job_once():
+    make_job("a")
+    barrier = threading.Barrier(2)
+    claimed = {}
+
+    def claim(owner):
+        barrier.wait()
+        claimed[owner] = job_store.claim_job(owner, lease_seconds=60, batch_slots=0, max_attempts=3)
+
+    threads = [threading.Thread(target=claim, args=(owner,)) for owner in ("n1", "n2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [job for job in claimed.values() if job is not None]
+    assert len(winners) == 1
+    assert winners[0]["id"] == "a"
+    assert winners[0]["status"] == "processing"
+    assert winners[0]["attempts"] == 1
+
+
+def test_expired_lease_is_reclaimed_with_next_attempt():
+    make_job("a")
+    first = job_store.claim_job("n1", lease_seconds=-1, batch_slots=0, max_attempts=3)
+    assert first["attempts"] == 1
+    assert not job_store.renew_lease("a", "n2", 60)
+
+    second = job_store.claim_job("n2", lease_seconds=60, batch_slots=0, max_attempts=3)
+    assert second["id"] == "a"
+    assert second["attempts"] == 2
+    assert not job_store.renew_lease("a", "n1", 60)
+    assert job_store.renew_lease("a", "n2", 60, progress={"pages_done": 1})
+    assert job_store.load_job("a")["progress"] == {"pages_done": 1}
+    # Con la concesión vigente nadie más puede reclamarlo
+    assert job_store.claim_job("n3", lease_seconds=60, batch_slots=0, max_attempts=3) is None
+
+
+def test_stale_owner_cannot_save():
+    make_job("a")
+    job = job_store.claim_job("n1", lease_seconds=-1, batch_slots=0, max_attempts=3)
+    job_store.claim_job("n2", lease_seconds=60, batch_slots=0, max_attempts=3)
+
+    job["status"] = "completed"
+    with pytest.raises(job_store.LeaseLost):
+        job_store.save_job(job, owner="n1")
+    assert job_store.load_job("a")["status"] == "processing"
+
+    job_store.save_job(job, owner="n2")
+    assert job_store.load_job("a")["status"] == "completed"
+
+
+def test_released_lease_cannot_be_saved_or_reclaimed():
+    make_job("a")
+    job = job_store.claim_job("n1", lease_seconds=60, batch_slots=0, max_attempts=3)
+    job["status"] = "completed"
+    job_store.save_job(job, owner="n1")
+    job_store.release_lease("a", "n1")
+
+    with pytest.raises(job_store.LeaseLost):
+        job_store.save_job(job, owner="n1")
+    assert job_store.claim_job("n2", lease_seconds=60, batch_slots=0, max_attempts=3) is None
+
+
+def test_exhausted_attempts_are_failed_once():
+    make_job("a")
+    for owner in ("n1", "n2"):
+        assert job_store.claim_job(owner, lease_seconds=-1, batch_slots=0, max_attempts=2) is not None
+
+    # Agotados los intentos ya no se reclama: queda para abandoned_jobs
+    assert job_store.claim_job("n3", lease_seconds=60, batch_slots=0, max_attempts=2) is None
+    abandoned = job_store.abandoned_jobs(max_attempts=2)
+    assert [job["id"] for job in abandoned] == ["a"]
+
+    job = abandoned[0]
+    job["status"] = "error"
+    job["updated_at"] = time.time()
+    assert job_store.fail_abandoned_job(job, max_attempts=2)
+    # Un segundo nodo que lo viera abandonado ya no lo cuenta otra vez
+    assert not job_store.fail_abandoned_job(job, max_attempts=2)
+    assert job_store.abandoned_jobs(max_attempts=2) == []
+    assert job_store.load_job("a")["status"] == "error"
+    with pytest.raises(job_store.LeaseLost):
+        job_store.save_job(job, owner="n2")
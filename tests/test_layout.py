@@ -0,0 +1,96 @@
+"""
+Pruebas de la segmentación en bloques (layout) y de la detección de páginas
+sin tinta (preprocess.ink_ratio) con páginas sintéticas.
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import layout  # noqa: E402
+from preprocess import ink_ratio  # noqa: E402
+from process_pdf import DEFAULT_BLANK_THRESHOLD  # noqa: E402
+
+
+def blank_page(height=1600, width=1200):
+    return np.full((height, width), 255, np.uint8)
+
+
+def draw_paragraph(gray, x, y, lines):
+    for i in range(lines):
+        cv2.putText(gray, "lorem ipsum dolor", (x, y + i * 40), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+
+
+def speckle_page(seed=0, specks=400):
+    gray = blank_page()
+    rng = np.random.default_rng(seed)
+    gray[rng.integers(0, gray.shape[0], specks), rng.integers(0, gray.shape[1], specks)] = 0
+    return gray
+
+
+def test_xy_cut_orders_columns_left_to_right():
+    mask = np.zeros((100, 200), bool)
+    mask[10:20, 10:190] = True    # título a todo el ancho
+    mask[40:90, 110:190] = True   # columna derecha
+    mask[40:90, 10:90] = True     # columna izquierda
+    assert layout.xy_cut(mask, row_gap=5, column_gap=5) == [
+        (10, 10, 190, 20), (10, 40, 90, 90), (110, 40, 190, 90)]
+
+
+def test_two_columns_in_reading_order():
+    gray = blank_page()
+    cv2.putText(gray, "A TITLE ACROSS THE PAGE", (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 0, 3)
+    draw_paragraph(gray, 660, 250, 8)
+    draw_paragraph(gray, 60, 250, 8)
+
+    blocks = layout.segment_page(gray)
+    boxes = [block["box"] for block in blocks]
+    assert len(blocks) == 3
+    # Título, columna izquierda y columna derecha
+    assert boxes[0][3] < boxes[1][1] and boxes[0][3] < boxes[2][1]
+    assert boxes[1][2] < boxes[2][0]
+    assert [block["kind"] for block in blocks] == ["printed"] * 3
+    assert [block["lines"] for block in blocks] == [1, 8, 8]
+
+
+def test_speckle_page_is_skipped():
+    gray = speckle_page()
+    assert layout.segment_page(gray) == []
+    assert ink_ratio(Image.fromarray(gray)) < DEFAULT_BLANK_THRESHOLD
+
+
+def test_low_contrast_noise_is_not_segmented():
+    rng = np.random.default_rng(0)
+    gray = np.clip(rng.normal(200, 10, (1600, 1200)), 0, 255).astype(np.uint8)
+    assert layout.segment_page(gray) == []
+    assert ink_ratio(Image.fromarray(gray)) < DEFAULT_BLANK_THRESHOLD
+
+
+def test_text_page_is_not_blank():
+    gray = blank_page()
+    draw_paragraph(gray, 60, 250, 8)
+    assert ink_ratio(Image.fromarray(gray)) > DEFAULT_BLANK_THRESHOLD
+
+
+def test_cursive_strokes_are_handwriting():
+    gray = blank_page()
+    xs = np.arange(100, 1000)
+    for line in range(3):
+        ys = (300 + line * 80 + 15 * np.sin(xs / 9) + 8 * np.sin(xs / 23)).astype(np.int32)
+        cv2.polylines(gray, [np.stack([xs, ys], axis=1)], False, 0, 2)
+
+    blocks = layout.segment_page(gray)
+    assert blocks
+    assert all(block["kind"] == "handwriting" for block in blocks)
+
+
+def test_is_handwriting_votes():
+    printed = {"components": 40, "aspect": 0.7, "fill": 0.5, "height_cv": 0.2}
+    assert not layout.is_handwriting(printed)
+    assert layout.is_handwriting({**printed, "aspect": 2.0, "fill": 0.15})
+    # Un solo rasgo no basta
+    assert not layout.is_handwriting({**printed, "height_cv": 0.6})
@@ -0,0 +1,70 @@
+"""
+Pruebas de la vuelta de las cajas de palabras a la imagen original tras el
+preprocesado (enderezado y reducción).
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import boxes_to_original, preprocess_image  # noqa: E402
+
+
+def words_table(*boxes):
+    return {'text': ['x'] * len(boxes),
+            'left': [box[0] for box in boxes], 'top': [box[1] for box in boxes],
+            'width': [box[2] for box in boxes], 'height': [box[3] for box in boxes]}
+
+
+def forward_box(box, transform):
+    """Caja que ocupa `box` (left, top, width, height) tras aplicar `transform`."""
+    left, top, width, height = box
+    corners = np.array([[left, top], [left + width, top], [left, top + height],
+                        [left + width, top + height]], dtype=np.float64)
+    mapped = cv2.transform(corners[None], np.asarray(transform))[0]
+    x0, y0 = mapped.min(axis=0)
+    x1, y1 = mapped.max(axis=0)
+    return round(x0), round(y0), round(x1 - x0), round(y1 - y0)
+
+
+def largest_ink_box(gray):
+    """Caja (left, top, width, height) de la mayor mancha de tinta."""
+    _, _, stats, _ = cv2.connectedComponentsWithStats((gray < 128).astype(np.uint8))
+    index = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    return tuple(int(v) for v in stats[index, :4])
+
+
+def test_no_transform_keeps_boxes():
+    words = words_table((10, 20, 30, 40))
+    assert boxes_to_original(words, None) == words_table((10, 20, 30, 40))
+
+
+def test_rotated_and_scaled_box_round_trips():
+    # Giro de 90 grados y reducción a la mitad: las cajas siguen alineadas
+    transform = cv2.getRotationMatrix2D((600, 800), 90, 0.5)
+    box = (500, 1250, 200, 100)
+    words = boxes_to_original(words_table(forward_box(box, transform)), transform)
+    for value, expected in zip((words['left'][0], words['top'][0], words['width'][0], words['height'][0]), box):
+        assert abs(value - expected) <= 1
+
+
+def test_deskewed_box_maps_back_to_skewed_page():
+    page = np.full((1600, 1200), 255, np.uint8)
+    for line in range(20):
+        cv2.putText(page, "lorem ipsum dolor sit amet consectetur", (80, 150 + line * 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+    cv2.rectangle(page, (500, 1250), (700, 1350), 0, -1)
+    skewed = cv2.warpAffine(page, cv2.getRotationMatrix2D((600, 800), -3, 1.0), (1200, 1600),
+                            borderValue=255)
+
+    processed, transform = preprocess_image(Image.fromarray(skewed), "deskew")
+    assert transform is not None
+    words = boxes_to_original(words_table(largest_ink_box(np.asarray(processed))), transform)
+
+    expected = largest_ink_box(skewed)
+    for value, wanted in zip((words['left'][0], words['top'][0], words['width'][0], words['height'][0]), expected):
+        assert abs(value - wanted) <= 1
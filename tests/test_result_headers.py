@@ -0,0 +1,90 @@
+"""
+Pruebas de las cabeceras condicionales y de rango de /result
+(api.parse_range y api.etag_matches).
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# api crea JOBS_DIR (y el almacén) al importarse
+os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="pdf2md-tests-"))
+
+import api  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+ETAG = '"0123abcd"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-", (0, 999)),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=990-2000", (990, 999)),
+    (" bytes = 10-19 ", (10, 19)),
+    # Sufijos: los últimos N bytes
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert api.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    # Varios rangos: se sirve el fichero completo
+    "bytes=0-9,20-29",
+    "bytes=0-9, -5",
+    # Otras unidades o sintaxis que no sabemos servir
+    "items=0-9",
+    "bytes=a-b",
+    "bytes=-",
+])
+def test_ranges_served_as_full_file(header):
+    assert api.parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=5000-6000", 1000),
+    ("bytes=20-10", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=0-", 0),
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(HTTPException) as error:
+        api.parse_range(header, size)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    ('"otro"', False),
+    ('"otro", ' + ETAG, True),
+    ('"otro","tambien"', False),
+    # Comparación débil: W/ no cuenta
+    ("W/" + ETAG, True),
+    ('W/"otro"', False),
+    ("*", True),
+    ('"otro", *', True),
+])
+def test_etag_matches(header, expected):
+    assert api.etag_matches(header, ETAG) is expected
+
+
+def test_weak_etag_on_the_server_side():
+    assert api.etag_matches(ETAG, "W/" + ETAG)
+
+
+def test_iter_file_serves_the_range(tmp_path):
+    path = tmp_path / "result.md"
+    path.write_bytes(bytes(range(256)) * 400)
+    first, last = api.parse_range("bytes=-70000", path.stat().st_size)
+    data = b"".join(api.iter_file(str(path), first, last - first + 1))
+    assert data == path.read_bytes()[-70000:]
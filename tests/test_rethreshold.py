@@ -0,0 +1,95 @@
+"""
+Regenerar el Markdown con otro umbral desde el fichero de palabras (JSON
+Lines con gzip) debe dar lo mismo que una pasada nueva de OCR con ese
+umbral. El renderizado y el OCR se sustituyen por tablas de palabras
+hechas a mano, de modo que no hacen falta poppler ni Tesseract.
+"""
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_pdf  # noqa: E402
+
+
+def table(*lines):
+    """Tabla de palabras con una línea por argumento: [(texto, confianza), ...]."""
+    words = {col: [] for col in process_pdf.WORD_COLUMNS}
+    for line_num, line in enumerate(lines, start=1):
+        for word_num, (text, conf) in enumerate(line, start=1):
+            values = {'text': text, 'conf': conf, 'block_num': 1, 'par_num': 1, 'line_num': line_num,
+                      'left': word_num * 50, 'top': line_num * 30, 'width': 40, 'height': 20}
+            for col in process_pdf.WORD_COLUMNS:
+                words[col].append(values.get(col, 0))
+    return words
+
+
+PAGE_WORDS = {
+    1: table([("Capítulo", 96), ("uno", 91)],
+             [("línea", 75), ("dudosa", 55)],
+             [("garabato", 30), ("ilegible", 20)]),
+    # Sólo pasa por el OCR con áreas (que obligan al modo 'ocr')
+    2: table([("Página", 97), ("con", 70), ("capa", 58)]),
+    3: table([("Año", 88), ("2024:", 65), ("€", 45)],
+             [("fin", 99)]),
+}
+TEXT_LAYER = {2: "Página con capa de texto"}
+AREAS = {"cabecera": (0, 0, 100, 40), "cuerpo": (0, 40, 100, 200)}
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    """PDF de tres páginas: la 2 con capa de texto y las demás con OCR."""
+    def iter_pdf_pages(input_pdf, dpi=300, batch_size=1, first_page=1, last_page=None,
+                       pages=None, area=None, grayscale=False):
+        for page_num in (pages if pages is not None else range(first_page, (last_page or 3) + 1)):
+            # La página (y el área) viajan en la propia imagen
+            img = Image.new('L', (10, 10), 255)
+            img.info['page'], img.info['area'] = page_num, area
+            yield page_num, img
+
+    def ocr_words(img, **kwargs):
+        words = PAGE_WORDS[img.info['page']]
+        if img.info['area'] == AREAS["cabecera"]:
+            words = table(*[[word] for word in zip(words['text'][:2], words['conf'][:2])])
+        return {col: list(values) for col, values in words.items()}
+
+    monkeypatch.setattr(process_pdf, "get_page_count", lambda input_pdf: 3)
+    monkeypatch.setattr(process_pdf, "extract_text_layer",
+                        lambda input_pdf, total_pages, mode='auto', log_callback=None:
+                        {} if mode == 'ocr' else dict(TEXT_LAYER))
+    monkeypatch.setattr(process_pdf, "iter_pdf_pages", iter_pdf_pages)
+    monkeypatch.setattr(process_pdf, "ocr_words", ocr_words)
+    return "documento.pdf"
+
+
+def convert(fake_pdf, output_md, conf_threshold, words_path=None, **kwargs):
+    process_pdf.process_pdf_to_markdown(fake_pdf, str(output_md), conf_threshold=conf_threshold,
+                                        words_path=str(words_path) if words_path else None,
+                                        preprocess='none', blank_threshold=0, layout=False, **kwargs)
+    return output_md.read_text(encoding='utf-8')
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"areas": AREAS}], ids=["pagina", "areas"])
+@pytest.mark.parametrize("first, second", [(60, 80), (80, 40), (60, 60)])
+def test_rebuild_matches_fresh_ocr(tmp_path, fake_pdf, kwargs, first, second):
+    words_path = tmp_path / "doc.words.jsonl.gz"
+    convert(fake_pdf, tmp_path / "first.md", first, words_path, **kwargs)
+
+    rebuilt = tmp_path / "rebuilt.md"
+    process_pdf.rebuild_markdown_from_words(str(words_path), str(rebuilt), conf_threshold=second)
+    fresh = convert(fake_pdf, tmp_path / "fresh.md", second, **kwargs)
+
+    assert rebuilt.read_text(encoding='utf-8') == fresh
+
+
+def test_threshold_changes_the_output(tmp_path, fake_pdf):
+    low = convert(fake_pdf, tmp_path / "low.md", 50)
+    high = convert(fake_pdf, tmp_path / "high.md", 80)
+    assert "línea dudosa" in low and "2024:" in low
+    assert "dudosa" not in high and "2024:" not in high
+    assert high.count("[texto manuscrito]") == 2
+    assert "Página con capa de texto" in high
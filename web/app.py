@@ -3,16 +3,32 @@ import uuid
 import httpx
 import time
 import json
+import asyncio
+import hashlib
 from urllib.parse import urljoin
 
+import aiofiles
+
 from fastapi import FastAPI, File, UploadFile, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from typing import Optional
 
+from upload_limits import MaxBodySizeMiddleware
+
 app = FastAPI()
 
+# Límite de tamaño de los PDF subidos y tamaño de bloque al copiarlos
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "500")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# El margen cubre las cabeceras multipart y el resto de campos del formulario
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE, paths=("/convert",))
+
 # Cargamos la plantilla
 templates = Jinja2Templates(directory="templates")
 
@@ -25,6 +41,96 @@ OCR_URL = os.getenv("OCR_URL", "http://transcriber:5001/process")
 STATUS_URL_BASE = os.getenv("STATUS_URL_BASE", "http://transcriber:5001/status/")
 RESULT_URL_BASE = os.getenv("RESULT_URL_BASE", "http://transcriber:5001/result/")
 LOGS_URL_BASE = os.getenv("LOGS_URL_BASE", "http://transcriber:5001/logs/")
+EVENTS_URL_BASE = os.getenv("EVENTS_URL_BASE", "http://transcriber:5001/events/")
+PAGES_URL_BASE = os.getenv("PAGES_URL_BASE", "http://transcriber:5001/pages/")
+
+# Cómo se entrega el PDF al transcriber:
+# - "http": se sube el fichero en la petición (comportamiento original)
+# - "path": UPLOAD_DIR está montado también en el transcriber y sólo se envía
+#   el nombre del fichero; si falla, se recurre a la subida HTTP
+SUBMIT_MODE = os.getenv("SUBMIT_MODE", "http")
+PATH_SUBMIT_URL = os.getenv("PATH_SUBMIT_URL", "http://transcriber:5001/process_path")
+
+# Cliente HTTP compartido hacia el transcriber: las conexiones se mantienen
+# abiertas (keep-alive) y se reutilizan entre peticiones y pestañas
+TRANSCRIBER_MAX_CONNECTIONS = int(os.getenv("TRANSCRIBER_MAX_CONNECTIONS", "100"))
+TRANSCRIBER_MAX_KEEPALIVE = int(os.getenv("TRANSCRIBER_MAX_KEEPALIVE", "20"))
+TRANSCRIBER_KEEPALIVE_EXPIRY = float(os.getenv("TRANSCRIBER_KEEPALIVE_EXPIRY", "60"))
+TRANSCRIBER_CONNECT_TIMEOUT = float(os.getenv("TRANSCRIBER_CONNECT_TIMEOUT", "5"))
+TRANSCRIBER_TIMEOUT = float(os.getenv("TRANSCRIBER_TIMEOUT", "10"))
+# Las subidas de PDF grandes necesitan más margen que las consultas
+TRANSCRIBER_UPLOAD_TIMEOUT = float(os.getenv("TRANSCRIBER_UPLOAD_TIMEOUT", "30"))
+# Los flujos de eventos ocupan una conexión durante todo el trabajo: van en un
+# pool aparte para no agotar el de las consultas normales
+TRANSCRIBER_MAX_STREAMS = int(os.getenv("TRANSCRIBER_MAX_STREAMS", "1000"))
+
+http_client: Optional[httpx.AsyncClient] = None
+stream_client: Optional[httpx.AsyncClient] = None
+
+# Contadores del proxy: peticiones enviadas frente a conexiones TCP abiertas
+proxy_metrics = {
+    "requests": 0,
+    "connections_opened": 0,
+    "errors": 0
+}
+
+async def trace_connections(event_name: str, info: dict):
+    """Cuenta las conexiones nuevas que abre el pool (evento de traza de httpcore)."""
+    if event_name == "connection.connect_tcp.complete":
+        proxy_metrics["connections_opened"] += 1
+
+async def count_request(request: httpx.Request):
+    proxy_metrics["requests"] += 1
+    request.extensions["trace"] = trace_connections
+
+async def count_response(response: httpx.Response):
+    if response.status_code >= 500:
+        proxy_metrics["errors"] += 1
+
+class ProxyMetricsCollector:
+    """Expone en /metrics los contadores del proxy y el estado de la web, leídos al momento."""
+    def collect(self):
+        yield CounterMetricFamily("pdf2md_web_transcriber_requests", "Peticiones enviadas al transcriber",
+                                  value=proxy_metrics["requests"])
+        yield CounterMetricFamily("pdf2md_web_transcriber_connections_opened",
+                                  "Conexiones TCP abiertas hacia el transcriber",
+                                  value=proxy_metrics["connections_opened"])
+        yield CounterMetricFamily("pdf2md_web_transcriber_errors", "Respuestas 5xx del transcriber",
+                                  value=proxy_metrics["errors"])
+        yield GaugeMetricFamily("pdf2md_web_active_jobs", "Trabajos en seguimiento por la web",
+                                value=len(active_jobs))
+        yield GaugeMetricFamily("pdf2md_web_uploads_in_progress", "PDF que se están recibiendo",
+                                value=len(uploads_in_progress))
+
+REGISTRY.register(ProxyMetricsCollector())
+
+@app.on_event("startup")
+async def start_http_client():
+    global http_client, stream_client
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(TRANSCRIBER_TIMEOUT, connect=TRANSCRIBER_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=TRANSCRIBER_MAX_CONNECTIONS,
+            max_keepalive_connections=TRANSCRIBER_MAX_KEEPALIVE,
+            keepalive_expiry=TRANSCRIBER_KEEPALIVE_EXPIRY
+        ),
+        event_hooks={"request": [count_request], "response": [count_response]}
+    )
+    # Sin tiempo máximo de lectura: el transcriber envía un keepalive periódico
+    stream_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(None, connect=TRANSCRIBER_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=TRANSCRIBER_MAX_STREAMS,
+                            max_keepalive_connections=TRANSCRIBER_MAX_KEEPALIVE,
+                            keepalive_expiry=TRANSCRIBER_KEEPALIVE_EXPIRY),
+        event_hooks={"request": [count_request], "response": [count_response]}
+    )
+
+@app.on_event("shutdown")
+async def close_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+    if stream_client is not None:
+        await stream_client.aclose()
 
 # Montamos el directorio de uploads para servir los .md
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
@@ -34,6 +140,148 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Diccionario para almacenar los trabajos en proceso
 active_jobs = {}
+# PDF que se están recibiendo ahora mismo (la retención no los toca)
+uploads_in_progress = set()
+
+# Retención de UPLOAD_DIR: antigüedad máxima y cuota total (0 desactiva cada límite)
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+UPLOAD_DIR_MAX_BYTES = int(os.getenv("UPLOAD_DIR_MAX_MB", "2048")) * 1024 * 1024
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "600"))  # segundos
+
+retention_stats = {
+    "runs": 0,
+    "last_run": None,
+    "last_removed_files": 0,
+    "last_reclaimed_bytes": 0,
+    "removed_files_total": 0,
+    "reclaimed_bytes_total": 0,
+    "usage_bytes": None
+}
+
+# Junto a cada PDF entregado por el volumen compartido se guarda el id de su
+# trabajo en `{pdf}.job`: así la retención sabe a qué trabajo preguntar
+# aunque la web se haya reiniciado y active_jobs esté vacío
+JOB_REF_SUFFIX = ".job"
+
+def save_job_ref(pdf_filename: str, job_id: str):
+    with open(os.path.join(UPLOAD_DIR, pdf_filename + JOB_REF_SUFFIX), "w") as f:
+        f.write(job_id)
+
+def load_job_ref(pdf_filename: str) -> Optional[str]:
+    """Id del trabajo que usa un PDF subido, o None si no se llegó a entregar por ruta."""
+    try:
+        with open(os.path.join(UPLOAD_DIR, pdf_filename + JOB_REF_SUFFIX)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def list_upload_files():
+    """
+    Ficheros de UPLOAD_DIR como (mtime, tamaño, nombre), del más antiguo al
+    más reciente. Las referencias `.job` no se listan: se borran con su PDF.
+    """
+    files = []
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file() and not entry.name.endswith(JOB_REF_SUFFIX):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.name))
+    files.sort()
+    return files
+
+def remove_upload_file(name: str) -> int:
+    """Borra un fichero de UPLOAD_DIR y devuelve los bytes liberados."""
+    path = os.path.join(UPLOAD_DIR, name)
+    try:
+        os.unlink(path + JOB_REF_SUFFIX)
+    except FileNotFoundError:
+        pass
+    try:
+        size = os.path.getsize(path)
+        os.unlink(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+async def pdf_in_use(name: str, pdf_jobs: dict) -> bool:
+    """
+    Indica si un PDF subido sigue haciendo falta: se está recibiendo o su
+    trabajo (leído por el transcriber desde el volumen compartido, también
+    al reintentarlo en otra réplica) no ha terminado todavía. El trabajo se
+    busca en active_jobs y, si la web se ha reiniciado, en su referencia.
+    """
+    if name in uploads_in_progress:
+        return True
+    job_id = pdf_jobs.get(name) or await run_in_threadpool(load_job_ref, name)
+    if not job_id:
+        # Nunca se entregó por ruta: el transcriber no lo lee
+        return False
+    try:
+        resp = await http_client.get(urljoin(STATUS_URL_BASE, job_id))
+        if resp.status_code == 404:
+            return False
+        resp.raise_for_status()
+        return resp.json().get("status") not in ("completed", "error")
+    except httpx.HTTPError:
+        # Ante la duda, no se borra
+        return True
+
+async def run_retention() -> dict:
+    """
+    Aplica la retención a UPLOAD_DIR: borra los ficheros más antiguos que
+    UPLOAD_RETENTION_HOURS y, si el directorio sigue por encima de
+    UPLOAD_DIR_MAX_BYTES, los usados hace más tiempo (la descarga de un .md
+    actualiza su fecha). Nunca borra PDF de trabajos que siguen en curso.
+    """
+    files = await run_in_threadpool(list_upload_files)
+    usage = sum(size for _, size, _ in files)
+    pdf_jobs = {info["pdf_filename"]: job_id for job_id, info in active_jobs.items()}
+    cutoff = time.time() - UPLOAD_RETENTION_HOURS * 3600
+    removed = 0
+    reclaimed = 0
+    
+    for mtime, size, name in files:
+        expired = UPLOAD_RETENTION_HOURS > 0 and mtime < cutoff
+        over_quota = UPLOAD_DIR_MAX_BYTES > 0 and usage > UPLOAD_DIR_MAX_BYTES
+        if not expired and not over_quota:
+            # Los siguientes son más recientes y ya estamos dentro de la cuota
+            break
+        if name.lower().endswith(".pdf") and await pdf_in_use(name, pdf_jobs):
+            continue
+        freed = await run_in_threadpool(remove_upload_file, name)
+        usage -= freed
+        reclaimed += freed
+        removed += 1
+    
+    # Olvidar los trabajos antiguos para que active_jobs no crezca sin límite
+    if UPLOAD_RETENTION_HOURS > 0:
+        for job_id in [j for j, info in active_jobs.items() if info["created_at"] < cutoff]:
+            if not os.path.exists(active_jobs[job_id]["pdf_path"]):
+                del active_jobs[job_id]
+    
+    retention_stats["runs"] += 1
+    retention_stats["last_run"] = time.time()
+    retention_stats["last_removed_files"] = removed
+    retention_stats["last_reclaimed_bytes"] = reclaimed
+    retention_stats["removed_files_total"] += removed
+    retention_stats["reclaimed_bytes_total"] += reclaimed
+    retention_stats["usage_bytes"] = usage
+    if removed:
+        print(f"Retención: {removed} ficheros eliminados, {reclaimed} bytes liberados, "
+              f"{usage} bytes en uso en {UPLOAD_DIR}")
+    return {"removed_files": removed, "reclaimed_bytes": reclaimed, "usage_bytes": usage}
+
+async def retention_loop():
+    while True:
+        try:
+            await run_retention()
+        except Exception as e:
+            print(f"Error en la retención de {UPLOAD_DIR}: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+@app.on_event("startup")
+async def start_retention():
+    if RETENTION_INTERVAL > 0 and (UPLOAD_RETENTION_HOURS > 0 or UPLOAD_DIR_MAX_BYTES > 0):
+        app.state.retention_task = asyncio.create_task(retention_loop())
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -46,6 +294,8 @@ async def convert(
     dpi: int = Form(300),
     conf_threshold: int = Form(60),
     lang: str = Form("spa"),
+    mode: str = Form("auto"),
+    adaptive: bool = Form(False),
     process_areas: bool = Form(False),
     area_left: Optional[int] = Form(0),
     area_top: Optional[int] = Form(0),
@@ -56,27 +306,95 @@ async def convert(
     original_filename = pdf.filename  # Guardar el nombre original del archivo
     pdf_filename = f"{uuid.uuid4()}.pdf"
     pdf_path = os.path.join(UPLOAD_DIR, pdf_filename)
-    with open(pdf_path, "wb") as f:
-        f.write(await pdf.read())
+    # Copia por bloques: nunca se tiene el PDF completo en memoria
+    size = 0
+    uploads_in_progress.add(pdf_filename)
+    try:
+        async with aiofiles.open(pdf_path, "wb") as f:
+            while chunk := await pdf.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+                await f.write(chunk)
+    except BaseException:
+        # Subida a medias (límite superado, error de E/S, cliente desconectado):
+        # la retención no toca lo que sigue en uploads_in_progress, se borra aquí
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+        uploads_in_progress.discard(pdf_filename)
+        raise
+    finally:
+        await pdf.close()
+    
+    try:
+        return await submit_pdf(request, pdf_path, pdf_filename, original_filename, params_from_form(
+            dpi, conf_threshold, lang, mode, adaptive, original_filename,
+            process_areas, area_left, area_top, area_right, area_bottom))
+    except Exception:
+        # El transcriber no ha creado el trabajo (error de red o respuesta de
+        # error): el PDF no se va a usar
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+        raise
+    finally:
+        uploads_in_progress.discard(pdf_filename)
 
-    # 2) Preparamos los parámetros adicionales
+def params_from_form(dpi, conf_threshold, lang, mode, adaptive, original_filename,
+                     process_areas, area_left, area_top, area_right, area_bottom) -> dict:
+    """Parámetros que se envían al transcriber a partir del formulario."""
     params = {
         "dpi": dpi,
         "conf_threshold": conf_threshold,
         "lang": lang,
+        "mode": mode,
+        "adaptive": adaptive,
         "original_filename": original_filename  # Añadimos el nombre original
     }
     
     # Añadir área si está habilitada
     if process_areas and area_right > 0 and area_bottom > 0:
         params["area"] = json.dumps([area_left, area_top, area_right, area_bottom])
+    return params
 
+async def submit_pdf(request: Request, pdf_path: str, pdf_filename: str,
+                     original_filename: str, params: dict):
+    """Envía al transcriber un PDF ya guardado en UPLOAD_DIR y redirige al seguimiento."""
     # 3) Enviamos el PDF al servicio OCR para iniciar el procesamiento
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        files = {"file": (pdf_filename, open(pdf_path, "rb"), "application/pdf")}
-        resp = await client.post(OCR_URL, files=files, data=params)
-        resp.raise_for_status()
-        data = resp.json()
+    resp = None
+    if SUBMIT_MODE == "path":
+        # Sólo viaja la referencia al fichero del volumen compartido
+        try:
+            resp = await http_client.post(PATH_SUBMIT_URL, data={**params, "pdf_ref": pdf_filename})
+            if resp.status_code >= 400 and resp.status_code not in (429, 503):
+                print(f"Entrega por volumen compartido rechazada ({resp.status_code}); se sube el PDF por HTTP")
+                resp = None
+        except httpx.HTTPError as e:
+            print(f"Entrega por volumen compartido fallida ({e}); se sube el PDF por HTTP")
+            resp = None
+    if resp is None:
+        # httpx envía el fichero abierto por bloques; el `with` garantiza que se cierra
+        with open(pdf_path, "rb") as pdf_file:
+            files = {"file": (pdf_filename, pdf_file, "application/pdf")}
+            resp = await http_client.post(OCR_URL, files=files, data=params,
+                                          timeout=httpx.Timeout(TRANSCRIBER_UPLOAD_TIMEOUT, connect=TRANSCRIBER_CONNECT_TIMEOUT))
+        # El transcriber tiene ya su propia copia: la nuestra sobra
+        os.unlink(pdf_path)
+    if resp.status_code in (429, 503):
+        # El trabajo no se ha creado: el PDF no se va a usar
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+        # El transcriber está saturado: avisamos al usuario en lugar de fallar
+        retry_after = resp.headers.get("Retry-After", "unos")
+        return templates.TemplateResponse(
+            "error.html",
+            {
+                "request": request,
+                "error": f"El servicio está ocupado procesando otros documentos. Inténtelo de nuevo en {retry_after} segundos"
+            },
+            status_code=resp.status_code
+        )
+    resp.raise_for_status()
+    data = resp.json()
     
     # 4) Guardamos el ID del trabajo y redirigimos a la página de seguimiento
     job_id = data.get("job_id")
@@ -88,6 +406,9 @@ async def convert(
                 "error": "No se pudo iniciar el procesamiento"
             }
         )
+    if os.path.exists(pdf_path):
+        # Entregado por ruta: el transcriber lo leerá del volumen compartido
+        await run_in_threadpool(save_job_ref, pdf_filename, job_id)
     
     # Guardar en el diccionario de trabajos activos
     active_jobs[job_id] = {
@@ -114,17 +435,49 @@ async def track_job(request: Request, job_id: str):
     )
 
 @app.get("/api/status/{job_id}")
-async def get_job_status(job_id: str):
-    """Endpoint para que el frontend consulte el estado del trabajo."""
+async def get_job_status(job_id: str, request: Request):
+    """
+    Endpoint para que el frontend consulte el estado del trabajo. Reenvía
+    If-None-Match y el ETag del transcriber, de modo que si nada ha cambiado
+    la respuesta es un 304 sin cuerpo.
+    """
     try:
         status_url = urljoin(STATUS_URL_BASE, job_id)
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(status_url)
-            resp.raise_for_status()
-            return resp.json()
+        headers = {}
+        if request.headers.get("if-none-match"):
+            headers["If-None-Match"] = request.headers["if-none-match"]
+        resp = await http_client.get(status_url, headers=headers)
+        cache_headers = {k: resp.headers[k] for k in ("ETag", "Cache-Control") if k in resp.headers}
+        if resp.status_code == 304:
+            return Response(status_code=304, headers=cache_headers)
+        resp.raise_for_status()
+        return JSONResponse(resp.json(), headers=cache_headers)
     except httpx.HTTPError as e:
         return {"status": "error", "message": f"Error al consultar el estado: {str(e)}"}
 
+@app.get("/api/events/{job_id}")
+async def proxy_job_events(job_id: str):
+    """Reenvía al navegador el flujo de eventos (SSE) del trabajo según llega del transcriber."""
+    events_url = urljoin(EVENTS_URL_BASE, job_id)
+    
+    async def relay():
+        try:
+            async with stream_client.stream("GET", events_url) as resp:
+                if resp.status_code != 200:
+                    yield f"event: failure\ndata: {json.dumps({'status_code': resp.status_code})}\n\n"
+                    return
+                async for chunk in resp.aiter_raw():
+                    yield chunk
+        except httpx.HTTPError as e:
+            # El navegador recurrirá a la consulta periódica del estado
+            yield f"event: failure\ndata: {json.dumps({'error': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/logs/{job_id}")
 async def proxy_job_logs(job_id: str, last_n: int = None):
     """Endpoint para que el frontend consulte los logs del trabajo."""
@@ -134,35 +487,66 @@ async def proxy_job_logs(job_id: str, last_n: int = None):
         if last_n is not None:
             params["last_n"] = last_n
             
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(logs_url, params=params)
-            resp.raise_for_status()
-            return resp.json()
+        resp = await http_client.get(logs_url, params=params)
+        resp.raise_for_status()
+        return resp.json()
     except httpx.HTTPError as e:
         return {"logs": [], "error": f"Error al consultar logs: {str(e)}"}
 
+@app.get("/api/pages/{job_id}")
+async def proxy_job_pages(job_id: str, first: int = 1, last: Optional[int] = None):
+    """Páginas ya terminadas del trabajo, para mostrarlas mientras se procesan las demás."""
+    try:
+        params = {"first": first}
+        if last is not None:
+            params["last"] = last
+        resp = await http_client.get(urljoin(PAGES_URL_BASE, job_id), params=params)
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.HTTPError as e:
+        return {"pages": [], "error": f"Error al consultar las páginas: {str(e)}"}
+
+@app.get("/api/proxy_metrics")
+async def get_proxy_metrics():
+    """Métricas del cliente hacia el transcriber: cuántas peticiones reutilizan conexión."""
+    requests_sent = proxy_metrics["requests"]
+    opened = proxy_metrics["connections_opened"]
+    reused = max(0, requests_sent - opened)
+    return {
+        **proxy_metrics,
+        "requests_reusing_connection": reused,
+        "reuse_ratio": round(reused / requests_sent, 3) if requests_sent else None,
+        "limits": {
+            "max_connections": TRANSCRIBER_MAX_CONNECTIONS,
+            "max_keepalive_connections": TRANSCRIBER_MAX_KEEPALIVE,
+            "keepalive_expiry": TRANSCRIBER_KEEPALIVE_EXPIRY
+        },
+        "timeouts": {
+            "connect": TRANSCRIBER_CONNECT_TIMEOUT,
+            "request": TRANSCRIBER_TIMEOUT,
+            "upload": TRANSCRIBER_UPLOAD_TIMEOUT
+        }
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas de la web (contadores del proxy) en el formato de Prometheus."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/result/{job_id}", response_class=HTMLResponse)
 async def show_result(request: Request, job_id: str):
     """Muestra la página de resultado cuando el trabajo está completo."""
     try:
         # Verificar estado del trabajo
         status_url = urljoin(STATUS_URL_BASE, job_id)
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            status_resp = await client.get(status_url)
-            status_resp.raise_for_status()
-            job_data = status_resp.json()
+        status_resp = await http_client.get(status_url)
+        status_resp.raise_for_status()
+        job_data = status_resp.json()
         
         if job_data.get("status") != "completed":
             # Si no está completo, redirigir a la página de seguimiento
             return RedirectResponse(url=f"/track/{job_id}")
         
-        # Si está completo, obtener el resultado
-        result_url = urljoin(RESULT_URL_BASE, job_id)
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            result_resp = await client.get(result_url)
-            result_resp.raise_for_status()
-            md_text = result_resp.text
-        
         # Obtener parámetros utilizados (si están disponibles)
         params = job_data.get("params", {
             "dpi": 300,
@@ -188,10 +572,17 @@ async def show_result(request: Request, job_id: str):
             # Si no tenemos el nombre original, usamos el ID del trabajo
             md_filename = f"{job_id}.md"
         
-        # Guardar el markdown en disco para poder descargarlo luego
+        # Si está completo, obtener el resultado: de la copia local si ya la
+        # guardamos en una visita anterior (misma huella) y, si no, del
+        # transcriber, guardándolo en disco para poder descargarlo luego
         md_path = os.path.join(UPLOAD_DIR, md_filename)
-        with open(md_path, "w", encoding="utf-8") as f:
-            f.write(md_text)
+        md_text = await run_in_threadpool(read_cached_markdown, md_path, job_data.get("result_sha256"))
+        if md_text is None:
+            result_url = urljoin(RESULT_URL_BASE, job_id)
+            result_resp = await http_client.get(result_url)
+            result_resp.raise_for_status()
+            await run_in_threadpool(write_markdown, md_path, result_resp.content)
+            md_text = result_resp.text
         
         # Renderizar plantilla de resultado
         return templates.TemplateResponse(
@@ -214,6 +605,33 @@ async def show_result(request: Request, job_id: str):
             }
         )
 
+def read_cached_markdown(md_path: str, sha256: Optional[str]) -> Optional[str]:
+    """Devuelve la copia local del Markdown si existe y coincide con `sha256`."""
+    if not sha256 or not os.path.exists(md_path):
+        return None
+    with open(md_path, "rb") as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != sha256:
+        return None
+    return data.decode("utf-8")
+
+def write_markdown(md_path: str, data: bytes):
+    """Escribe el Markdown con un rename atómico para no servir nunca un fichero a medias."""
+    tmp_path = f"{md_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, md_path)
+
+@app.get("/api/retention")
+async def get_retention_stats():
+    """Bytes liberados por la retención, uso actual de UPLOAD_DIR y límites configurados."""
+    return {
+        **retention_stats,
+        "max_age_hours": UPLOAD_RETENTION_HOURS,
+        "max_bytes": UPLOAD_DIR_MAX_BYTES,
+        "interval": RETENTION_INTERVAL
+    }
+
 @app.get("/download/{md_filename}")
 async def download(md_filename: str):
     """Endpoint para descargar el archivo Markdown."""
@@ -221,6 +639,9 @@ async def download(md_filename: str):
     if not os.path.exists(md_path):
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     
+    # La fecha de modificación hace de última descarga para la retención por cuota
+    os.utime(md_path)
+    
     # Usar el parámetro 'attachment' para forzar la descarga en lugar de mostrar en el navegador
     return FileResponse(
         md_path,
@@ -0,0 +1,42 @@
+"""
+Límite de tamaño de las subidas, común a la web (web/app.py) y al
+transcriber (api.py lo importa como web.upload_limits). Está en web/ para que
+exista también cuando docker-compose monta ./web sobre /app en el contenedor
+de la web.
+"""
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class MaxBodySizeMiddleware:
+    """
+    Rechaza con 413 las subidas que superan `max_bytes` mientras llegan: por
+    Content-Length si viene en la cabecera y, si no, contando los bytes del
+    cuerpo según se reciben, sin esperar a tener el fichero completo.
+    """
+    def __init__(self, app, max_bytes: int, paths: tuple):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": "El archivo supera el tamaño máximo permitido"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+            return message
+
+        await self.app(scope, limited_receive, send)